@@ -0,0 +1,92 @@
+"""
+A micro-benchmark of the sunburst builder against the number of items.
+
+It compares site.build_sunburst with the linear child scan it replaced.
+
+Usage:
+    python -m benchmarks.bench_breakdown
+"""
+
+import functools
+import timeit
+from typing import Any, Dict, List, Tuple
+
+from coa_flask_app import site
+
+
+def linear_sunburst(result: List[Tuple[int, str, str, str, int]]) -> Dict[str, Any]:
+    """
+    The sunburst builder as it was, scanning the children for every row.
+
+    Args:
+        result: The rows returned by item_breakdown.
+
+    Returns:
+        A json breakdown of the debris.
+    """
+    def get_child(name, children):
+        for index, child in enumerate(children):
+            if child['name'] == name:
+                return index
+        return -1
+
+    sunburst_data: Dict[str, Any] = {'name': 'Debris', 'children': []}
+    for _, item_name, category_name, material_name, count in result:
+        material_idx = get_child(material_name, sunburst_data['children'])
+        if material_idx < 0:
+            sunburst_data['children'].append(
+                {'name': material_name, 'children': []})
+            material_idx = len(sunburst_data['children']) - 1
+
+        material = sunburst_data['children'][material_idx]
+        category_idx = get_child(category_name, material['children'])
+        if category_idx < 0:
+            material['children'].append({'name': category_name, 'children': []})
+            category_idx = len(material['children']) - 1
+
+        material['children'][category_idx]['children'].append(
+            {'name': item_name, 'count': count})
+
+    return sunburst_data
+
+
+def make_rows(items: int) -> List[Tuple[int, str, str, str, int]]:
+    """
+    Makes item breakdown rows spread over a growing number of
+    materials and categories.
+
+    Args:
+        items: The number of items.
+
+    Returns:
+        The rows of item id, item name, category, material, quantity.
+    """
+    materials = max(items // 20, 1)
+    categories = max(items // 4, 1)
+    return [(i,
+             f'item {i}',
+             f'category {i % categories}',
+             f'material {i % categories % materials}',
+             i * 7 % 101)
+            for i in range(items)]
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the timings.
+    """
+    print(f'{"items":>8} {"linear ms":>12} {"indexed ms":>12} {"speedup":>8}')
+    for items in (100, 500, 1000, 5000, 20000):
+        rows = make_rows(items)
+        assert linear_sunburst(rows) == site.build_sunburst(rows)
+        runs = max(20000 // items, 3)
+        linear = timeit.timeit(functools.partial(linear_sunburst, rows),
+                               number=runs) / runs
+        indexed = timeit.timeit(functools.partial(site.build_sunburst, rows),
+                                number=runs) / runs
+        print(f'{items:>8} {linear * 1000:>12.3f} {indexed * 1000:>12.3f} '
+              f'{linear / indexed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
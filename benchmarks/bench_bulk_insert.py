@@ -0,0 +1,79 @@
+"""
+A benchmark of the bulk contribution ingestion.
+
+It always measures the validation rate, and with --insert it also inserts
+the records into the database configured by the DB_* environment
+variables and reports the sustained rows per second.
+
+Usage:
+    python -m benchmarks.bench_bulk_insert [--records N] [--items N] [--insert]
+"""
+
+import argparse
+import random
+import time
+from typing import Any, Dict, List
+
+from coa_flask_app import contribution
+
+
+def make_records(records: int, items: int) -> List[Dict[str, Any]]:
+    """
+    Makes contribution records shaped like a big cleanup event.
+
+    Args:
+        records: The number of team records.
+        items: The number of item lines per record.
+
+    Returns:
+        The contribution records.
+    """
+    rand = random.Random(0)
+    return [{
+        'siteId': rand.randint(1, 50),
+        'volunteerDate': '2019-04-27',
+        'teamCaptain': f'Captain {i}',
+        'numOfPeople': rand.randint(1, 10),
+        'numOfTrashbags': rand.randint(0, 5),
+        'trashWeight': rand.random() * 20,
+        'walkingDistance': rand.random() * 2,
+        'updatedBy': 'benchmark',
+        'eventCode': 'BENCH',
+        'items': [{'itemId': rand.randint(1, 100),
+                   'quantity': rand.randint(1, 40),
+                   'brand': ''}
+                  for _ in range(items)]
+    } for i in range(records)]
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the rates.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=500)
+    parser.add_argument('--items', type=int, default=30)
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--insert', action='store_true',
+                        help='Insert into the configured database')
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.items)
+    rows = args.records * (args.items + 1)
+
+    started = time.perf_counter()
+    for record in records:
+        contribution.validate_contribution(record)
+    elapsed = time.perf_counter() - started
+    print(f'validated {rows} rows in {elapsed:.3f}s, {rows / elapsed:,.0f} rows/sec')
+
+    if args.insert:
+        outcome = contribution.insert_contributions(records,
+                                                    chunk_size=args.chunk_size)
+        print(f'inserted {outcome["rows"]} rows in {outcome["seconds"]:.3f}s, '
+              f'{outcome["rowsPerSecond"]:,.0f} rows/sec, '
+              f'{outcome["failed"]} records failed')
+
+
+if __name__ == '__main__':
+    main()
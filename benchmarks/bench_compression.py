@@ -0,0 +1,91 @@
+"""
+A micro-benchmark of the bytes on the wire and the CPU per request of the
+response compression.
+
+It compares sending the plain body, compressing on every request, and
+negotiating between the variants compressed once per data version, for
+the locations hierarchy, trash items and breakdown payloads.
+
+Usage:
+    python -m benchmarks.bench_compression
+"""
+
+import gzip
+import time
+from typing import Any, Callable, Dict
+
+from flask import Flask, request
+
+from benchmarks import bench_breakdown, bench_json
+from coa_flask_app import compression, fast_json, site
+
+
+def cpu_per_call(func: Callable[[], Any], iterations: int) -> float:
+    """
+    Measures the CPU time of a function.
+
+    Args:
+        func: The function.
+        iterations: The number of calls.
+
+    Returns:
+        The CPU time per call in microseconds.
+    """
+    started = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def respond(app: Flask, accept: str, body: bytes, variants: Dict[str, bytes]) -> Any:
+    """
+    Builds the response of a request accepting some encodings.
+
+    Args:
+        app: The Flask app.
+        accept: The Accept-Encoding of the request, empty for none.
+        body: The plain body.
+        variants: The compressed bodies by encoding.
+
+    Returns:
+        The response and its encoding.
+    """
+    headers = {'Accept-Encoding': accept} if accept else {}
+    with app.test_request_context(headers=headers):
+        return compression.encoded_response(body, variants, 'application/json',
+                                            request.accept_encodings)
+
+
+def main(iterations: int = 200) -> None:
+    """
+    Prints the body size and CPU per request of each strategy.
+
+    Args:
+        iterations: The number of requests per strategy.
+    """
+    app = Flask(__name__)
+    payloads = bench_json.make_payloads(counties=10, towns=20, sites=15, items=2000)
+    payloads.append(('breakdown', {'breakdown': site.build_sunburst(
+        bench_breakdown.make_rows(1000))}))
+    print(f'encodings: {", ".join(compression.ENCODINGS)}, '
+          f'threshold {compression.min_bytes()} bytes')
+
+    for name, payload in payloads:
+        body = fast_json.dumps(payload)
+        variants = compression.compress_all(body)
+        sizes = ', '.join(f'{encoding} {len(variant)}'
+                          for encoding, variant in variants.items())
+        print(f'{name}: plain {len(body)} bytes, {sizes}')
+
+        for label, func in (('plain', lambda body=body: respond(app, '', body, {})),
+                            ('gzip per request',
+                             lambda body=body: respond(app, 'gzip', body,
+                                                       {'gzip': gzip.compress(body, 6)})),
+                            ('pre-compressed',
+                             lambda body=body, variants=variants: respond(
+                                 app, 'gzip, br', body, variants))):
+            print(f'    {label:<18} {cpu_per_call(func, iterations):10.1f}us cpu')
+
+
+if __name__ == '__main__':
+    main()
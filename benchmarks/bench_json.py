@@ -0,0 +1,105 @@
+"""
+A micro-benchmark of the JSON response paths for the stable payloads.
+
+It compares jsonify, the fast encoder and the pre-serialized bytes on a
+locations hierarchy and a trash item list the size of a large deployment.
+
+Usage:
+    python -m benchmarks.bench_json
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from flask import Flask, jsonify
+
+from coa_flask_app import compression, fast_json
+
+
+def make_payloads(counties: int, towns: int, sites: int,
+                  items: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Makes the locations hierarchy and trash items payloads.
+
+    Args:
+        counties: The number of counties.
+        towns: The number of towns per county.
+        sites: The number of sites per town.
+        items: The number of trash items.
+
+    Returns:
+        The name and payload of each.
+    """
+    hierarchy = {
+        f'County {county}': {
+            f'Town {county}-{town}': [f'Site {county}-{town}-{site}'
+                                      for site in range(sites)]
+            for town in range(towns)
+        }
+        for county in range(counties)
+    }
+    trash_items = [(item, f'Material {item % 7}', f'Category {item % 23}',
+                    f'Item {item}') for item in range(items)]
+    return [('locationsHierarchy', {'locationsHierarchy': hierarchy}),
+            ('getTrashItems', {'getTrashItems': trash_items})]
+
+
+def jsonify_bytes(app: Flask, payload: Any) -> bytes:
+    """
+    Serializes a payload the way a plain jsonify response does.
+
+    Args:
+        app: The Flask app.
+        payload: The payload.
+
+    Returns:
+        The response body.
+    """
+    with app.test_request_context():
+        return jsonify(payload).get_data()
+
+
+def measure(func: Callable[[], Any], iterations: int) -> Tuple[float, float]:
+    """
+    Times a function.
+
+    Args:
+        func: The function.
+        iterations: The number of calls.
+
+    Returns:
+        The wall and CPU time per call in microseconds.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(iterations):
+        func()
+    return ((time.perf_counter() - wall) / iterations * 1e6,
+            (time.process_time() - cpu) / iterations * 1e6)
+
+
+def main(iterations: int = 200) -> None:
+    """
+    Prints the time per response of each path and the body sizes.
+
+    Args:
+        iterations: The number of calls of each path.
+    """
+    app = Flask(__name__)
+    print(f'fast encoder: {"orjson" if fast_json.orjson else "json"}')
+    for name, payload in make_payloads(counties=10, towns=20, sites=15, items=2000):
+        body = fast_json.dumps(payload)
+        variants = compression.compress_all(body)
+
+        print(f'{name}: {len(body)} bytes, gzip {len(variants["gzip"])} bytes')
+        for label, func in (('jsonify', lambda payload=payload: jsonify_bytes(app, payload)),
+                            ('fast dumps', lambda payload=payload: fast_json.dumps(payload)),
+                            ('fast dumps + gzip',
+                             lambda payload=payload: compression.compress_all(
+                                 fast_json.dumps(payload))),
+                            ('pre-serialized', lambda variants=variants: variants['gzip'])):
+            wall, cpu = measure(func, iterations)
+            print(f'    {label:<18} {wall:10.1f}us wall {cpu:10.1f}us cpu')
+
+
+if __name__ == '__main__':
+    main()
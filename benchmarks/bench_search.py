@@ -0,0 +1,111 @@
+"""
+A micro-benchmark of the location search index against a linear scan.
+
+Usage:
+    python -m benchmarks.bench_search
+"""
+
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from coa_flask_app import search
+
+
+STREETS = ('Ocean', 'Beach', 'Harbor', 'Bay', 'Main', 'Park', 'River', 'Pier',
+           'Lighthouse', 'Boardwalk', 'Inlet', 'Dune', 'Marina', 'Cove')
+SUFFIXES = ('Ave', 'St', 'Park', 'Beach', 'Point', 'Landing')
+
+
+def make_locations(counties: int, towns: int, sites: int,
+                   seed: int = 7) -> List[Tuple[str, str, str]]:
+    """
+    Makes site, town and county names with shared words, like real ones.
+
+    Args:
+        counties: The number of counties.
+        towns: The number of towns per county.
+        sites: The number of sites per town.
+        seed: The random seed.
+
+    Returns:
+        The site, town and county of each site.
+    """
+    rng = random.Random(seed)
+    locations = []
+    for county in range(counties):
+        county_name = f'{rng.choice(STREETS)} County {county}'
+        for town in range(towns):
+            town_name = f'{rng.choice(STREETS)} {rng.choice(STREETS)} {county}-{town}'
+            for site in range(sites):
+                locations.append((f'{rng.choice(STREETS)} {rng.choice(SUFFIXES)} {site}',
+                                  town_name, county_name))
+    return locations
+
+
+def linear_search(locations: List[Tuple[str, str, str]], query: str,
+                  limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Searches by scanning every location, matching words like the index.
+
+    Args:
+        locations: The site, town and county of each site.
+        query: The query.
+        limit: The max number of results.
+
+    Returns:
+        The matching sites.
+    """
+    words = search.normalize(query)
+    matches = []
+    for site_name, town, county in locations:
+        name_words = search.normalize(site_name)
+        if all(any(name_word.startswith(word)
+                   or search.edit_distance(word, name_word, search.max_typos(word))
+                   <= search.max_typos(word)
+                   for name_word in name_words)
+               for word in words):
+            matches.append({'locationName': site_name, 'town': town, 'county': county})
+    return sorted(matches, key=lambda match: match['locationName'])[:limit]
+
+
+def measure(func: Any, queries: List[str], repeat: int) -> float:
+    """
+    Times a search function over some queries.
+
+    Returns:
+        The time per query in microseconds.
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            func(query)
+    return (time.perf_counter() - started) / (repeat * len(queries)) * 1e6
+
+
+def main() -> None:
+    """
+    Prints the time per query of the index and the linear scan.
+    """
+    queries = ['oce', 'ocean ave', 'harbr', 'lighthuose', 'bay st 3', 'marina',
+               'boardwalk landing 1', 'zzz']
+    for counties, towns, sites in ((5, 10, 10), (20, 25, 20)):
+        locations = make_locations(counties, towns, sites)
+        started = time.perf_counter()
+        index = search.LocationIndex()
+        index.add(locations[:-sites])
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        index.add(locations)
+        added = time.perf_counter() - started
+
+        print(f'{len(locations)} sites: built in {built * 1000:.1f}ms, '
+              f'added {sites} sites in {added * 1000:.2f}ms')
+        print(f'    index  {measure(index.search, queries, 20):10.1f}us per query')
+        linear = measure(lambda query, locations=locations: linear_search(locations, query),
+                         queries, 1)
+        print(f'    linear {linear:10.1f}us per query')
+
+
+if __name__ == '__main__':
+    main()
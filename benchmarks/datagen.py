@@ -0,0 +1,195 @@
+"""
+A synthetic data generator for the local SQLite stand-in.
+
+Usage:
+    python -m benchmarks.datagen PATH [--counties N] [--towns N] [--sites N]
+                                      [--items N] [--years N] [--teams N]
+                                      [--lines N]
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+from coa_flask_app import contribution, local_db
+
+
+MATERIALS = ('Plastic', 'Glass', 'Metal', 'Paper', 'Wood', 'Cloth', 'Rubber')
+BRANDS = ('Brand A', 'Brand B', 'Brand C', 'Brand D', 'Brand E', 'Brand F')
+
+# The default size of the generated database, also the options of the suite.
+SIZES = {'counties': 3, 'towns': 5, 'sites': 4, 'items': 150, 'years': 5,
+         'teams': 12, 'lines': 25}
+
+
+def generate(path: str,
+             counties: int = 3,
+             towns: int = 5,
+             sites: int = 4,
+             items: int = 150,
+             years: int = 5,
+             teams: int = 12,
+             lines: int = 25,
+             seed: int = 0) -> Dict[str, Any]:
+    """
+    Writes a fresh synthetic database of volunteer records.
+
+    Args:
+        path: The database file, replaced if it exists.
+        counties: The number of counties.
+        towns: The number of towns per county.
+        sites: The number of sites per town.
+        items: The number of trash items.
+        years: The number of years of records, ending this year.
+        teams: The number of teams per site per year.
+        lines: The number of item lines per team.
+        seed: The random seed.
+
+    Returns:
+        The number of rows written to each table.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    rand = random.Random(seed)
+    connection = local_db.connect(path)
+    cursor = connection.cursor()
+
+    site_rows = _site_rows(counties, towns, sites)
+    cursor.executemany('INSERT INTO coa.site_info VALUES (%s, %s, %s, %s)',
+                       site_rows)
+
+    item_rows = [(item_id,
+                  MATERIALS[item_id % len(MATERIALS)],
+                  f'Category {item_id % 20}',
+                  f'Item {item_id}')
+                 for item_id in range(1, items + 1)]
+    cursor.executemany('INSERT INTO coa.item VALUES (%s, %s, %s, %s)', item_rows)
+
+    team_count = _write_teams(cursor, rand, site_rows, item_rows, years, teams, lines)
+
+    connection.commit()
+    connection.close()
+    return {'sites': len(site_rows), 'items': items, 'teams': team_count,
+            'lines': team_count * lines}
+
+
+def _site_rows(counties: int, towns: int, sites: int) -> List[Tuple[int, str, str, str]]:
+    """
+    Builds the site rows, numbered through every town of every county.
+
+    Args:
+        counties: The number of counties.
+        towns: The number of towns per county.
+        sites: The number of sites per town.
+
+    Returns:
+        The site id, site name, town and county of every site.
+    """
+    site_rows: List[Tuple[int, str, str, str]] = []
+    for county in range(counties):
+        for town in range(towns):
+            for site in range(sites):
+                site_rows.append((len(site_rows) + 1,
+                                  f'Site {county}-{town}-{site}',
+                                  f'Town {county}-{town}',
+                                  f'County {county}'))
+    return site_rows
+
+
+def _write_teams(cursor: Any,
+                 rand: random.Random,
+                 site_rows: List[Tuple[int, str, str, str]],
+                 item_rows: List[Tuple[int, str, str, str]],
+                 years: int,
+                 teams: int,
+                 lines: int) -> int:
+    """
+    Writes the teams of every site and year with their item lines.
+
+    Args:
+        cursor: The cursor to write with.
+        rand: The random generator.
+        site_rows: The sites.
+        item_rows: The items.
+        years: The number of years of records, ending this year.
+        teams: The number of teams per site per year.
+        lines: The number of item lines per team.
+
+    Returns:
+        The number of teams written.
+    """
+    first_day = date(date.today().year - years + 1, 1, 1)
+    # Popular items are picked far more often, like the real dirty dozen.
+    weights = [1 / rank for rank in range(1, len(item_rows) + 1)]
+    team_count = 0
+    for site_id, *_ in site_rows:
+        for year in range(years):
+            for _ in range(teams):
+                day = first_day.replace(year=first_day.year + year) + \
+                    timedelta(days=rand.randrange(365))
+                _write_team(cursor, rand, site_id, day, item_rows, weights, lines)
+                team_count += 1
+    return team_count
+
+
+def _write_team(cursor: Any,
+                rand: random.Random,
+                site_id: int,
+                day: date,
+                item_rows: List[Tuple[int, str, str, str]],
+                weights: List[float],
+                lines: int) -> None:
+    """
+    Writes one team and its item lines.
+
+    Args:
+        cursor: The cursor to write with.
+        rand: The random generator.
+        site_id: The site of the team.
+        day: The volunteer date.
+        item_rows: The items.
+        weights: The weight of each item to be picked.
+        lines: The number of item lines.
+    """
+    cursor.execute(contribution.TEAM_QUERY,
+                   (site_id, day, f'Captain {rand.randrange(500)}',
+                    rand.randint(1, 12), rand.randint(0, 6),
+                    round(rand.random() * 30, 1),
+                    round(rand.random() * 3, 2), 'datagen'))
+    team_id = cursor.lastrowid
+    picked = rand.choices(item_rows, weights=weights, k=lines)
+    cursor.executemany(contribution.VOLUNTEER_QUERY,
+                       [(team_id, item[0], rand.randint(1, 60),
+                         rand.choice(BRANDS) if rand.random() < 0.3 else '',
+                         'datagen', 'GEN')
+                        for item in picked])
+
+
+def add_size_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds an option for every size of the generated database.
+
+    Args:
+        parser: The parser to add the options to.
+    """
+    for name, default in SIZES.items():
+        parser.add_argument(f'--{name}', type=int, default=default)
+
+
+def main() -> None:
+    """
+    The command line entry of the generator.
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic database.')
+    parser.add_argument('path')
+    add_size_arguments(parser)
+    parser.add_argument('--seed', type=int, default=0)
+    args = vars(parser.parse_args())
+    print(generate(args.pop('path'), **args))
+
+
+if __name__ == '__main__':
+    main()
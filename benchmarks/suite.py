@@ -0,0 +1,233 @@
+"""
+A reproducible benchmark and load test suite against the local stand-in.
+
+It generates a synthetic database (see benchmarks.datagen), microbenchmarks
+the site and contribution functions, then runs concurrent HTTP load against
+the Flask app. The results are written as JSON so runs can be compared.
+
+Usage:
+    python -m benchmarks.suite [--db PATH] [--out results.json]
+                               [--baseline old.json] [--skip-load]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import datagen
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Returns the nearest rank percentile of some samples.
+
+    Args:
+        samples: The samples.
+        fraction: The percentile as a fraction, 0.95 for p95.
+
+    Returns:
+        The percentile.
+    """
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples: List[float], elapsed: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Summarizes latency samples in milliseconds.
+
+    Args:
+        samples: The latencies in seconds.
+        elapsed: The wall time the samples were taken in, for throughput.
+
+    Returns:
+        The count, mean and percentiles, and the throughput if elapsed is given.
+    """
+    summary = {
+        'count': len(samples),
+        'meanMs': statistics.mean(samples) * 1000,
+        'p50Ms': percentile(samples, 0.50) * 1000,
+        'p95Ms': percentile(samples, 0.95) * 1000,
+        'p99Ms': percentile(samples, 0.99) * 1000
+    }
+    if elapsed:
+        summary['throughputPerSec'] = len(samples) / elapsed
+    return summary
+
+
+def microbenchmarks(iterations: int) -> Dict[str, Any]:
+    """
+    Times the site and contribution functions called directly.
+
+    The reference cache is dropped before every call so the database work
+    is measured, not the cache.
+
+    Args:
+        iterations: The number of calls of each function.
+
+    Returns:
+        The latency summary of each function.
+    """
+    # Imported here so the backend environment is set first.
+    from coa_flask_app import cache, contribution, site  # pylint: disable=import-outside-toplevel
+
+    location = ('town', 'Town 0-1', '2016-1-1', time.strftime('%Y-%m-%d'))
+    legacy_post = ('1#04/27/2019#Benchmark#3#1#2.5#0.5#bench----'
+                   'Plastic, Item 1[1]#12#brand#bench#BENCH||'
+                   'Glass, Item 2[2]#4##bench#BENCH||')
+    cases: List[Tuple[str, Callable[[], Any]]] = [
+        ('item_breakdown', lambda: site.item_breakdown(*location)),
+        ('breakdown', lambda: site.breakdown(*location)),
+        ('dirty_dozen', lambda: site.dirty_dozen(*location)),
+        ('dashboard', lambda: site.dashboard(*location)),
+        ('locations_hierarchy', site.locations_hierarchy),
+        ('insert_contribution', lambda: contribution.insert_contribution(legacy_post))
+    ]
+
+    results = {}
+    for name, func in cases:
+        samples = []
+        for _ in range(iterations):
+            cache.invalidate()
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+        print(f'{name:<22} p50 {results[name]["p50Ms"]:8.2f}ms '
+              f'p99 {results[name]["p99Ms"]:8.2f}ms')
+
+    return results
+
+
+def load_test(requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Runs concurrent HTTP requests against the app on a local server.
+
+    Args:
+        requests: The number of requests per route.
+        concurrency: The number of concurrent clients.
+
+    Returns:
+        The latency and throughput summary of each route.
+    """
+    # Imported here so the backend environment is set first.
+    from werkzeug.serving import WSGIRequestHandler, make_server  # pylint: disable=import-outside-toplevel
+    from coa_flask_app import APP  # pylint: disable=import-outside-toplevel
+
+    class QuietHandler(WSGIRequestHandler):
+        """
+        A request handler that doesn't log every request.
+        """
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, APP, threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    routes = [
+        '/dirtydozen?locationCategory=site&locationName=Site%200-1-2',
+        '/breakdown?locationCategory=town&locationName=Town%200-1',
+        '/dashboard?locationCategory=county&locationName=County%200',
+        '/validdaterange?locationCategory=town&locationName=Town%200-1',
+        '/locationsHierarchy',
+        '/getTrashItems'
+    ]
+
+    def fetch(url: str) -> float:
+        started = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for route in routes:
+                started = time.perf_counter()
+                samples = list(executor.map(fetch, [base + route] * requests))
+                results[route] = summarize(samples, time.perf_counter() - started)
+                print(f'{route:<62} p50 {results[route]["p50Ms"]:8.2f}ms '
+                      f'p99 {results[route]["p99Ms"]:8.2f}ms '
+                      f'{results[route]["throughputPerSec"]:8.1f}/s')
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """
+    Prints the p50 change of every benchmark against a baseline run.
+
+    Args:
+        results: The results of this run.
+        baseline: The results of an earlier run.
+    """
+    for section in ('micro', 'load'):
+        for name, summary in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old:
+                change = (summary['p50Ms'] / old['p50Ms'] - 1) * 100
+                print(f'{section:<6}{name:<62} p50 {change:+7.1f}%')
+
+
+def main() -> None:
+    """
+    The command line entry of the suite.
+    """
+    parser = argparse.ArgumentParser(description='Run the benchmark suite.')
+    parser.add_argument('--db', default='bench.sqlite3')
+    parser.add_argument('--regenerate', action='store_true')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline')
+    args = parser.parse_args()
+
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = args.db
+    sizes = {name: getattr(args, name) for name in datagen.SIZES}
+    data = None
+    if args.regenerate or not os.path.exists(args.db):
+        data = datagen.generate(args.db, **sizes)
+        print(f'Generated {data}')
+
+    results: Dict[str, Any] = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sizes': sizes,
+            'generated': data,
+            'iterations': args.iterations,
+            'requests': args.requests,
+            'concurrency': args.concurrency
+        },
+        'micro': microbenchmarks(args.iterations)
+    }
+    if not args.skip_load:
+        results['load'] = load_test(args.requests, args.concurrency)
+
+    with open(args.out, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2)
+    print(f'Wrote {args.out}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            compare(results, json.load(handle))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,19 +6,135 @@ the application.
 """
 
 
+import hmac
+import math
+import os
 from datetime import datetime
+from typing import Tuple
 
-from flask import jsonify, request, session, url_for, Flask
+from flask import jsonify, request, session, url_for, Flask, Response
 from flask_cors import CORS
+import pymysql
 
-from coa_flask_app import contribution, site
+from coa_flask_app import (admission, batch, cache, compression, contribution,
+                           db_accessor, engine, export, fast_json, metrics, search, site,
+                           slow_query, warmup, write_behind)
+from coa_flask_app.http_cache import conditional
 
 
 APP = Flask(__name__)
 CORS(APP)
+fast_json.init_app(APP)
+metrics.init_app(APP)
+admission.init_app(APP)
+slow_query.init()
+
+fast_json.register_payload(
+    'locations', lambda: {'locations': site.all_locations_list()})
+fast_json.register_payload(
+    'locationsHierarchy', lambda: {'locationsHierarchy': site.locations_hierarchy()})
+fast_json.register_payload(
+    'getTLs', lambda: {'getTLs': contribution.get_tls()})
+fast_json.register_payload(
+    'getTrashItems', lambda: {'getTrashItems': contribution.get_trash_items()})
+warmup.init_app(APP)
+write_behind.init_app(APP)
+
+
+@APP.errorhandler(db_accessor.PoolTimeoutError)
+@APP.errorhandler(pymysql.MySQLError)
+def database_error(error: Exception) -> Response:
+    """
+    Answers a request the database failed, with a 503 when it can't be
+    reached so clients retry once the circuit breaker probes it again.
+
+    Args:
+        error: The database error.
+
+    Returns:
+        A json error response.
+    """
+    if isinstance(error, (db_accessor.PoolTimeoutError, db_accessor.CircuitOpenError)) \
+            or db_accessor.is_connection_error(error):
+        retry_after = max(1, math.ceil(db_accessor.BREAKER.reset_timeout))
+        response = jsonify(error='The database is unavailable, please retry')
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    APP.logger.exception('Database error')
+    response = jsonify(error='Database error')
+    response.status_code = 500
+    return response
+
+
+def location_args() -> Tuple[str, str, str, str]:
+    """
+    Parses the location and date range arguments shared by the site routes.
+
+    The request args contain:
+        locationCategory - Default of site.
+        locationName     - Default of the common location.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+
+    Returns:
+        The location category, location name, start date and end date.
+    """
+    location_category = request.args.get('locationCategory',
+                                         default='site',
+                                         type=str)
+    location_category = 'site_name' if location_category == 'site' else location_category
+
+    location_name = request.args.get('locationName',
+                                     default='Union Beach',
+                                     type=str)
+    start_date = request.args.get('startDate',
+                                  default='2016-1-1',
+                                  type=str)
+    end_date = request.args.get('endDate',
+                                default=datetime.now().strftime('%Y-%m-%d'),
+                                type=str)
+    return location_category, location_name, start_date, end_date
+
+
+def sunburst_args() -> Tuple[bool, int]:
+    """
+    Parses the optional shape arguments of the breakdown sunburst.
+
+    The request args contain:
+        rollup - Add counts to the material and category nodes.
+        depth  - 1 for materials, 2 for categories, 3 for items.
+
+    Returns:
+        The rollup flag and the depth.
+    """
+    rollup = request.args.get('rollup',
+                              default='false',
+                              type=str).lower() in {'1', 'true', 'yes'}
+    depth = request.args.get('depth',
+                             default=3,
+                             type=int)
+    return rollup, depth
+
+
+def admin_authorized() -> bool:
+    """
+    Checks the admin token of the request against ADMIN_TOKEN, the admin
+    routes are closed while it isn't set.
+
+    Returns:
+        True if the request may use the admin routes.
+    """
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        return False
+    given = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(given.encode(), token.encode())
 
 
 @APP.route('/')
+@conditional
 def index():
     """
     Index holds the main page for the REST API.
@@ -32,6 +148,7 @@ def index():
 
 
 @APP.route('/locations')
+@conditional
 def all_locations_list():
     """
     The locations route returns all the locations.
@@ -39,10 +156,11 @@ def all_locations_list():
     Returns:
         A json list of all the locations.
     """
-    return jsonify(locations=site.all_locations_list())
+    return fast_json.payload_response('locations')
 
 
 @APP.route('/dirtydozen')
+@conditional
 def dirty_dozen():
     """
     The dirty dozen route is designed to give the UI the data
@@ -57,20 +175,7 @@ def dirty_dozen():
     Returns:
         The dirty dozen for the requested category, name, and date range.
     """
-    location_category = request.args.get('locationCategory',
-                                         default='site',
-                                         type=str)
-    location_category = 'site_name' if location_category == 'site' else location_category
-
-    location_name = request.args.get('locationName',
-                                     default='Union Beach',
-                                     type=str)
-    start_date = request.args.get('startDate',
-                                  default='2016-1-1',
-                                  type=str)
-    end_date = request.args.get('endDate',
-                                default=datetime.now().strftime('%Y-%m-%d'),
-                                type=str)
+    location_category, location_name, start_date, end_date = location_args()
 
     return jsonify(dirtydozen=site.dirty_dozen(location_category,
                                                location_name,
@@ -78,7 +183,121 @@ def dirty_dozen():
                                                end_date))
 
 
+@APP.route('/topk')
+@conditional
+def top_k():
+    """
+    The top k route ranks the items, categories, materials or brands with
+    the most debris, for the dirty dozen and brand reports.
+
+    The app route itself contains:
+        dimension        - item (default), category, material, or brand.
+        k                - The number of results, default of 12.
+        offset           - The number of results to skip, default of 0.
+        locationCategory - Default of site, all ranks the whole coast.
+        locationName     - Default of the common location.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+
+    Returns:
+        The page of the ranking and the total debris and number of results.
+    """
+    location_category, location_name, start_date, end_date = location_args()
+    dimension = request.args.get('dimension',
+                                 default='item',
+                                 type=str)
+    count = request.args.get('k',
+                             default=12,
+                             type=int)
+    offset = request.args.get('offset',
+                              default=0,
+                              type=int)
+    if dimension not in site.TOP_K_DIMENSIONS:
+        error = jsonify(error=f'dimension must be one of {", ".join(site.TOP_K_DIMENSIONS)}')
+        error.status_code = 400
+        return error
+
+    return jsonify(topk=site.top_k(dimension,
+                                   location_category,
+                                   location_name,
+                                   start_date,
+                                   end_date,
+                                   count=max(1, min(count, 500)),
+                                   offset=max(0, offset)))
+
+
+@APP.route('/compare')
+@conditional
+def compare():
+    """
+    The compare route gives the UI the dirty dozens of several locations
+    and a matrix of their item counts side by side.
+
+    The app route itself contains:
+        locationCategory - Default of site.
+        locationName     - Repeated once per location to compare.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+
+    Returns:
+        The comparison for the requested category, names, and date range.
+    """
+    location_category, _, start_date, end_date = location_args()
+    location_names = request.args.getlist('locationName', type=str)
+
+    return jsonify(compare=site.compare(location_category,
+                                        location_names,
+                                        start_date,
+                                        end_date))
+
+
+@APP.route('/trend')
+@conditional
+def trend():
+    """
+    The trend route gives the UI the total debris of a location bucketed
+    over time for a trend chart.
+
+    The app route itself contains:
+        locationCategory - Default of site.
+        locationName     - Default of the common location.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+        bucket           - day, week, month (default), or year.
+        itemId           - Only count this item.
+        material         - Only count items of this material.
+        category         - Only count items of this category.
+
+    Returns:
+        The count per bucket for the requested category, name, and date range.
+    """
+    location_category, location_name, start_date, end_date = location_args()
+    bucket = request.args.get('bucket',
+                              default='month',
+                              type=str)
+    if bucket not in site.TREND_BUCKETS:
+        error = jsonify(error=f'bucket must be one of {", ".join(site.TREND_BUCKETS)}')
+        error.status_code = 400
+        return error
+
+    max_buckets = site.max_trend_buckets()
+    if site.trend_bucket_count(start_date, end_date, bucket) > max_buckets:
+        error = jsonify(error=f'at most {max_buckets} buckets of a {bucket} may be requested')
+        error.status_code = 400
+        return error
+
+    return jsonify(trend=site.trend(location_category,
+                                    location_name,
+                                    start_date,
+                                    end_date,
+                                    bucket=bucket,
+                                    item_id=request.args.get('itemId', type=int),
+                                    material=request.args.get('material', type=str),
+                                    category=request.args.get('category', type=str)))
+
+
 @APP.route('/breakdown')
+@conditional
 def breakdown():
     """
     The breakdown route is designed to give the UI the data
@@ -89,32 +308,101 @@ def breakdown():
         locationName     - Default of the common location.
         startDate        - The old start date for historical reasons.
         endDate          - Now.
+        rollup           - Add counts to the material and category nodes.
+        depth            - 1 for materials, 2 for categories, 3 for items.
 
     Returns:
         The breakdown for the requested category, name, and date range.
     """
-    location_category = request.args.get('locationCategory',
-                                         default='site',
-                                         type=str)
-    location_category = 'site_name' if location_category == 'site' else location_category
-
-    location_name = request.args.get('locationName',
-                                     default='Union Beach',
-                                     type=str)
-    start_date = request.args.get('startDate',
-                                  default='2016-1-1',
-                                  type=str)
-    end_date = request.args.get('endDate',
-                                default=datetime.now().strftime('%Y-%m-%d'),
-                                type=str)
+    location_category, location_name, start_date, end_date = location_args()
+    rollup, depth = sunburst_args()
 
     return jsonify(data=site.breakdown(location_category,
                                        location_name,
                                        start_date,
-                                       end_date))
+                                       end_date,
+                                       rollup=rollup,
+                                       depth=depth))
+
+
+@APP.route('/dashboard')
+@conditional
+def dashboard():
+    """
+    The dashboard route gives the UI the dirty dozen, breakdown and valid
+    date range of a location in one round trip.
+
+    The app route itself contains:
+        locationCategory - Default of site.
+        locationName     - Default of the common location.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+        rollup           - Add counts to the material and category nodes.
+        depth            - 1 for materials, 2 for categories, 3 for items.
+
+    Returns:
+        The dirty dozen, breakdown and valid date range for the requested
+        category, name, and date range.
+    """
+    location_category, location_name, start_date, end_date = location_args()
+    rollup, depth = sunburst_args()
+
+    return jsonify(**site.dashboard(location_category,
+                                    location_name,
+                                    start_date,
+                                    end_date,
+                                    rollup=rollup,
+                                    depth=depth))
+
+
+@APP.route('/export')
+def export_data():
+    """
+    The export route streams the raw summary rows of a location and date
+    range as CSV or NDJSON, gzipped when the client accepts it.
+
+    The app route itself contains:
+        locationCategory - Default of site.
+        locationName     - Default of the common location.
+        startDate        - The old start date for historical reasons.
+        endDate          - Now.
+        format           - csv (default) or ndjson.
+
+    Returns:
+        The streamed rows for the requested category, name, and date range.
+    """
+    location_category, location_name, start_date, end_date = location_args()
+    data_format = request.args.get('format',
+                                   default='csv',
+                                   type=str)
+    if data_format not in {'csv', 'ndjson'}:
+        error = jsonify(error='format must be csv or ndjson')
+        error.status_code = 400
+        return error
+
+    rows = export.export_rows(location_category,
+                              location_name,
+                              start_date,
+                              end_date)
+    if data_format == 'csv':
+        body, mimetype = export.to_csv(rows), 'text/csv'
+    else:
+        body, mimetype = export.to_ndjson(rows), 'application/x-ndjson'
+
+    headers = {
+        'Content-Disposition': f'attachment; filename=coa_export.{data_format}',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.accept_encodings:
+        body = export.gzipped(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    # The rows are read while the response streams, after the request.
+    return admission.hold_until_closed(Response(body, mimetype=mimetype, headers=headers))
 
 
 @APP.route('/validdaterange')
+@conditional
 def valid_date_range():
     """
     The valid date range route is designed to give the UI a valid date
@@ -140,7 +428,31 @@ def valid_date_range():
                                                         location_name))
 
 
+@APP.route('/locations/search')
+@conditional
+def locations_search():
+    """
+    The locations search route returns the sites, towns and counties best
+    matching what the user typed, for the location autocomplete.
+
+    The app route itself contains:
+        q     - The text typed by the user.
+        limit - The max number of matches, default of 10.
+
+    Returns:
+        A json list of the matches with their town and county.
+    """
+    query = request.args.get('q',
+                             default='',
+                             type=str)
+    limit = request.args.get('limit',
+                             default=10,
+                             type=int)
+    return jsonify(results=search.search_locations(query, max(1, min(limit, 100))))
+
+
 @APP.route('/locationsHierarchy')
+@conditional
 def locations_hierarchy():
     """
     The locations hierarchy route returns the all the locations in a hierarchy.
@@ -148,10 +460,11 @@ def locations_hierarchy():
     Returns:
         A json list of the locations hierarchy.
     """
-    return jsonify(locationsHierarchy=site.locations_hierarchy())
+    return fast_json.payload_response('locationsHierarchy')
 
 
 @APP.route('/getTLs')
+@conditional
 def get_tls():
     """
     The get tls route returns the all the team leads for the input drop down.
@@ -159,10 +472,11 @@ def get_tls():
     Returns:
         A json list of the team leads.
     """
-    return jsonify(getTLs=contribution.get_tls())
+    return fast_json.payload_response('getTLs')
 
 
 @APP.route('/getTrashItems')
+@conditional
 def get_trash_items():
     """
     The get trash items route returns the all the trash items for the input
@@ -171,7 +485,7 @@ def get_trash_items():
     Returns:
         A json list of the trash items.
     """
-    return jsonify(getTrashItems=contribution.get_trash_items())
+    return fast_json.payload_response('getTrashItems')
 
 
 @APP.route('/saveUserInfo', methods=['POST'])
@@ -204,8 +518,144 @@ def insert_contribution():
     """
     A post request to insert a contribution into the database.
 
+    In write-behind mode the contribution is queued and acknowledged with
+    an id to poll /contributions/status with.
+
     Returns:
-        An empty JSON on success, and error response otherwise.
+        An empty JSON (or the queued id) on success, and error response
+        otherwise.
     """
-    contribution.insert_contribution(request.form.items()[0][0])
+    post_str = request.form.items()[0][0]
+    try:
+        if write_behind.enabled():
+            record = contribution.parse_legacy_contribution(post_str)
+            response = jsonify(id=write_behind.enqueue(record), status='queued')
+            response.status_code = 202
+            return response
+
+        contribution.insert_contribution(post_str)
+    except ValueError as exc:
+        error = jsonify(error=str(exc))
+        error.status_code = 400
+        return error
+
     return jsonify({})
+
+
+@APP.route('/contributions/status/<contribution_id>')
+def contribution_status(contribution_id):
+    """
+    The contribution status route tells the UI if a queued contribution
+    has been written yet.
+
+    Returns:
+        The status of the contribution, queued, committed or failed.
+    """
+    status = write_behind.status(contribution_id)
+    if status is None:
+        error = jsonify(error='Unknown contribution')
+        error.status_code = 404
+        return error
+
+    return jsonify(status)
+
+
+@APP.route('/contributions/bulk', methods=['POST'])
+def insert_contributions():
+    """
+    A post request to insert many contributions into the database at once.
+
+    The body is a json list of contribution records, see
+    contribution.validate_contribution for their shape.
+
+    Returns:
+        The outcome of every record on success, and error response otherwise.
+    """
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        error = jsonify(error='Expected a json list of contributions')
+        error.status_code = 400
+        return error
+
+    chunk_size = request.args.get('chunkSize',
+                                  default=50,
+                                  type=int)
+    return jsonify(contribution.insert_contributions(records,
+                                                     chunk_size=max(chunk_size, 1)))
+
+
+@APP.route('/batch', methods=['POST'])
+def run_batch():
+    """
+    A post request running many read requests at once, like the charts of
+    a page, and answering them all in one response.
+
+    The body is a json list of sub-requests, each a path with an optional
+    query string, like /dirtydozen?locationName=Union Beach, or an object
+    with a path and its args. Identical sub-requests are only run once.
+
+    The app route itself contains:
+        deadline - Seconds to wait for the sub-requests, capped by
+                   BATCH_DEADLINE.
+
+    Returns:
+        The status, body and timing of every sub-request in order on
+        success, and error response otherwise.
+    """
+    sub_requests = request.get_json(silent=True)
+    if not isinstance(sub_requests, list):
+        error = jsonify(error='Expected a json list of sub-requests')
+        error.status_code = 400
+        return error
+
+    if len(sub_requests) > batch.max_requests():
+        error = jsonify(error=f'A batch holds at most {batch.max_requests()} sub-requests')
+        error.status_code = 413
+        return error
+
+    deadline = request.args.get('deadline',
+                                default=batch.max_deadline(),
+                                type=float)
+    deadline = min(max(deadline, 0.0), batch.max_deadline())
+    return jsonify(batch.run_batch(APP, sub_requests, deadline))
+
+
+@APP.route('/stats')
+def stats():
+    """
+    The stats route returns the runtime stats of this worker.
+
+    Returns:
+        A json of the database pool, circuit breaker, cache, response cache,
+        engine, write-behind, warm-up and batch stats.
+    """
+    return jsonify(pool=db_accessor.pool_stats(),
+                   breaker=db_accessor.breaker_stats(),
+                   cache=cache.cache_stats(),
+                   responses=compression.response_cache_stats(),
+                   engine=engine.engine_stats(),
+                   writeBehind=write_behind.write_behind_stats(),
+                   warmup=warmup.warmup_stats(),
+                   batch=batch.batch_stats())
+
+
+@APP.route('/admin/slowQueries')
+def slow_queries():
+    """
+    The slow queries route reports the statements that spent the most time
+    over the slow query threshold, across all the workers.
+
+    The app route itself contains:
+        limit - The number of statements, default of 20.
+
+    Returns:
+        A json list of the top offenders.
+    """
+    if not admin_authorized():
+        error = jsonify(error='Unauthorized')
+        error.status_code = 401
+        return error
+
+    return jsonify(threshold=slow_query.threshold(),
+                   slowQueries=slow_query.top_offenders(
+                       request.args.get('limit', default=20, type=int)))
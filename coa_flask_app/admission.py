@@ -0,0 +1,312 @@
+"""
+A module designed to hold the admission control of the database bound routes.
+
+Every route has a pool of run slots shared by all the workers of a host,
+a request takes a free slot or waits for one in the pool's bounded queue.
+When the queue is full, or the wait times out, the request is turned away
+at once with a 503 and a Retry-After header instead of piling onto MySQL
+until harakiri kills the worker.
+
+The slots are lock files held with flock, so a killed worker's slots are
+released by the kernel. A waiting request blocks on the lock of one run
+slot, picked by its place in the queue so the waiters spread over the
+slots. The write routes have their own pool, a longer wait, and while a
+write is waiting the read routes only use half of their slots so the
+database has room for it.
+
+The read routes answered by the HTTP cache, with a 304 or with a kept
+response, take no slot, they only take one on a cache miss. A streamed
+response keeps its slot until the stream is closed.
+
+The admission is set up with the following environment variables:
+    ADMISSION             - Set to 0 to turn the admission control off.
+    ADMISSION_DIR         - The directory of the slot files (default
+                            admission in the private RUNTIME_DIR).
+    ADMISSION_READ_LIMIT  - In-flight requests per read route (default 8).
+    ADMISSION_WRITE_LIMIT - In-flight write requests (default 16).
+    ADMISSION_QUEUE       - Waiting requests per pool (default 16).
+    ADMISSION_WAIT        - Seconds a read waits for a slot, writes wait
+                            three times as long (default 2).
+"""
+
+import fcntl
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from flask import Flask, Response, g, jsonify, request
+
+from coa_flask_app import metrics, runtime_files
+
+
+WRITE_ENDPOINTS = {'insert_contribution', 'insert_contributions'}
+EXEMPT_ENDPOINTS = {'index', 'metrics', 'stats', 'slow_queries', 'save_user_info',
+                    'contribution_status', 'static'}
+
+
+def enabled() -> bool:
+    """
+    Checks if the admission control is turned on.
+
+    Returns:
+        True unless ADMISSION is off.
+    """
+    return os.environ.get('ADMISSION', '1').lower() not in {'0', 'false', 'no'}
+
+
+def admission_dir() -> str:
+    """
+    Returns the directory of the slot files, creating it when needed.
+
+    Returns:
+        The directory.
+    """
+    return runtime_files.private_dir(os.environ.get('ADMISSION_DIR')
+                                     or runtime_files.runtime_path('admission'))
+
+
+def pool_settings(pool: str) -> Tuple[int, int, float]:
+    """
+    Returns the slots, queue length and wait of a pool.
+
+    Args:
+        pool: write, or the endpoint of a read route.
+
+    Returns:
+        The number of run slots, queue slots and the max wait in seconds.
+    """
+    wait = float(os.environ.get('ADMISSION_WAIT', '2'))
+    queue = int(os.environ.get('ADMISSION_QUEUE', '16'))
+    if pool == 'write':
+        return int(os.environ.get('ADMISSION_WRITE_LIMIT', '16')), queue, wait * 3
+    return int(os.environ.get('ADMISSION_READ_LIMIT', '8')), queue, wait
+
+
+def _try_slot(path_prefix: str, slots: int) -> Tuple[Optional[Any], int]:
+    """
+    Takes the first free slot of a pool.
+
+    Every attempt opens its own handle, flock then excludes the threads of
+    this worker as well as the other workers.
+
+    Args:
+        path_prefix: The path of the slot files without their index.
+        slots: The number of slots to try.
+
+    Returns:
+        The open and locked slot file and its index, or None and -1 if they
+        are all taken.
+    """
+    for index in range(slots):
+        handle = runtime_files.open_private(f'{path_prefix}.{index}', 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return handle, index
+        except OSError:
+            handle.close()
+    return None, -1
+
+
+def _wait_for_slot(path: str, timeout: float) -> Optional[Any]:
+    """
+    Blocks on the lock of a slot for up to a timeout.
+
+    The blocking lock can't time out by itself, so it is taken by a helper
+    thread. A slot the helper gets after the timeout is released at once.
+
+    Args:
+        path: The slot file.
+        timeout: Seconds to wait.
+
+    Returns:
+        The open and locked slot file, or None if it wasn't freed in time.
+    """
+    handle = runtime_files.open_private(path, 'a')
+    acquired = threading.Event()
+    state_lock = threading.Lock()
+    state = {'abandoned': False}
+
+    def lock() -> None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        except OSError:
+            handle.close()
+            return
+        with state_lock:
+            if state['abandoned']:
+                handle.close()
+            else:
+                acquired.set()
+
+    threading.Thread(target=lock, name='admission-wait', daemon=True).start()
+    if acquired.wait(timeout):
+        return handle
+    with state_lock:
+        # The helper owns the handle from now on, unless it just got the lock.
+        state['abandoned'] = not acquired.is_set()
+        return handle if acquired.is_set() else None
+
+
+def _write_waiting(directory: str) -> bool:
+    """
+    Checks if a write is waiting for a slot.
+
+    Waiting writes hold a shared lock on the pressure file, so it can't be
+    locked exclusively while one does.
+
+    Args:
+        directory: The directory of the slot files.
+
+    Returns:
+        True if a write is waiting.
+    """
+    with runtime_files.open_private(os.path.join(directory, 'write.pressure'),
+                                    'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+
+def acquire(pool: str) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Takes a run slot of a pool, waiting in its queue when they are all taken.
+
+    Args:
+        pool: write, or the endpoint of a read route.
+
+    Returns:
+        The slot to release when the request is done and None, or None and
+        why the request was rejected, queue_full or timeout.
+    """
+    directory = admission_dir()
+    slots, queue, wait = pool_settings(pool)
+    prefix = os.path.join(directory, pool)
+
+    def usable_slots() -> int:
+        if pool != 'write' and _write_waiting(directory):
+            return max(1, slots // 2)
+        return slots
+
+    slot, _ = _try_slot(prefix + '.run', usable_slots())
+    if slot is not None:
+        metrics.inc('coa_admission_admitted_total', pool=pool)
+        return slot, None
+
+    queue_slot, position = _try_slot(prefix + '.queue', queue)
+    if queue_slot is None:
+        metrics.inc('coa_admission_rejected_total', pool=pool, reason='queue_full')
+        return None, 'queue_full'
+
+    metrics.inc('coa_admission_queued_total', pool=pool)
+    pressure = None
+    if pool == 'write':
+        pressure = runtime_files.open_private(os.path.join(directory, 'write.pressure'),
+                                              'a')
+        fcntl.flock(pressure, fcntl.LOCK_SH)
+
+    started = time.monotonic()
+    try:
+        # A slot may have been freed while the queue slot was taken.
+        slot, _ = _try_slot(prefix + '.run', usable_slots())
+        if slot is None:
+            slot = _wait_for_slot(f'{prefix}.run.{position % usable_slots()}', wait)
+    finally:
+        queue_slot.close()
+        if pressure is not None:
+            pressure.close()
+
+    metrics.observe('coa_admission_wait_seconds', time.monotonic() - started, pool=pool)
+    if slot is None:
+        metrics.inc('coa_admission_rejected_total', pool=pool, reason='timeout')
+        return None, 'timeout'
+
+    metrics.inc('coa_admission_admitted_total', pool=pool)
+    return slot, None
+
+
+def admit_request() -> Optional[Response]:
+    """
+    Takes a run slot for the current request, unless it is exempt or holds
+    one already. The slot is released when the request is torn down.
+
+    Returns:
+        None if the request may run, or the 503 response turning it away.
+    """
+    if not enabled() or request.endpoint is None \
+            or request.endpoint in EXEMPT_ENDPOINTS or 'admission_slot' in g:
+        return None
+
+    pool = 'write' if request.endpoint in WRITE_ENDPOINTS else request.endpoint
+    try:
+        slot, reason = acquire(pool)
+    except OSError:
+        # Without the slot files the request is let through.
+        return None
+
+    if slot is None:
+        _, _, wait = pool_settings(pool)
+        error = jsonify(error='The server is busy, please retry', reason=reason)
+        error.status_code = 503
+        error.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        return error
+
+    g.admission_slot = slot
+    return None
+
+
+def admit_on_miss(view: Callable) -> Callable:
+    """
+    Marks a route wrapper that takes the run slot itself, with
+    admit_request, only once it knows the request needs the database.
+
+    Args:
+        view: The route function.
+
+    Returns:
+        The same function.
+    """
+    view.admits_on_miss = True  # type: ignore
+    return view
+
+
+def hold_until_closed(response: Response) -> Response:
+    """
+    Hands the request's run slot to a streamed response, which releases it
+    once the stream is closed instead of when the request is torn down.
+
+    Args:
+        response: The streamed response.
+
+    Returns:
+        The same response.
+    """
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        response.call_on_close(slot.close)
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Limits the in-flight requests of every database bound route of an app.
+
+    Args:
+        app: The Flask app.
+    """
+    @app.before_request
+    def admit():
+        view = app.view_functions.get(request.endpoint) if request.endpoint else None
+        if getattr(view, 'admits_on_miss', False):
+            return None
+        return admit_request()
+
+    @app.teardown_request
+    def release(_exc):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            slot.close()
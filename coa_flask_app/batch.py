@@ -0,0 +1,292 @@
+"""
+A module designed to hold the batch API running many read requests at once.
+
+A page of the reporting front end needs dozens of independent read
+requests, one per chart. A batch sends them as one json list, they are
+dispatched to the existing read routes on a bounded thread pool of the
+worker, so they share its database pool, and their results come back in
+the order they were asked for. Identical sub-requests only run once.
+
+A sub-request still queued at the deadline is cancelled and one still
+running is answered with a 504. A running thread can't be stopped, so it
+finishes the sub-request, bounded by the database timeouts, and its result
+is dropped. While every thread is taken by such sub-requests new batches
+are answered with a 503 per sub-request instead of queueing behind them.
+The batches are tuned with the following environment variables:
+    BATCH_MAX_REQUESTS - Max sub-requests in a batch (default 50).
+    BATCH_WORKERS      - Threads running sub-requests per worker process
+                         (default DB_POOL_SIZE, or 4).
+    BATCH_DEADLINE     - Max seconds a batch runs for (default 10).
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+
+
+# The read routes a batch may call.
+BATCH_ENDPOINTS = {'all_locations_list', 'dirty_dozen', 'top_k', 'compare', 'trend',
+                   'breakdown', 'dashboard', 'valid_date_range', 'locations_search',
+                   'locations_hierarchy', 'get_tls', 'get_trash_items'}
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_PID = 0
+_EXECUTOR_LOCK = threading.Lock()
+_STATS = {'batches': 0, 'subRequests': 0, 'deduplicated': 0, 'timedOut': 0,
+          'rejected': 0, 'orphaned': 0}
+
+_Futures = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Tuple[int, Future]]
+
+
+def max_requests() -> int:
+    """
+    Returns the max number of sub-requests in a batch.
+
+    Returns:
+        The limit.
+    """
+    return int(os.environ.get('BATCH_MAX_REQUESTS', '50'))
+
+
+def max_deadline() -> float:
+    """
+    Returns the longest a batch may run for.
+
+    Returns:
+        The deadline in seconds.
+    """
+    return float(os.environ.get('BATCH_DEADLINE', '10'))
+
+
+def batch_workers() -> int:
+    """
+    Returns the number of threads running sub-requests in a worker.
+
+    Returns:
+        The thread count.
+    """
+    return max(int(os.environ.get('BATCH_WORKERS', os.environ.get('DB_POOL_SIZE', '4'))), 1)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns this process' sub-request threads, starting them after a fork.
+
+    Returns:
+        The thread pool.
+    """
+    global _EXECUTOR, _EXECUTOR_PID  # pylint: disable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            _EXECUTOR = ThreadPoolExecutor(max_workers=batch_workers(),
+                                           thread_name_prefix='batch')
+            _EXECUTOR_PID = os.getpid()
+            _STATS['orphaned'] = 0
+        return _EXECUTOR
+
+
+def parse_sub_request(app: Flask, sub_request: Any) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """
+    Validates a sub-request and reduces it to its path and sorted args, so
+    identical sub-requests compare equal.
+
+    Args:
+        app: The Flask app.
+        sub_request: A path with an optional query string, or a dict of a
+                     path and its args.
+
+    Returns:
+        The path and the args.
+
+    Raises:
+        ValueError: If the sub-request is malformed or not a batchable route.
+    """
+    if isinstance(sub_request, str):
+        sub_request = {'path': sub_request}
+    if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str):
+        raise ValueError('Expected a path or an object with a path')
+
+    url = urlsplit(sub_request['path'])
+    args = parse_qsl(url.query, keep_blank_values=True)
+    extra_args = sub_request.get('args', {})
+    if not isinstance(extra_args, dict):
+        raise ValueError('Expected args to be an object')
+    args += [(str(name), str(value)) for name, value in extra_args.items()]
+
+    try:
+        endpoint, _ = app.url_map.bind('localhost').match(url.path, method='GET')
+    except MethodNotAllowed:
+        raise ValueError(f'{url.path} can not be batched') from None
+    except HTTPException:
+        raise ValueError(f'Unknown route {url.path}') from None
+    if endpoint not in BATCH_ENDPOINTS:
+        raise ValueError(f'{url.path} can not be batched')
+
+    return url.path, tuple(sorted(args))
+
+
+def _dispatch(app: Flask, path: str, args: Tuple[Tuple[str, str], ...],
+              submitted: float) -> Dict[str, Any]:
+    """
+    Runs a sub-request through the app, hooks and error handlers included.
+
+    Args:
+        app: The Flask app.
+        path: The route path.
+        args: The query args.
+        submitted: When the sub-request was queued.
+
+    Returns:
+        The status, json body, staleness and timings of the sub-request.
+    """
+    started = time.monotonic()
+    with app.test_request_context(path, query_string=list(args)):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception('Batched request to %s failed', path)
+            response = app.make_response(({'error': 'Internal error'}, 500))
+        body = response.get_json(silent=True) if response.is_json else None
+        stale = response.headers.get('X-Data-Stale') == 'true'
+        status = response.status_code
+        response.close()
+
+    return {
+        'status': status,
+        'body': body,
+        'stale': stale,
+        'wait': round(started - submitted, 6),
+        'time': round(time.monotonic() - started, 6)
+    }
+
+
+def _orphan_finished(_: Future) -> None:
+    """
+    Counts off a sub-request that ran past its batch's deadline once its
+    thread is free again.
+    """
+    with _EXECUTOR_LOCK:
+        _STATS['orphaned'] -= 1
+
+
+def _submit(app: Flask, sub_requests: List[Any],
+            executor: Optional[ThreadPoolExecutor]) -> Tuple[List[Any], _Futures]:
+    """
+    Queues every distinct valid sub-request of a batch.
+
+    Args:
+        app: The Flask app.
+        sub_requests: The sub-requests, see parse_sub_request.
+        executor: The sub-request threads, or None to queue nothing while
+                  they are all taken by sub-requests past their deadline.
+
+    Returns:
+        The plan, the key or the ready result of every sub-request, and the
+        first index and future of every key.
+    """
+    futures: _Futures = {}
+    plan: List[Any] = []
+    for index, sub_request in enumerate(sub_requests):
+        try:
+            key = parse_sub_request(app, sub_request)
+        except ValueError as error:
+            plan.append({'status': 400, 'body': {'error': str(error)}})
+            continue
+
+        if executor is None:
+            plan.append({'status': 503, 'body': {'error': 'Batch threads are busy'}})
+        else:
+            if key not in futures:
+                futures[key] = (index, executor.submit(_dispatch, app, key[0], key[1],
+                                                       time.monotonic()))
+            plan.append(key)
+    return plan, futures
+
+
+def _collect(plan: List[Any], futures: _Futures, done: Set[Future]) -> List[Dict[str, Any]]:
+    """
+    Puts the results of a batch in the order of its sub-requests.
+
+    Args:
+        plan: The key or the ready result of every sub-request.
+        futures: The first index and future of every key.
+        done: The futures finished in time.
+
+    Returns:
+        The result of every sub-request.
+    """
+    results = []
+    for index, entry in enumerate(plan):
+        if isinstance(entry, dict):
+            results.append(entry)
+            continue
+
+        first, future = futures[entry]
+        if future in done:
+            result = dict(future.result())
+        else:
+            result = {'status': 504, 'body': {'error': 'Deadline exceeded'}}
+        if first != index:
+            result['duplicateOf'] = first
+        results.append(result)
+    return results
+
+
+def run_batch(app: Flask, sub_requests: List[Any], deadline: float) -> Dict[str, Any]:
+    """
+    Runs the sub-requests of a batch concurrently, identical ones only once.
+
+    Args:
+        app: The Flask app.
+        sub_requests: The sub-requests, see parse_sub_request.
+        deadline: Seconds to wait for the sub-requests.
+
+    Returns:
+        The result of every sub-request in order and the batch timing.
+    """
+    started = time.monotonic()
+    executor: Optional[ThreadPoolExecutor] = get_executor()
+    with _EXECUTOR_LOCK:
+        if _STATS['orphaned'] >= batch_workers():
+            executor = None
+    plan, futures = _submit(app, sub_requests, executor)
+
+    done, not_done = wait([future for _, future in futures.values()], timeout=deadline)
+    for future in not_done:
+        if not future.cancel():
+            with _EXECUTOR_LOCK:
+                _STATS['orphaned'] += 1
+            future.add_done_callback(_orphan_finished)
+
+    results = _collect(plan, futures, done)
+    with _EXECUTOR_LOCK:
+        _STATS['batches'] += 1
+        _STATS['subRequests'] += len(sub_requests)
+        _STATS['deduplicated'] += sum(1 for result in results if 'duplicateOf' in result)
+        _STATS['timedOut'] += len(not_done)
+        _STATS['rejected'] += sum(1 for result in results if result['status'] == 503)
+
+    return {
+        'results': results,
+        'deadline': deadline,
+        'time': round(time.monotonic() - started, 6)
+    }
+
+
+def batch_stats() -> Dict[str, Any]:
+    """
+    Returns the batch numbers of this worker.
+
+    Returns:
+        A dict of the batches, their sub-requests, the ones run only once,
+        the ones cut off by the deadline, the ones turned away while the
+        threads were busy and the ones still running past their deadline.
+    """
+    with _EXECUTOR_LOCK:
+        return dict(_STATS)
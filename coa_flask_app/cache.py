@@ -0,0 +1,343 @@
+"""
+The module designed to hold the in-process result cache.
+
+Reference data such as the locations, team leads and trash items only
+changes when a contribution is inserted, so it is cached here with a
+TTL and a bounded size. Results are also kept in the host wide shared
+cache. The shared cache generation and the data version are part of every
+key, so an insert in any worker invalidates the results of all of them,
+and a result is never kept under a data version older than its data.
+
+The last good result of every key is also kept past its TTL. When a
+result expires it is still served, marked stale, while it is refreshed in
+the background, and it is served as well while the database is failing
+or its circuit breaker is open. The cache is tuned with the following
+environment variables:
+    CACHE_TTL      - Seconds an entry stays fresh (default 300).
+    CACHE_MAX_SIZE - The max number of entries kept (default 256).
+    STALE_TTL      - Seconds the last good result of a key is kept
+                     (default 86400).
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+import pymysql
+from flask import g, has_request_context
+
+from coa_flask_app import data_version, db_accessor, shared_cache, singleflight
+
+
+class CacheCounters:
+    """
+    The hit, miss, eviction and invalidation totals of a TTLCache, guarded
+    by the cache's lock.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def hit_rate(self) -> float:
+        """
+        Returns the share of lookups answered from the cache.
+
+        Returns:
+            The hit rate, 0 before any lookup.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns the totals.
+
+        Returns:
+            A dict of the hits, misses, hit rate, evictions and invalidations.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hit_rate(),
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+
+class TTLCache:
+    """
+    A thread safe least recently used cache where entries also expire.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 300.0) -> None:
+        """
+        The constructor of the TTLCache class.
+
+        Args:
+            max_size: The max number of entries kept before evicting.
+            ttl: Seconds an entry stays fresh.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._counters = CacheCounters()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Looks up a key in the cache.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            A tuple of whether the key was found and its value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._counters.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._counters.hits += 1
+            return True, entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Stores a value in the cache, evicting the least recently used
+        entry if the cache is full.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store.
+            ttl: An optional override of the default ttl.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters.evictions += 1
+
+    def invalidate(self) -> None:
+        """
+        Drops every entry in the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._counters.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the usage numbers of the cache.
+
+        Returns:
+            A dict of the cache size and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'ttl': self.ttl,
+                **self._counters.as_dict()
+            }
+
+
+REFERENCE_CACHE = TTLCache(max_size=int(os.environ.get('CACHE_MAX_SIZE', '256')),
+                           ttl=float(os.environ.get('CACHE_TTL', '300')))
+
+# The generation and last good result of every key, served when the fresh
+# one can't be had at once.
+STALE_CACHE = TTLCache(max_size=int(os.environ.get('CACHE_MAX_SIZE', '256')),
+                       ttl=float(os.environ.get('STALE_TTL', '86400')))
+
+# Stands in for the shared generation when the shared cache is off.
+_LOCAL_GENERATION = 0
+_GENERATION_LOCK = threading.Lock()
+_REFRESHING: Set[Hashable] = set()
+_STALE_LOCK = threading.Lock()
+_STALE_STATS = {'served': 0, 'servedOnError': 0, 'refreshes': 0, 'refreshErrors': 0}
+
+
+def _serve_stale(value: Any, on_error: bool = False) -> Any:
+    """
+    Counts a stale result and marks the current request as serving one.
+
+    Args:
+        value: The stale result.
+        on_error: Whether the fresh result failed to load.
+
+    Returns:
+        The stale result.
+    """
+    with _STALE_LOCK:
+        _STALE_STATS['servedOnError' if on_error else 'served'] += 1
+    if has_request_context():
+        g.data_stale = True
+    return value
+
+
+def served_stale() -> bool:
+    """
+    Checks if a stale result was served to the current request.
+
+    Returns:
+        True if the response holds stale data.
+    """
+    return has_request_context() and g.get('data_stale', False)
+
+
+def _refresh(key: Hashable, compute: Callable[[], Any],
+             recheck: Callable[[], Tuple[bool, Any]]) -> None:
+    """
+    Refreshes an expired result in a background thread, once per key.
+
+    Args:
+        key: The key of the result.
+        compute: Computes and stores the fresh result.
+        recheck: Looks up a result another worker computed.
+    """
+    with _STALE_LOCK:
+        if key in _REFRESHING:
+            return
+        _REFRESHING.add(key)
+        _STALE_STATS['refreshes'] += 1
+
+    def run() -> None:
+        try:
+            singleflight.do(key, compute, recheck)
+        except Exception:  # pylint: disable=broad-except
+            # The stale result keeps being served until a refresh works.
+            with _STALE_LOCK:
+                _STALE_STATS['refreshErrors'] += 1
+        finally:
+            with _STALE_LOCK:
+                _REFRESHING.discard(key)
+
+    threading.Thread(target=run, name='cache-refresh', daemon=True).start()
+
+
+def generation() -> Tuple[int, str]:
+    """
+    Returns the generation results are cached under.
+
+    The data version is read before any result is computed, so a result is
+    never older than the data version it is cached under, and the ETags
+    built from that version always match the cached bodies.
+
+    Returns:
+        The shared cache generation and the data version.
+    """
+    shared = shared_cache.get_cache()
+    return (shared.generation() if shared is not None else _LOCAL_GENERATION,
+            data_version.current())
+
+
+def cached(func: Callable) -> Callable:
+    """
+    Caches the results of a function in the reference cache and the shared
+    cache, keyed on the function and its arguments. Concurrent misses of
+    the same key are collapsed into one call.
+
+    An expired result of the same generation is served stale and refreshed
+    in the background. A result of an older generation is only served when
+    loading the new one fails, like while the circuit breaker is open.
+
+    The cached value is shared between callers, so it must not be mutated.
+
+    Args:
+        func: The function to cache.
+
+    Returns:
+        The wrapped function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__module__, func.__qualname__, args,
+               tuple(sorted(kwargs.items())))
+        shared = shared_cache.get_cache()
+        current = generation()
+        local_key = current + key
+        # The shared cache checks its own generation, only the version is
+        # part of its key.
+        shared_key = current[1:] + key
+        found, value = REFERENCE_CACHE.get(local_key)
+        if found:
+            return value
+
+        if shared is not None:
+            found, value = shared.get(shared_key)
+            if found:
+                REFERENCE_CACHE.set(local_key, value)
+                STALE_CACHE.set(key, (current, value))
+                return value
+
+        def compute() -> Any:
+            value = func(*args, **kwargs)
+            REFERENCE_CACHE.set(local_key, value)
+            STALE_CACHE.set(key, (current, value))
+            if shared is not None:
+                shared.set(shared_key, value, REFERENCE_CACHE.ttl, current[0])
+            return value
+
+        def recheck() -> Tuple[bool, Any]:
+            return shared.get(shared_key) if shared is not None else (False, None)
+
+        has_stale, stale = STALE_CACHE.get(key)
+        if has_stale:
+            stale_generation, stale_value = stale
+            if stale_generation == current:
+                _refresh(local_key, compute, recheck)
+                return _serve_stale(stale_value)
+
+        try:
+            return singleflight.do(local_key, compute, recheck)
+        except (pymysql.MySQLError, db_accessor.PoolTimeoutError):
+            if not has_stale:
+                raise
+            return _serve_stale(stale_value, on_error=True)
+
+    return wrapper
+
+
+def invalidate() -> None:
+    """
+    Drops every cached result, this is called whenever the data changes.
+
+    Bumping the shared generation invalidates the other workers too, the
+    last good results are kept but only served again while the database
+    is failing.
+    """
+    global _LOCAL_GENERATION  # pylint: disable=global-statement
+    REFERENCE_CACHE.invalidate()
+    with _GENERATION_LOCK:
+        _LOCAL_GENERATION += 1
+    shared = shared_cache.get_cache()
+    if shared is not None:
+        shared.bump()
+
+
+def cache_stats() -> Dict[str, Any]:
+    """
+    Returns the usage numbers of the reference cache, the shared cache and
+    the coalescing of misses.
+
+    Returns:
+        A dict of the cache stats.
+    """
+    with _STALE_LOCK:
+        stale = dict(STALE_CACHE.stats(), **_STALE_STATS, refreshing=len(_REFRESHING))
+    return dict(REFERENCE_CACHE.stats(),
+                stale=stale,
+                shared=shared_cache.shared_cache_stats(),
+                singleFlight=singleflight.singleflight_stats())
@@ -0,0 +1,142 @@
+"""
+A module designed to hold the response compression logic.
+
+Cacheable responses are compressed once, when they are built, and the
+compressed bytes are kept next to the plain ones so a request only picks
+the variant its Accept-Encoding allows. Brotli is used when the optional
+brotli package is installed, gzip otherwise.
+
+The compression is tuned with the following environment variables:
+    COMPRESS_MIN_BYTES    - Bodies smaller than this are sent plain (default 1024).
+    RESPONSE_CACHE_SIZE   - The max number of responses kept per worker
+                            (default 256).
+"""
+
+import gzip
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from flask import Response
+
+from coa_flask_app.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # pylint: disable=invalid-name
+
+
+# The encodings in our order of preference when the client likes them equally.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Responses are only compressed once per data version, so the levels favour
+# size over speed.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def min_bytes() -> int:
+    """
+    Returns the size below which bodies are sent plain.
+
+    Returns:
+        The threshold in bytes.
+    """
+    return int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses a body with an encoding.
+
+    Args:
+        data: The plain body.
+        encoding: br or gzip.
+
+    Returns:
+        The compressed body.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL)
+
+
+def compress_all(data: bytes) -> Dict[str, bytes]:
+    """
+    Compresses a body with every supported encoding.
+
+    Variants that don't save any bytes are dropped, so are all of them for
+    bodies under the threshold.
+
+    Args:
+        data: The plain body.
+
+    Returns:
+        The compressed body by encoding.
+    """
+    if len(data) < min_bytes():
+        return {}
+
+    variants = {encoding: compress(data, encoding) for encoding in ENCODINGS}
+    return {encoding: body for encoding, body in variants.items()
+            if len(body) < len(data)}
+
+
+def negotiate(accept_encodings: Any, available: Any) -> Optional[str]:
+    """
+    Picks the encoding to send a response with.
+
+    Args:
+        accept_encodings: The Accept-Encoding of the request.
+        available: The encodings the body is available in.
+
+    Returns:
+        The encoding the client likes best, ties going to our preference,
+        or None to send the plain body.
+    """
+    best: Optional[str] = None
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding] if encoding in available else 0
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encoded_response(body: bytes, variants: Dict[str, bytes], mimetype: str,
+                     accept_encodings: Any) -> Tuple[Response, Optional[str]]:
+    """
+    Builds a response out of a body and its compressed variants.
+
+    Args:
+        body: The plain body.
+        variants: The compressed bodies by encoding.
+        mimetype: The mimetype of the body.
+        accept_encodings: The Accept-Encoding of the request.
+
+    Returns:
+        The response and the encoding it was sent with.
+    """
+    encoding = negotiate(accept_encodings, variants)
+    response = Response(variants[encoding] if encoding else body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response, encoding
+
+
+# The plain and compressed bodies of the cacheable responses by ETag, the
+# ETag changes with the data version so entries never go stale.
+RESPONSE_CACHE = TTLCache(max_size=int(os.environ.get('RESPONSE_CACHE_SIZE', '256')),
+                          ttl=24 * 60 * 60)
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    """
+    Returns the usage numbers of the compressed response cache.
+
+    Returns:
+        A dict of the cache stats and the encodings in use.
+    """
+    return dict(RESPONSE_CACHE.stats(), encodings=list(ENCODINGS),
+                minBytes=min_bytes())
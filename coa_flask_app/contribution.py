@@ -4,12 +4,17 @@ A module designed to hold the logic related to the contribution page.
 
 import bisect
 import csv
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Tuple
 
+import pymysql
+
+from coa_flask_app import cache, data_version, engine, rollup
 from coa_flask_app.db_accessor import Accessor
 
 
+@cache.cached
 def get_tls() -> List[str]:
     """
     Get all the team leads for the drop downs.
@@ -28,6 +33,7 @@ def get_tls() -> List[str]:
         return [tl[0] for tl in db_handle.fetchall()]
 
 
+@cache.cached
 def get_trash_items() -> Dict[str, List[str]]:
     """
     Get all the trash items for the drop downs.
@@ -60,66 +66,328 @@ def get_trash_items() -> Dict[str, List[str]]:
     return trash_items
 
 
-def insert_contribution(post_str: str) -> None:
+TEAM_QUERY = """
+             INSERT INTO coa.team_info
+                 (site_id,
+                  volunteer_date,
+                  team_captain,
+                  num_of_people,
+                  num_of_trashbags,
+                  trash_weight,
+                  walking_distance,
+                  updated_by)
+             VALUES
+                 (%s, %s, %s, %s, %s, %s, %s, %s)
+             """
+
+VOLUNTEER_QUERY = """
+                  INSERT INTO coa.volunteer_info
+                      (team_id,
+                       item_id,
+                       quantity,
+                       brand,
+                       updated_by,
+                       event_code)
+                  VALUES
+                      (%s, %s, %s, %s, %s, %s)
+                  """
+
+TeamRow = Tuple[int, str, str, int, int, float, float, str]
+VolunteerRow = Tuple[int, int, str, str, str]
+
+
+def _parse_date(volunteer_date: str) -> str:
     """
-    Inserts into the database that a contribution was made.
+    Parses a volunteer date given as m/d/Y or Y-m-d.
+
+    Args:
+        volunteer_date: The date string.
+
+    Returns:
+        The date in the Y-m-d form of the database.
+
+    Raises:
+        ValueError: If the date is in neither form.
+    """
+    for date_format in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(volunteer_date, date_format).strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            continue
+
+    raise ValueError(f'volunteerDate {volunteer_date!r} is not a valid date')
+
+
+def _field(record: Dict[str, Any], name: str, cast: Callable, default: Any = None) -> Any:
+    """
+    Reads and converts a field of a contribution record.
+
+    Args:
+        record: The contribution record.
+        name: The name of the field.
+        cast: The type to convert the value to.
+        default: The value of a missing field, None means it is required.
+
+    Returns:
+        The converted value.
+
+    Raises:
+        ValueError: If the field is missing or has the wrong type.
+    """
+    value = record.get(name, default)
+    if value is None or value == '':
+        raise ValueError(f'{name} is required')
+
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f'{name} {value!r} is not a valid {cast.__name__}') from None
+
+
+def validate_contribution(record: Any) -> Tuple[TeamRow, List[VolunteerRow]]:
+    """
+    Validates a contribution record and converts it into database rows.
+
+    A record looks like:
+    {
+        "siteId": 12,
+        "volunteerDate": "2019-04-27",
+        "teamCaptain": "Jane Doe",
+        "numOfPeople": 4,
+        "numOfTrashbags": 2,
+        "trashWeight": 10.5,
+        "walkingDistance": 0.5,
+        "updatedBy": "jdoe",
+        "eventCode": "BS2019",
+        "items": [{"itemId": 7, "quantity": 31, "brand": ""}, ...]
+    }
+    Each item may override the record's updatedBy and eventCode.
+
+    Args:
+        record: The contribution record.
+
+    Returns:
+        The team row and the volunteer rows, without the team id.
+
+    Raises:
+        ValueError: If the record is malformed.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('A contribution must be an object')
+
+    updated_by = _field(record, 'updatedBy', str)
+    event_code = record.get('eventCode', '')
+    team_row = (_field(record, 'siteId', int),
+                _parse_date(_field(record, 'volunteerDate', str)),
+                _field(record, 'teamCaptain', str),
+                _field(record, 'numOfPeople', int),
+                _field(record, 'numOfTrashbags', int, 0),
+                _field(record, 'trashWeight', float, 0),
+                _field(record, 'walkingDistance', float, 0),
+                updated_by)
+
+    items = record.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non empty list')
+
+    volunteer_rows: List[VolunteerRow] = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Every item must be an object')
+
+        volunteer_rows.append((_field(item, 'itemId', int),
+                               _field(item, 'quantity', int),
+                               str(item.get('brand') or ''),
+                               str(item.get('updatedBy') or updated_by),
+                               str(item.get('eventCode') or event_code)))
+
+    return team_row, volunteer_rows
+
+
+def _insert_rows(db_handle: Any,
+                 contributions: List[Tuple[TeamRow, List[VolunteerRow]]]) -> List[int]:
+    """
+    Inserts validated contributions in the current transaction, along with
+    their totals in the daily rollup when it is on.
+
+    Args:
+        db_handle: The cursor to insert with.
+        contributions: The team and volunteer rows of each contribution.
+
+    Returns:
+        The team id of each contribution.
+    """
+    team_ids = []
+    volunteer_rows: List[Tuple[Any, ...]] = []
+    for team_row, rows in contributions:
+        db_handle.execute(TEAM_QUERY, team_row)
+        team_id = db_handle.lastrowid
+        team_ids.append(team_id)
+        volunteer_rows.extend((team_id, *row) for row in rows)
+
+    db_handle.executemany(VOLUNTEER_QUERY, volunteer_rows)
+    if rollup.enabled():
+        rollup.add_contributions(db_handle,
+                                 ((team_row[0], team_row[1], row[0], row[1])
+                                  for team_row, rows in contributions
+                                  for row in rows))
+    return team_ids
+
+
+def data_changed() -> None:
+    """
+    Invalidates everything derived from the data after a write commits,
+    the cached reference data, the in-memory engine and the data version.
+    """
+    cache.invalidate()
+    engine.refresh()
+    data_version.bump()
+
+
+def insert_contributions(records: List[Any],
+                         chunk_size: int = 50) -> Dict[str, Any]:
+    """
+    Validates and inserts many contributions, committing them in chunks.
+
+    All the records are validated first, the valid ones are then inserted
+    with parameterized statements, one transaction per chunk. If a chunk
+    fails its records are retried one by one so every record gets its own
+    outcome.
+
+    Args:
+        records: The contribution records, see validate_contribution.
+        chunk_size: The number of contributions per transaction.
+
+    Returns:
+        The outcome of every record along with the totals and insert rate.
+    """
+    results: List[Dict[str, Any]] = []
+    valid: List[Tuple[int, Tuple[TeamRow, List[VolunteerRow]]]] = []
+    for index, record in enumerate(records):
+        try:
+            valid.append((index, validate_contribution(record)))
+            results.append({'index': index, 'ok': True})
+        except ValueError as error:
+            results.append({'index': index, 'ok': False, 'error': str(error)})
+
+    def insert_chunk(chunk):
+        with Accessor() as db_handle:
+            team_ids = _insert_rows(db_handle, [rows for _, rows in chunk])
+        for (index, _), team_id in zip(chunk, team_ids):
+            results[index]['teamId'] = team_id
+
+    started = time.monotonic()
+    rows_inserted = 0
+    try:
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            try:
+                insert_chunk(chunk)
+                rows_inserted += sum(1 + len(rows) for _, (_, rows) in chunk)
+                continue
+            except pymysql.MySQLError:
+                pass
+
+            for single in chunk:
+                try:
+                    insert_chunk([single])
+                    rows_inserted += 1 + len(single[1][1])
+                except pymysql.MySQLError as error:
+                    results[single[0]].update(ok=False, error=str(error))
+    finally:
+        # The chunks committed before any error are already in the database.
+        if rows_inserted:
+            data_changed()
+
+    elapsed = time.monotonic() - started
+    inserted = sum(1 for result in results if result['ok'])
+
+    return {
+        'results': results,
+        'inserted': inserted,
+        'failed': len(results) - inserted,
+        'rows': rows_inserted,
+        'seconds': round(elapsed, 6),
+        'rowsPerSecond': round(rows_inserted / elapsed, 1) if elapsed else None
+    }
+
+
+def parse_legacy_contribution(post_str: str) -> Dict[str, Any]:
+    """
+    Converts the legacy post string into a contribution record.
+
+    The legacy post string looks like
+    site#date#captain#people#bags#weight#distance#updater----item#quantity#brand#updater#event||...
+
+    Args:
+        post_str: The legacy post string.
+
+    Returns:
+        The contribution record, see validate_contribution.
+
+    Raises:
+        ValueError: If the post string is malformed.
     """
     # TODO: This should be changed as this is all tied to how the
     # data was passed in the older version.
-    team_query = """
-                INSERT INTO coa.team_info
-                    (site_id,
-                     volunteer_date,
-                     team_captain,
-                     num_of_people,
-                     num_of_trashbags,
-                     trash_weight,
-                     walking_distance,
-                     updated_by)
-                VALUES
-                """
-
-    volunteer_query = """
-                      INSERT INTO coa.volunteer_info
-                        (team_id,
-                         item_id,
-                         quantity,
-                         brand,
-                         updated_by,
-                         event_code)
-                    VALUES
-                    """
-
-    team_info, volunteer_info = post_str.split('----')
-
-    row = team_info.split('#')
-    team_query += "(%s,'%s','%s',%s,%s,%s,%s,'%s')" % (
-        row[0],
-        datetime.strptime(row[1], '%m/%d/%Y').strftime("%Y-%m-%d"),
-        row[2],
-        row[3],
-        row[4],
-        row[5],
-        row[6],
-        row[7]
-    )
-
-    volunteer_reader = csv.reader(volunteer_info.split('||'), delimiter='#')
-    for row in volunteer_reader:
-        if row:
-            volunteer_query += "(%s,%s,%s,'%s','%s','%s')," % (
-                'LAST_INSERT_ID()',
-                row[0].split('[')[1].split(']')[0],
-                row[1],
-                row[2],
-                row[3],
-                row[4]
-            )
-
-    query = f"""BEGIN;
-                {team_query}';
-                {volunteer_query[:-1]};
-                COMMIT;
-             """
+    try:
+        team_info, volunteer_info = post_str.split('----')
+        row = team_info.split('#')
+        record: Dict[str, Any] = {
+            'siteId': row[0],
+            'volunteerDate': row[1],
+            'teamCaptain': row[2],
+            'numOfPeople': row[3],
+            'numOfTrashbags': row[4],
+            'trashWeight': row[5],
+            'walkingDistance': row[6],
+            'updatedBy': row[7],
+            'items': []
+        }
+
+        volunteer_reader = csv.reader(volunteer_info.split('||'), delimiter='#')
+        for row in volunteer_reader:
+            if row:
+                record['items'].append({
+                    'itemId': row[0].split('[')[1].split(']')[0],
+                    'quantity': row[1],
+                    'brand': row[2],
+                    'updatedBy': row[3],
+                    'eventCode': row[4]
+                })
+    except (IndexError, ValueError):
+        raise ValueError('Malformed contribution') from None
+
+    return record
+
+
+def insert_validated(contributions: List[Tuple[TeamRow, List[VolunteerRow]]]) -> List[int]:
+    """
+    Inserts already validated contributions in a single transaction.
+
+    Everything derived from the data is invalidated once the insert commits.
+
+    Args:
+        contributions: The team and volunteer rows from validate_contribution.
+
+    Returns:
+        The team id of each contribution.
+    """
     with Accessor() as db_handle:
-        db_handle.execute(query)
+        team_ids = _insert_rows(db_handle, contributions)
+
+    data_changed()
+    return team_ids
+
+
+def insert_contribution(post_str: str) -> None:
+    """
+    Inserts into the database that a contribution was made.
+
+    Everything derived from the data is invalidated once the insert commits.
+
+    Args:
+        post_str: The legacy post string, see parse_legacy_contribution.
+    """
+    insert_validated([validate_contribution(parse_legacy_contribution(post_str))])
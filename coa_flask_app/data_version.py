@@ -0,0 +1,119 @@
+"""
+A module designed to track the version of the data in the database.
+
+The version is a short token that changes whenever a contribution is
+inserted. Rows are only ever added, so it is derived from the highest
+primary key of each table, which the database answers from the end of the
+index without scanning it, and every worker agrees on it. A row deleted
+or edited by hand isn't noticed until something is inserted.
+
+A version read is kept in the host wide shared cache, so the workers of a
+host read it from the database once per interval between them, and each
+worker keeps its own copy for the interval as well. While the database
+can't be reached the last version read is kept, so the cached responses
+keep being served.
+The refresh interval is set with the following environment variable:
+    DATA_VERSION_TTL - Seconds between version checks (default 5).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import pymysql
+
+from coa_flask_app import shared_cache
+from coa_flask_app.db_accessor import Accessor, PoolTimeoutError
+
+
+_LOCK = threading.Lock()
+_VERSION: Optional[str] = None
+_LAST_VERSION: Optional[str] = None
+_CHECKED = 0.0
+_SHARED_KEY = ('coa_flask_app.data_version', 'version')
+
+
+def read_version() -> str:
+    """
+    Reads the data version from the database.
+
+    Returns:
+        The data version token.
+    """
+    query = """
+            SELECT
+                (SELECT MAX(team_id) FROM coa.team_info),
+                (SELECT MAX(volunteer_id) FROM coa.volunteer_info),
+                (SELECT MAX(item_id) FROM coa.item),
+                (SELECT MAX(site_id) FROM coa.site_info)
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query)
+        row: Tuple = db_handle.fetchone()
+
+    return hashlib.sha1(repr(row).encode()).hexdigest()[:16]
+
+
+def _read_shared(ttl: float) -> str:
+    """
+    Returns the data version another worker of the host read within the
+    interval, or reads it and shares it.
+
+    Args:
+        ttl: Seconds the version read is shared for.
+
+    Returns:
+        The data version token.
+    """
+    shared = shared_cache.get_cache()
+    if shared is None:
+        return read_version()
+
+    # A version read before a write of this host isn't shared after it.
+    generation = shared.generation()
+    found, version = shared.get(_SHARED_KEY)
+    if found:
+        return version
+
+    version = read_version()
+    shared.set(_SHARED_KEY, version, ttl, generation)
+    return version
+
+
+def current() -> str:
+    """
+    Returns the current data version, re-reading it when it is too old.
+
+    Returns:
+        The data version token.
+    """
+    global _VERSION, _LAST_VERSION, _CHECKED  # pylint: disable=global-statement
+    ttl = float(os.environ.get('DATA_VERSION_TTL', '5'))
+    if _VERSION is not None and time.monotonic() - _CHECKED < ttl:
+        return _VERSION
+
+    with _LOCK:
+        if _VERSION is None or time.monotonic() - _CHECKED >= ttl:
+            try:
+                _VERSION = _read_shared(ttl)
+            except (pymysql.MySQLError, PoolTimeoutError):
+                if _LAST_VERSION is None:
+                    raise
+                _VERSION = _LAST_VERSION
+            _LAST_VERSION = _VERSION
+            _CHECKED = time.monotonic()
+        return _VERSION
+
+
+def bump() -> None:
+    """
+    Forgets the current data version so the next check re-reads it.
+
+    This is called whenever a write commits, after the shared cache
+    generation moved, so the shared version is dropped as well.
+    """
+    global _VERSION  # pylint: disable=global-statement
+    with _LOCK:
+        _VERSION = None
@@ -1,11 +1,652 @@
 """
 The module designed to contain all the database access logic.
+
+Connections are handed out by a small per-process pool so that every
+request doesn't pay for a fresh TCP connection and MySQL handshake.
+The pool is sized and tuned with the following environment variables:
+    DB_POOL_SIZE      - The max number of connections per process (default 4).
+    DB_POOL_TIMEOUT   - Seconds to wait for a free connection (default 10).
+    DB_POOL_MAX_AGE   - Seconds before a connection is recycled (default 1800).
+    DB_POOL_PING_IDLE - Seconds idle before a connection is pinged on
+                        checkout (default 30).
+    DB_BACKEND        - mysql (default) or sqlite for the local stand-in.
+
+MySQL connections time out instead of hanging, and a circuit breaker stops
+every Accessor from trying the database for a while after several
+connection failures in a row. It is tuned with:
+    DB_CONNECT_TIMEOUT  - Seconds to wait for a connection (default 5).
+    DB_READ_TIMEOUT     - Seconds to wait for a query result (default 30).
+    DB_WRITE_TIMEOUT    - Seconds to wait to send a query (default 30).
+    DB_BREAKER_FAILURES - Failures in a row that open the breaker (default 5).
+    DB_BREAKER_RESET    - Seconds before a probe is let through (default 10).
 """
 
 import os
-from typing import List
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
 import pymysql
+import pymysql.cursors
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection could be checked out of the pool in time.
+    """
+
+
+class CircuitOpenError(pymysql.OperationalError):
+    """
+    Raised instead of touching the database while the circuit breaker is open.
+    """
+
+
+# The MySQL client errors meaning the server can't be reached or went away.
+CONNECTION_ERRORS = {2002, 2003, 2006, 2013, 2055}
+
+
+class _PooledConnection:
+    """
+    A thin record tying a connection to its age and last use.
+    """
+
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def age(self, now: float) -> float:
+        """
+        Returns the seconds since the connection was opened.
+
+        Args:
+            now: The current time.monotonic().
+
+        Returns:
+            The age in seconds.
+        """
+        return now - self.created
+
+    def idle_time(self, now: float) -> float:
+        """
+        Returns the seconds since the connection was last released.
+
+        Args:
+            now: The current time.monotonic().
+
+        Returns:
+            The idle time in seconds.
+        """
+        return now - self.last_used
+
+
+def _connect_mysql() -> Any:
+    """
+    Creates a brand new MySQL connection from the environment.
+
+    Returns:
+        A new pymysql connection.
+    """
+    return pymysql.connect(host=os.environ['DB_SERVER'],
+                           user=os.environ['DB_USERNAME'],
+                           password=os.environ['DB_PASSWORD'],
+                           database=os.environ['DB_DATABASE'],
+                           port=int(os.environ['DB_PORT']),
+                           connect_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+                           read_timeout=int(os.environ.get('DB_READ_TIMEOUT', '30')),
+                           write_timeout=int(os.environ.get('DB_WRITE_TIMEOUT', '30')))
+
+
+def _connect_sqlite() -> Any:
+    """
+    Creates a connection to the local SQLite stand-in.
+
+    Returns:
+        A new pymysql like connection.
+    """
+    # Imported here so the stand-in is only loaded when it is used.
+    from coa_flask_app import local_db  # pylint: disable=import-outside-toplevel
+    return local_db.connect(os.environ.get('DB_SQLITE_PATH', 'coa_local.sqlite3'))
+
+
+BACKENDS: Dict[str, Callable[[], Any]] = {
+    'mysql': _connect_mysql,
+    'sqlite': _connect_sqlite
+}
+
+
+def register_backend(name: str, connect: Callable[[], Any]) -> None:
+    """
+    Registers a database backend that DB_BACKEND can select.
+
+    Args:
+        name: The name of the backend.
+        connect: A function returning a new pymysql like connection.
+    """
+    BACKENDS[name] = connect
+
+
+def _connect() -> Any:
+    """
+    Creates a brand new database connection with the backend chosen by
+    the DB_BACKEND environment variable, MySQL by default.
+
+    Returns:
+        A new connection.
+    """
+    return BACKENDS[os.environ.get('DB_BACKEND', 'mysql')]()
+
+
+def _close_quietly(connection: Any) -> None:
+    """
+    Closes a connection ignoring any errors from an already dead socket.
+
+    Args:
+        connection: The connection to close.
+    """
+    try:
+        connection.close()
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+
+class PoolSettings(NamedTuple):
+    """
+    The limits of a ConnectionPool.
+    """
+    size: int
+    timeout: float
+    max_age: float
+    ping_idle: float
+
+
+class _PoolCounters:
+    """
+    The running totals of a ConnectionPool, guarded by the pool's lock.
+    """
+
+    def __init__(self) -> None:
+        self.created = 0
+        self.recycled = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def waited(self, seconds: float) -> None:
+        """
+        Records a checkout that had to wait for a free connection.
+
+        Args:
+            seconds: The time waited.
+        """
+        self.waits += 1
+        self.wait_time += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns the totals.
+
+        Returns:
+            A dict of the connections opened and recycled and the waits.
+        """
+        return {
+            'created': self.created,
+            'recycled': self.recycled,
+            'waits': self.waits,
+            'waitTimeTotal': round(self.wait_time, 6)
+        }
+
+
+class ConnectionPool:
+    """
+    A bounded, thread safe pool of database connections for one process.
+
+    Connections are pinged when they have sat idle for a while and are
+    recycled once they pass their max age. The pool remembers the pid it
+    was created in so a forked worker never reuses its parent's sockets.
+    """
+
+    def __init__(self,
+                 size: int = 4,
+                 timeout: float = 10.0,
+                 max_age: float = 1800.0,
+                 ping_idle: float = 30.0) -> None:
+        """
+        The constructor of the ConnectionPool class.
+
+        Args:
+            size: The max number of connections open at once.
+            timeout: Seconds to wait for a connection before giving up.
+            max_age: Seconds a connection lives before it is recycled.
+            ping_idle: Seconds idle before a connection is pinged on checkout.
+        """
+        self.settings = PoolSettings(size, timeout, max_age, ping_idle)
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
+        self._idle: List[_PooledConnection] = []
+        self._checked_out = 0
+        self._counters = _PoolCounters()
+
+    def _reset_after_fork(self) -> None:
+        """
+        Drops every connection inherited from the parent process.
+
+        The sockets are shared with the parent, so they are only dropped
+        and never closed, closing them would end the parent's session.
+        """
+        self._lock = threading.Condition()
+        self._idle = []
+        self._checked_out = 0
+        self.pid = os.getpid()
+
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        """
+        Checks if an idle connection can be handed out again.
+
+        Args:
+            pooled: The pooled connection to check.
+
+        Returns:
+            True if the connection is young enough and alive.
+        """
+        now = time.monotonic()
+        if pooled.age(now) > self.settings.max_age:
+            return False
+
+        if pooled.idle_time(now) > self.settings.ping_idle:
+            try:
+                pooled.connection.ping(reconnect=False)
+            except Exception:  # pylint: disable=broad-except
+                return False
+
+        return True
+
+    def acquire(self) -> _PooledConnection:
+        """
+        Checks a connection out of the pool, opening one if there is room.
+
+        Returns:
+            A pooled connection.
+
+        Raises:
+            PoolTimeoutError: If no connection frees up within the timeout.
+        """
+        if self.pid != os.getpid():
+            self._reset_after_fork()
+
+        size, timeout = self.settings.size, self.settings.timeout
+        started = time.monotonic()
+        with self._lock:
+            while not self._idle and self._checked_out >= size:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f'No database connection free after {timeout}s')
+                self._lock.wait(remaining)
+
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self._counters.waited(waited)
+
+            pooled = self._idle.pop() if self._idle else None
+            self._checked_out += 1
+
+        if pooled is not None and self._is_usable(pooled):
+            return pooled
+
+        if pooled is not None:
+            _close_quietly(pooled.connection)
+            with self._lock:
+                self._counters.recycled += 1
+
+        try:
+            pooled = _PooledConnection(_connect())
+        except Exception:
+            self._give_back_slot()
+            raise
+
+        with self._lock:
+            self._counters.created += 1
+        return pooled
+
+    def _give_back_slot(self) -> None:
+        """
+        Frees a checked out slot and wakes up one waiter.
+        """
+        with self._lock:
+            self._checked_out -= 1
+            self._lock.notify()
+
+    def release(self, pooled: _PooledConnection, discard: bool = False) -> None:
+        """
+        Returns a connection to the pool.
+
+        Args:
+            pooled: The pooled connection to return.
+            discard: Close the connection instead of keeping it around.
+        """
+        if self.pid != os.getpid():
+            # Checked out before a fork, it belongs to the parent.
+            return
+
+        if discard:
+            _close_quietly(pooled.connection)
+            self._give_back_slot()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._checked_out -= 1
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    def close_all(self) -> None:
+        """
+        Closes every idle connection in the pool.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for pooled in idle:
+            _close_quietly(pooled.connection)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the current usage numbers of the pool.
+
+        Returns:
+            A dict of the pool size, usage and wait times.
+        """
+        with self._lock:
+            return {
+                'size': self.settings.size,
+                'checkedOut': self._checked_out,
+                'idle': len(self._idle),
+                **self._counters.as_dict(),
+                'pid': self.pid
+            }
+
+
+_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the pool for this process, creating it on first use.
+
+    Returns:
+        The connection pool.
+    """
+    global _POOL  # pylint: disable=global-statement
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ConnectionPool(
+                    size=int(os.environ.get('DB_POOL_SIZE', '4')),
+                    timeout=float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+                    max_age=float(os.environ.get('DB_POOL_MAX_AGE', '1800')),
+                    ping_idle=float(os.environ.get('DB_POOL_PING_IDLE', '30')))
+    return _POOL
+
+
+def pool_stats() -> Dict[str, Any]:
+    """
+    Returns the usage numbers of this process' connection pool.
+
+    Returns:
+        A dict of the pool stats.
+    """
+    return get_pool().stats()
+
+
+def _reset_pool_in_child() -> None:
+    """
+    Throws away the inherited pool in a freshly forked process.
+    """
+    global _POOL  # pylint: disable=global-statement
+    global _POOL_LOCK  # pylint: disable=global-statement
+    _POOL = None
+    _POOL_LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_in_child)
+
+
+class CircuitBreaker:
+    """
+    Counts the connection failures in a row of this process, and once there
+    are too many fails every database access at once for a while. Then a
+    single probe is let through, its success closes the breaker again.
+    """
+
+    def __init__(self, failures: int, reset_timeout: float) -> None:
+        """
+        The constructor of the CircuitBreaker class.
+
+        Args:
+            failures: The failures in a row that open the breaker.
+            reset_timeout: Seconds the breaker stays open before a probe.
+        """
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._counts = {'opened': 0, 'rejected': 0}
+
+    def before(self) -> None:
+        """
+        Checks the breaker before touching the database.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or another caller is
+                              already probing the database.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                self._counts['rejected'] += 1
+                raise CircuitOpenError(2003, 'The database circuit breaker is open')
+            self._probing = True
+
+    def success(self) -> None:
+        """
+        Records that the database answered, closing the breaker.
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def abort(self) -> None:
+        """
+        Records that a caller never reached the database, so another one
+        may probe it.
+        """
+        with self._lock:
+            self._probing = False
+
+    def failure(self) -> None:
+        """
+        Records a connection failure, opening the breaker after too many.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failures:
+                if self._opened_at is None:
+                    self._counts['opened'] += 1
+                self._opened_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        """
+        Checks if the database is being avoided right now.
+
+        Returns:
+            True while the breaker is open and not ready for a probe.
+        """
+        with self._lock:
+            return self._opened_at is not None and \
+                time.monotonic() - self._opened_at < self.reset_timeout
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the state of the breaker.
+
+        Returns:
+            A dict of the state, the failures in a row and the times it
+            opened and turned callers away.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                state = 'closed'
+            elif self._probing or \
+                    time.monotonic() - self._opened_at >= self.reset_timeout:
+                state = 'halfOpen'
+            else:
+                state = 'open'
+            return {
+                'state': state,
+                'failures': self._failures,
+                **self._counts
+            }
+
+
+BREAKER = CircuitBreaker(failures=int(os.environ.get('DB_BREAKER_FAILURES', '5')),
+                         reset_timeout=float(os.environ.get('DB_BREAKER_RESET', '10')))
+
+
+def is_connection_error(error: Optional[BaseException]) -> bool:
+    """
+    Checks if an error means the database couldn't be reached.
+
+    Args:
+        error: The error.
+
+    Returns:
+        True for connection failures, lost connections and timeouts.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, pymysql.InterfaceError):
+        return True
+    return isinstance(error, pymysql.OperationalError) and bool(error.args) \
+        and error.args[0] in CONNECTION_ERRORS
+
+
+def breaker_stats() -> Dict[str, Any]:
+    """
+    Returns the state of this process' circuit breaker.
+
+    Returns:
+        A dict of the breaker stats.
+    """
+    return BREAKER.stats()
+
+
+class QueryEvent(NamedTuple):
+    """
+    The record of one statement run through an Accessor, passed to the
+    query hooks.
+
+    Attributes:
+        call_site: The name of the function that ran the statement.
+        query: The statement.
+        params: The parameters of the statement.
+        duration: Seconds the statement took, until it failed if it did.
+        rows: The number of rows returned or affected, 0 when it failed.
+        connection: The connection the statement ran on.
+        unbuffered: If the result is still being streamed.
+        failed: If the statement raised, for example a timeout.
+    """
+    call_site: str
+    query: str
+    params: Any
+    duration: float
+    rows: int
+    connection: Any
+    unbuffered: bool
+    failed: bool = False
+
+
+QUERY_HOOKS: List[Callable[[QueryEvent], None]] = []
+
+
+def add_query_hook(hook: Callable[[QueryEvent], None]) -> None:
+    """
+    Registers a function called after every statement run through an
+    Accessor, for example to record metrics.
+
+    Args:
+        hook: The function, it receives a QueryEvent.
+    """
+    if hook not in QUERY_HOOKS:
+        QUERY_HOOKS.append(hook)
+
+
+class _InstrumentedCursor:
+    """
+    A cursor wrapper timing every statement and passing it to the hooks.
+    """
+
+    def __init__(self, cursor: Any, connection: Any) -> None:
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _run(self, method: Callable, query: str, params: Any) -> Any:
+        """
+        Runs a statement and reports it to the hooks, failed or not.
+
+        Args:
+            method: The cursor method to run it with.
+            query: The statement.
+            params: The parameters of the statement.
+
+        Returns:
+            The result of the cursor method.
+        """
+        # Two frames up is the function that called execute.
+        call_site = sys._getframe(2).f_code.co_name  # pylint: disable=protected-access
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(query, params)
+            failed = False
+        finally:
+            event = QueryEvent(call_site, query, params, time.perf_counter() - started,
+                               0 if failed else max(self._cursor.rowcount or 0, 0),
+                               self._connection,
+                               isinstance(self._cursor, pymysql.cursors.SSCursor),
+                               failed)
+            for hook in QUERY_HOOKS:
+                try:
+                    hook(event)
+                except Exception:  # pylint: disable=broad-except
+                    pass
+        return result
+
+    def execute(self, query: str, params: Any = None) -> Any:
+        """
+        Executes a statement.
+        """
+        return self._run(self._cursor.execute, query, params)
+
+    def executemany(self, query: str, params: Any) -> Any:
+        """
+        Executes a statement once per set of parameters.
+        """
+        return self._run(self._cursor.executemany, query, params)
 
 
 class Accessor:
@@ -13,17 +654,24 @@ class Accessor:
     This class is designed to contain all the database access logic.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, cursor_class: Any = None, dedicated: bool = False) -> None:
         """
         The constructor of the Accessor class.
 
-        We create a database connection to be used.
+        The database connection is checked out of the pool when the
+        context manager is entered.
+
+        Args:
+            cursor_class: An optional pymysql cursor class, for example
+                          pymysql.cursors.SSCursor to stream large results.
+            dedicated: Open a connection of its own, closed on exit, instead
+                       of using the pool. A long lived stream then doesn't
+                       hold one of the few pooled connections.
         """
-        self.connection = pymysql.connect(host=os.environ['DB_SERVER'],
-                                          user=os.environ['DB_USERNAME'],
-                                          password=os.environ['DB_PASSWORD'],
-                                          database=os.environ['DB_DATABASE'],
-                                          port=int(os.environ['DB_PORT']))
+        self.cursor_class = cursor_class
+        self.dedicated = dedicated
+        self.pooled: Optional[_PooledConnection] = None
+        self.connection: Any = None
         self.cursor = None
 
     def __enter__(self):
@@ -36,7 +684,24 @@ class Accessor:
         Returns:
             A cursor to execute queries on.
         """
-        self.cursor = self.connection.cursor()
+        BREAKER.before()
+        try:
+            if self.dedicated:
+                self.connection = _connect()
+            else:
+                self.pooled = get_pool().acquire()
+                self.connection = self.pooled.connection
+        except Exception as error:
+            # Only a failed connect counts against the database, a pool
+            # timeout or a bug never reached it.
+            if isinstance(error, pymysql.OperationalError):
+                BREAKER.failure()
+            else:
+                BREAKER.abort()
+            raise
+        self.cursor = self.connection.cursor(self.cursor_class)
+        if QUERY_HOOKS:
+            return _InstrumentedCursor(self.cursor, self.connection)
         return self.cursor
 
     def __exit__(self,
@@ -47,19 +712,60 @@ class Accessor:
         The exit of the Accessor class for a context manager.
 
         This designed to be used as a context manager and handles
-        the cleanup of the cursor and database connection.
+        the cleanup of the cursor and hands the connection back to the pool.
+        A failed statement is rolled back so the next user of the
+        connection doesn't inherit a half finished transaction.
 
         Args:
             ex_type: The exception type.
             ex_value: The exception value.
             traceback: The traceback for the exception.
         """
-        _, _, _ = ex_type, ex_value, traceback
-        self.connection.commit()
+        _ = traceback
+        if is_connection_error(ex_value):
+            BREAKER.failure()
+        else:
+            BREAKER.success()
+
+        if ex_type is not None and isinstance(self.cursor,
+                                              pymysql.cursors.SSCursor):
+            # Closing an unbuffered cursor reads the rest of its result,
+            # dropping the connection is far cheaper.
+            self.cursor = None
+            self._hand_back(discard=True)
+            return
+
+        discard = False
+        try:
+            if ex_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        except Exception:  # pylint: disable=broad-except
+            discard = True
+
         if self.cursor is not None:
-            self.cursor.close()
+            try:
+                self.cursor.close()
+            except Exception:  # pylint: disable=broad-except
+                discard = True
+            self.cursor = None
 
-        self.connection.close()
+        self._hand_back(discard)
+
+    def _hand_back(self, discard: bool) -> None:
+        """
+        Returns the connection to the pool, or closes a dedicated one.
+
+        Args:
+            discard: Close a pooled connection instead of keeping it around.
+        """
+        if self.pooled is not None:
+            get_pool().release(self.pooled, discard=discard)
+        elif self.connection is not None:
+            _close_quietly(self.connection)
+        self.pooled = None
+        self.connection = None
 
     def show_tables(self) -> List[str]:
         """
@@ -72,6 +778,6 @@ class Accessor:
             The name of all the tables.
         """
         query = 'SHOW TABLES'
-        with self.connection as cursor:
+        with self as cursor:
             cursor.execute(query)
             return [columns[0] for columns in cursor.fetchall()]
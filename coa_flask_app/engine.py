@@ -0,0 +1,453 @@
+"""
+A module designed to hold the optional in-memory aggregation engine.
+
+The engine loads the summary view once into NumPy columns and keeps, for
+every site, town and county, a running total of each item by date.
+The quantity of each item over any date range is then the difference of
+two prefix rows, so the dashboards can sweep date ranges without
+sending a GROUP BY to MySQL for every step.
+
+The loaded data is tagged with the data version and the shared cache
+generation, and reloaded as soon as either moves, so every worker answers
+with the data behind the current ETags and cache keys.
+
+NumPy is an optional dependency, without it (or when disabled) every
+caller falls back to the SQL queries. The engine is tuned with the
+following environment variables:
+    AGGREGATION_ENGINE        - Set to 'columnar' to enable the engine.
+    ENGINE_MEMORY_BUDGET_MB   - The max size of the prefix tables (default 256).
+    ENGINE_MAX_AGE            - Seconds before the data is reloaded even if
+                                it hasn't changed (default 600).
+"""
+
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from coa_flask_app import data_version, shared_cache
+from coa_flask_app.db_accessor import Accessor
+
+np: Any
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # pylint: disable=invalid-name
+
+
+LOCATION_CATEGORIES = ('site_name', 'town', 'county')
+
+
+class MemoryBudgetError(Exception):
+    """
+    Raised when the prefix tables would not fit in the memory budget.
+    """
+
+
+def _parse_day(day: str) -> Optional[date]:
+    """
+    Parses a date in the loose Y-m-d form the routes accept.
+
+    Args:
+        day: The date string, for example 2016-1-1.
+
+    Returns:
+        The date, or None if it could not be parsed.
+    """
+    try:
+        return datetime.strptime(day, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+class _PrefixTable:
+    """
+    The running item totals by date for every location of one category.
+
+    For a location the rows offsets[i]:offsets[i + 1] of totals hold a zero
+    row followed by the cumulative item quantities on each day in days.
+    """
+
+    def __init__(self, names: List[str], days: Any, offsets: Any,
+                 totals: Any) -> None:
+        self.index = {name: i for i, name in enumerate(names)}
+        self.days = days
+        self.offsets = offsets
+        self.totals = totals
+
+    def location_days(self, name: str) -> Tuple[Any, int]:
+        """
+        Returns the days a location has data for and where its rows start.
+
+        Args:
+            name: The name of the location.
+
+        Returns:
+            The sorted days of the location and the offset of its zero row.
+        """
+        loc = self.index[name]
+        start, end = self.offsets[loc], self.offsets[loc + 1]
+        # The day of row r lives at days[r - loc - 1], skipping the zero rows.
+        return self.days[start - loc:end - loc - 1], start
+
+    def range_totals(self, name: str, first: date, last: date) -> Any:
+        """
+        Returns the quantity of each item in a date range.
+
+        Args:
+            name: The name of the location.
+            first: The first day, inclusive.
+            last: The last day, inclusive.
+
+        Returns:
+            A vector of quantities indexed like the engine's items.
+        """
+        days, start = self.location_days(name)
+        low = np.searchsorted(days, np.datetime64(first, 'D'), side='left')
+        high = np.searchsorted(days, np.datetime64(last, 'D'), side='right')
+        return self.totals[start + high] - self.totals[start + low]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory held by the table.
+        """
+        return self.days.nbytes + self.offsets.nbytes + self.totals.nbytes
+
+
+class ColumnarEngine:  # pylint: disable=too-many-instance-attributes
+    """
+    The in-memory columnar copy of the summary view with prefix sums.
+    """
+
+    def __init__(self, rows: List[Tuple[Any, ...]], memory_budget: int) -> None:
+        """
+        The constructor of the ColumnarEngine class.
+
+        Args:
+            rows: The rows of site, town, county, volunteer date, item id,
+                  item name, category, material, and quantity.
+            memory_budget: The max bytes the prefix tables may take.
+
+        Raises:
+            MemoryBudgetError: If the tables would not fit in the budget.
+        """
+        self.loaded_at = time.monotonic()
+        self.row_count = len(rows)
+
+        # Items are grouped by name like the SQL's GROUP BY item_name, and
+        # reported with the id, category and material of the lowest id of
+        # the name, where MySQL picks any row of the group.
+        items: Dict[str, Tuple[int, str, str, str]] = {}
+        for row in sorted(rows, key=lambda row: row[4], reverse=True):
+            items[row[5]] = (row[4], row[5], row[6], row[7])
+        # The output order matches MySQL's GROUP BY item_name ordering.
+        self.items = [items[name] for name in sorted(items)]
+        item_index = {item[1]: i for i, item in enumerate(self.items)}
+
+        self.day = np.array([row[3] for row in rows], dtype='datetime64[D]')
+        self.item = np.array([item_index[row[5]] for row in rows],
+                             dtype=np.int64)
+        self.quantity = np.array([row[8] or 0 for row in rows], dtype=np.int64)
+
+        self.locations: Dict[str, Any] = {}
+        self.location_names: Dict[str, List[str]] = {}
+        for column, category in enumerate(LOCATION_CATEGORIES):
+            names, codes = np.unique(np.array([row[column] for row in rows],
+                                              dtype=object).astype(str),
+                                     return_inverse=True)
+            self.location_names[category] = [str(name) for name in names]
+            self.locations[category] = codes
+
+        self._check_budget(memory_budget)
+        self.tables = {category: self._build_table(category)
+                       for category in LOCATION_CATEGORIES}
+
+    def _location_days(self, category: str) -> Tuple[Any, Any]:
+        """
+        Groups the rows by location and day.
+
+        Args:
+            category: The category of location.
+
+        Returns:
+            The unique (location, day) keys and each row's key index.
+        """
+        day_numbers = self.day.astype(np.int64)
+        first_day = day_numbers.min() if day_numbers.size else 0
+        span = (day_numbers.max() - first_day + 1) if day_numbers.size else 1
+        keys = self.locations[category] * span + (day_numbers - first_day)
+        return np.unique(keys, return_inverse=True)
+
+    def _check_budget(self, memory_budget: int) -> None:
+        """
+        Makes sure the prefix tables will fit in the memory budget.
+
+        Args:
+            memory_budget: The max bytes the prefix tables may take.
+
+        Raises:
+            MemoryBudgetError: If the tables would not fit.
+        """
+        needed = 0
+        for category in LOCATION_CATEGORIES:
+            groups = self._location_days(category)[0].size
+            locations = len(self.location_names[category])
+            needed += (groups + locations) * len(self.items) * 8
+
+        if needed > memory_budget:
+            raise MemoryBudgetError(
+                f'Prefix tables need {needed} bytes, budget is {memory_budget}')
+
+    def _build_table(self, category: str) -> _PrefixTable:
+        """
+        Builds the running item totals by date for one category of location.
+
+        Args:
+            category: The category of location.
+
+        Returns:
+            The prefix table.
+        """
+        keys, group = self._location_days(category)
+        per_day = np.zeros((keys.size, len(self.items)), dtype=np.int64)
+        np.add.at(per_day, (group, self.item), self.quantity)
+
+        # The day of each group, in location then day order.
+        group_day = np.zeros(keys.size, dtype='datetime64[D]')
+        group_day[group] = self.day
+        group_location = np.zeros(keys.size, dtype=np.int64)
+        group_location[group] = self.locations[category]
+
+        locations = len(self.location_names[category])
+        counts = np.bincount(group_location, minlength=locations)
+        offsets = np.zeros(locations + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts + 1)
+
+        totals = np.zeros((keys.size + locations, len(self.items)),
+                          dtype=np.int64)
+        group_start = 0
+        for loc in range(locations):
+            group_end = group_start + counts[loc]
+            start = offsets[loc]
+            np.cumsum(per_day[group_start:group_end], axis=0,
+                      out=totals[start + 1:start + 1 + counts[loc]])
+            group_start = group_end
+
+        return _PrefixTable(self.location_names[category], group_day, offsets,
+                            totals)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory held by the engine's columns and tables.
+        """
+        columns = (self.day.nbytes + self.item.nbytes + self.quantity.nbytes
+                   + sum(codes.nbytes for codes in self.locations.values()))
+        return columns + sum(table.nbytes for table in self.tables.values())
+
+    def item_breakdown(self,
+                       location_category: str,
+                       location_name: str,
+                       start_date: str,
+                       end_date: str) -> List[Tuple[int, str, str, str, int]]:
+        """
+        Returns a list of tuples comprising of the item id, item name,
+        category, material, and quantity, the same as site.item_breakdown.
+
+        Like the SQL, items are grouped by name and items totalling 0 in the
+        date range are left out.
+
+        Args:
+            location_category: The type of location.
+            location_name: The name of the location.
+            start_date: The start date.
+            end_date: The end date.
+
+        Returns:
+            A list of item id, item name, category, material, quantity.
+        """
+        first, last = _parse_day(start_date), _parse_day(end_date)
+        table = self.tables.get(location_category)
+        if (table is None or first is None or last is None or last < first
+                or location_name not in table.index):
+            return []
+
+        totals = table.range_totals(location_name, first, last)
+        return [(*item, int(total))
+                for item, total in zip(self.items, totals.tolist()) if total]
+
+    def valid_date_range(self,
+                         location_category: str,
+                         location_name: str) -> Optional[Tuple[date, date]]:
+        """
+        Returns the first and last day a location has data for.
+
+        Args:
+            location_category: The category of location.
+            location_name: The name of the location.
+
+        Returns:
+            The first and last day, or None if the location is unknown.
+        """
+        table = self.tables.get(location_category)
+        if table is None or location_name not in table.index:
+            return None
+
+        days, _ = table.location_days(location_name)
+        return days[0].item(), days[-1].item()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the size of the loaded data.
+
+        Returns:
+            A dict of the row, item and location counts and memory use.
+        """
+        return {
+            'rows': self.row_count,
+            'items': len(self.items),
+            'locations': {category: len(names)
+                          for category, names in self.location_names.items()},
+            'bytes': self.nbytes,
+            'age': round(time.monotonic() - self.loaded_at, 3)
+        }
+
+
+def load_rows() -> List[Tuple[Any, ...]]:
+    """
+    Reads the whole summary view.
+
+    Returns:
+        The rows of site, town, county, volunteer date, item id, item name,
+        category, material, and quantity.
+    """
+    query = """
+            SELECT
+                site_name,
+                town,
+                county,
+                volunteer_date,
+                item_id,
+                item_name,
+                category,
+                material,
+                quantity
+            FROM coa_summary_view
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query)
+        return list(db_handle.fetchall())
+
+
+_ENGINE: Optional[ColumnarEngine] = None
+_ENGINE_VERSION: Optional[Tuple[int, str]] = None
+# refresh() bumps the requested count, a successful load catches up to the
+# count it started at, so a refresh during a load or a failed load is kept.
+_REFRESHES = {'requested': 1, 'loaded': 0}
+_DISABLED_REASON: Optional[str] = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    """
+    Checks if the engine is turned on and NumPy is installed.
+
+    Returns:
+        True if the engine should be used.
+    """
+    return (np is not None
+            and os.environ.get('AGGREGATION_ENGINE', '') == 'columnar')
+
+
+def current_version() -> Tuple[int, str]:
+    """
+    Returns the version of the data the engine must be loaded at.
+
+    The shared cache generation moves as soon as any worker of the host
+    writes, the data version when a write lands from anywhere.
+
+    Returns:
+        The shared cache generation and the data version.
+    """
+    shared = shared_cache.get_cache()
+    return (shared.generation() if shared is not None else 0,
+            data_version.current())
+
+
+def get_engine() -> Optional[ColumnarEngine]:
+    """
+    Returns the loaded engine, reloading it when the data changed or it is
+    too old.
+
+    Returns:
+        The engine, or None if it is disabled or the data doesn't fit.
+    """
+    global _ENGINE, _ENGINE_VERSION, _DISABLED_REASON  # pylint: disable=global-statement
+    if not enabled():
+        return None
+
+    max_age = float(os.environ.get('ENGINE_MAX_AGE', '600'))
+    version = current_version()
+
+    def fresh() -> bool:
+        return not _stale() and _ENGINE_VERSION == version and (
+            _ENGINE is None or time.monotonic() - _ENGINE.loaded_at < max_age)
+
+    if fresh():
+        return _ENGINE
+
+    with _ENGINE_LOCK:
+        if not fresh():
+            budget = int(os.environ.get('ENGINE_MEMORY_BUDGET_MB', '256'))
+            # The version is read before the rows, so the rows are never
+            # older than the version they are tagged with.
+            requested = _REFRESHES['requested']
+            try:
+                _ENGINE = ColumnarEngine(load_rows(), budget * 1024 * 1024)
+                _DISABLED_REASON = None
+            except MemoryBudgetError as error:
+                _ENGINE = None
+                _DISABLED_REASON = str(error)
+            _ENGINE_VERSION = version
+            _REFRESHES['loaded'] = requested
+
+        return _ENGINE
+
+
+def _stale() -> bool:
+    """
+    Checks if a refresh was asked for since the data was loaded.
+
+    Returns:
+        True if the data must be reloaded.
+    """
+    return _REFRESHES['loaded'] != _REFRESHES['requested']
+
+
+def refresh() -> None:
+    """
+    Marks the loaded data as stale so it is reloaded on next use.
+
+    This is the hook to call whenever the underlying data changes, the
+    other workers reload when they see the new cache generation.
+    """
+    _REFRESHES['requested'] += 1
+
+
+def engine_stats() -> Dict[str, Any]:
+    """
+    Returns the state of the engine.
+
+    Returns:
+        A dict of whether the engine is enabled and the size of its data.
+    """
+    engine = _ENGINE
+    return {
+        'enabled': enabled(),
+        'stale': _stale(),
+        'version': list(_ENGINE_VERSION) if _ENGINE_VERSION is not None else None,
+        'disabledReason': _DISABLED_REASON,
+        'data': engine.stats() if engine is not None else None
+    }
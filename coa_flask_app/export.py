@@ -0,0 +1,136 @@
+"""
+A module designed to hold the streaming export of the contribution data.
+
+Rows are read with an unbuffered cursor and written out as they arrive,
+so memory stays flat no matter how many rows are exported. Each stream
+reads over a dedicated connection, so a slow download never holds one of
+the pooled connections the other requests share.
+"""
+
+import csv
+import io
+import itertools
+import json
+import zlib
+from typing import Any, Iterable, Iterator, Tuple
+
+import pymysql.cursors
+
+from coa_flask_app.db_accessor import Accessor
+
+
+COLUMNS = ('site_name', 'town', 'county', 'volunteer_date', 'item_id',
+           'item_name', 'category', 'material', 'quantity')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(location_category: str,
+                location_name: str,
+                start_date: str,
+                end_date: str) -> Iterator[Tuple[Any, ...]]:
+    """
+    Streams the summary rows of a location and date range.
+
+    Args:
+        location_category: The category of location, site, town, or county.
+        location_name: The name of the location.
+        start_date: The start date.
+        end_date: The end date.
+
+    Yields:
+        The rows in the order of COLUMNS.
+    """
+    if location_category not in {'site_name', 'town', 'county'}:
+        return
+
+    query = """
+            SELECT
+                """ + ',\n                '.join(COLUMNS) + """
+            FROM coa_summary_view
+            WHERE %s <= volunteer_date
+                AND volunteer_date <= %s
+                AND """ + location_category + """ = %s
+            ORDER BY volunteer_date
+            """
+    with Accessor(pymysql.cursors.SSCursor, dedicated=True) as db_handle:
+        db_handle.execute(query, (start_date,
+                                  end_date,
+                                  location_name))
+        yield from db_handle
+
+
+def _buffered(pieces: Iterable[str]) -> Iterator[bytes]:
+    """
+    Groups small pieces of text into chunks of about CHUNK_SIZE bytes.
+
+    Args:
+        pieces: The text to group.
+
+    Yields:
+        The encoded chunks.
+    """
+    buffer = io.StringIO()
+    for piece in pieces:
+        buffer.write(piece)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer = io.StringIO()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def to_csv(rows: Iterable[Tuple[Any, ...]]) -> Iterator[bytes]:
+    """
+    Writes rows as CSV with a header line.
+
+    Args:
+        rows: The rows in the order of COLUMNS.
+
+    Yields:
+        The CSV in chunks.
+    """
+    def lines():
+        line = io.StringIO()
+        writer = csv.writer(line)
+        for row in itertools.chain([COLUMNS], rows):
+            writer.writerow(row)
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+
+    return _buffered(lines())
+
+
+def to_ndjson(rows: Iterable[Tuple[Any, ...]]) -> Iterator[bytes]:
+    """
+    Writes rows as newline delimited json objects.
+
+    Args:
+        rows: The rows in the order of COLUMNS.
+
+    Yields:
+        The NDJSON in chunks.
+    """
+    return _buffered(json.dumps(dict(zip(COLUMNS, row)), default=str) + '\n'
+                     for row in rows)
+
+
+def gzipped(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Gzips a stream of chunks on the fly.
+
+    Args:
+        chunks: The chunks to compress.
+
+    Yields:
+        The compressed chunks.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
@@ -0,0 +1,181 @@
+"""
+A module designed to hold the fast JSON serialization of responses.
+
+orjson is used when it is installed, otherwise the standard library json.
+Payloads that are the same for every caller between writes, like the
+locations hierarchy and the trash items, are serialized and compressed
+once per data version and served as bytes.
+"""
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from flask import Flask, Response, request
+
+DefaultJSONProvider: Any
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # pragma: no cover, Flask before 2.2
+    DefaultJSONProvider = None  # pylint: disable=invalid-name
+
+from coa_flask_app import cache, compression, data_version
+
+orjson: Any
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
+
+# orjson writes floats below 1e-4 or in exponent form differently.
+_FLOAT_MISMATCH = re.compile(rb'\de|0\.0000')
+
+
+def _flask_default() -> Callable[[Any], Any]:
+    """
+    Returns the conversion jsonify applies to the values json doesn't know,
+    like dates, UUIDs and dataclasses.
+
+    Returns:
+        The conversion function.
+    """
+    if DefaultJSONProvider is not None:
+        return DefaultJSONProvider.default
+    from flask.json import JSONEncoder  # type: ignore # pylint: disable=import-outside-toplevel
+    return JSONEncoder().default
+
+
+_default = _flask_default()
+
+
+def dumps(payload: Any) -> bytes:
+    """
+    Serializes a payload to the same bytes jsonify produces, compact with
+    sorted keys and ASCII only, without the trailing newline.
+
+    orjson is used for payloads it writes the same way, anything else,
+    like non string keys, non ASCII text or very small or large floats,
+    goes through the standard library json.
+
+    Args:
+        payload: The payload.
+
+    Returns:
+        The json bytes.
+    """
+    if orjson is not None:
+        try:
+            # Dates and dataclasses go through jsonify's conversion.
+            body = orjson.dumps(payload, default=_default,
+                                option=orjson.OPT_SORT_KEYS
+                                | orjson.OPT_PASSTHROUGH_DATETIME
+                                | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except TypeError:
+            pass
+        else:
+            if body.isascii() and not _FLOAT_MISMATCH.search(body):
+                return body
+    return json.dumps(payload, default=_default, sort_keys=True,
+                      separators=(',', ':')).encode()
+
+
+def init_app(app: Flask) -> None:
+    """
+    Makes jsonify use the fast encoder, through a JSON provider on Flask
+    2.2 and later and through the JSON encoder class before.
+
+    Args:
+        app: The Flask app.
+    """
+    if DefaultJSONProvider is None:
+        from flask.json import JSONEncoder  # type: ignore # pylint: disable=import-outside-toplevel
+
+        class FastJSONEncoder(JSONEncoder):  # pylint: disable=too-few-public-methods
+            """
+            A JSON encoder serializing with the fast encoder.
+            """
+
+            def encode(self, o: Any) -> str:
+                """
+                Serializes with the fast encoder when called like jsonify.
+                """
+                compact = (self.indent is None and self.item_separator == ','
+                           and self.key_separator == ':')
+                if compact and self.sort_keys and self.ensure_ascii:
+                    return dumps(o).decode()
+                return super().encode(o)
+
+        app.json_encoder = FastJSONEncoder  # type: ignore
+        return
+
+    class FastJSONProvider(DefaultJSONProvider):
+        """
+        A JSON provider serializing with the fast encoder.
+        """
+
+        def dumps(self, obj: Any, **kwargs: Any) -> str:
+            # jsonify only asks for compact separators outside debug mode.
+            compact = kwargs == {'separators': (',', ':')}
+            if compact and self.sort_keys and self.ensure_ascii:
+                return dumps(obj).decode()
+            return super().dumps(obj, **kwargs)
+
+    app.json = FastJSONProvider(app)
+
+
+PAYLOADS: Dict[str, Callable[[], Any]] = {}
+_PAYLOADS: Dict[str, Tuple[str, bytes, Dict[str, bytes]]] = {}
+_PAYLOADS_LOCK = threading.Lock()
+
+
+def register_payload(name: str, build: Callable[[], Any]) -> None:
+    """
+    Registers a stable payload served from pre-serialized bytes.
+
+    Args:
+        name: The name of the payload.
+        build: The function building the payload.
+    """
+    PAYLOADS[name] = build
+
+
+def payload_bytes(name: str) -> Tuple[bytes, Dict[str, bytes]]:
+    """
+    Returns the serialized and compressed bytes of a stable payload,
+    building them once per data version.
+
+    Args:
+        name: The name of the payload.
+
+    Returns:
+        The json bytes and their compressed variants by encoding.
+    """
+    version = data_version.current()
+    cached = _PAYLOADS.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    # jsonify ends its body with a newline.
+    body = dumps(PAYLOADS[name]()) + b'\n'
+    variants = compression.compress_all(body)
+    # The body is only kept if the version didn't move while it was built.
+    if not cache.served_stale() and data_version.current() == version:
+        with _PAYLOADS_LOCK:
+            _PAYLOADS[name] = (version, body, variants)
+    return body, variants
+
+
+def payload_response(name: str) -> Response:
+    """
+    Responds with a stable payload, compressed when the client accepts it.
+
+    Args:
+        name: The name of the payload.
+
+    Returns:
+        The response.
+    """
+    body, variants = payload_bytes(name)
+    return compression.encoded_response(body, variants, 'application/json',
+                                        request.accept_encodings)[0]
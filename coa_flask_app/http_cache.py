@@ -0,0 +1,113 @@
+"""
+A module designed to hold the HTTP caching logic of the read routes.
+
+Every read route gets a strong ETag built from the request and the data
+version, so a client revalidating with If-None-Match is answered with a
+304 without running any SQL or serializing the body. The body is then
+compressed once and kept by ETag, so the same request for the same data
+is answered from the kept bytes in the encoding the client accepts.
+Responses holding stale data are marked with X-Data-Stale and are neither
+kept nor cached by clients.
+The freshness is set with the following environment variable:
+    HTTP_MAX_AGE - Seconds clients may reuse a response without
+                   revalidating (default 0, always revalidate).
+"""
+
+import functools
+import hashlib
+import os
+from datetime import date
+from typing import Callable
+
+from flask import make_response, request
+
+from coa_flask_app import admission, cache, compression, data_version
+
+
+def request_etag(version: str) -> str:
+    """
+    Builds the ETag of the current request for a data version.
+
+    The date is part of it since the routes default the end date to today.
+
+    Args:
+        version: The data version.
+
+    Returns:
+        The ETag value.
+    """
+    args = sorted(request.args.items(multi=True))
+    key = repr((request.path, args, date.today().isoformat(), version))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional(view: Callable) -> Callable:
+    """
+    Adds ETag and Cache-Control headers to a read route and answers
+    matching If-None-Match requests with a 304.
+
+    The cached results are keyed on the data version, so a body built while
+    the version stayed the same is never older than its ETag. A body built
+    across a version change gets no ETag and isn't kept. Only a request
+    missing the cache takes an admission slot.
+
+    Args:
+        view: The route function.
+
+    Returns:
+        The wrapped route function.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = data_version.current()
+        etag = request_etag(version)
+        encodings = {etag: None, **{f'{etag}-{suffix}': suffix
+                                    for suffix in compression.ENCODINGS}}
+        matched = [tag for tag in encodings if tag in request.if_none_match]
+        encoding = None
+        if matched:
+            # Answered with the exact representation the client holds.
+            encoding = encodings[matched[0]]
+            response = make_response('', 304)
+            response.vary.add('Accept-Encoding')
+        else:
+            found, cached = compression.RESPONSE_CACHE.get(etag)
+            if not found:
+                rejected = admission.admit_request()
+                if rejected is not None:
+                    return rejected
+                response = make_response(view(*args, **kwargs))
+                encoding = response.headers.get('Content-Encoding')
+                if cache.served_stale():
+                    response.headers['X-Data-Stale'] = 'true'
+                    response.cache_control.no_store = True
+                    return response
+
+                if data_version.current() != version:
+                    response.cache_control.no_cache = True
+                    return response
+
+                if (response.status_code == 200 and encoding is None
+                        and not response.direct_passthrough):
+                    body = response.get_data()
+                    cached = (body, compression.compress_all(body), response.mimetype)
+                    compression.RESPONSE_CACHE.set(etag, cached)
+                    found = True
+
+            if found:
+                body, variants, mimetype = cached
+                response, encoding = compression.encoded_response(
+                    body, variants, mimetype, request.accept_encodings)
+
+        if response.status_code in {200, 304}:
+            # Every encoding of the body is a different representation.
+            response.set_etag(f'{etag}-{encoding}' if encoding else etag)
+            max_age = int(os.environ.get('HTTP_MAX_AGE', '0'))
+            response.cache_control.public = True
+            if max_age > 0:
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.no_cache = True
+        return response
+
+    return admission.admit_on_miss(wrapper)
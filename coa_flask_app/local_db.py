@@ -0,0 +1,305 @@
+"""
+A module designed to hold a local SQLite stand-in for the MySQL database.
+
+It is used by the benchmarks and for development without access to the
+real database. The connection mimics the parts of pymysql the app uses,
+%s parameters, tuple parameters for IN, the coa schema and DATE values.
+The secondary KEY definitions of a CREATE TABLE are dropped, and the daily
+rollup's MySQL only upsert is not supported.
+
+Select it with the following environment variables:
+    DB_BACKEND     - Set to sqlite to use the stand-in.
+    DB_SQLITE_PATH - The database file (default coa_local.sqlite3).
+"""
+
+import re
+import sqlite3
+from datetime import date
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pymysql
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS coa.site_info
+    (site_id INTEGER PRIMARY KEY,
+     site_name TEXT NOT NULL,
+     town TEXT NOT NULL,
+     county TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS coa.item
+    (item_id INTEGER PRIMARY KEY,
+     material TEXT NOT NULL,
+     category TEXT NOT NULL,
+     item_name TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS coa.team_info
+    (team_id INTEGER PRIMARY KEY AUTOINCREMENT,
+     site_id INTEGER NOT NULL,
+     volunteer_date DATE NOT NULL,
+     team_captain TEXT,
+     num_of_people INTEGER,
+     num_of_trashbags INTEGER,
+     trash_weight REAL,
+     walking_distance REAL,
+     updated_by TEXT);
+
+CREATE TABLE IF NOT EXISTS coa.volunteer_info
+    (volunteer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+     team_id INTEGER NOT NULL,
+     item_id INTEGER NOT NULL,
+     quantity INTEGER NOT NULL,
+     brand TEXT,
+     updated_by TEXT,
+     event_code TEXT);
+
+CREATE INDEX IF NOT EXISTS coa.volunteer_team ON volunteer_info (team_id);
+
+CREATE VIEW IF NOT EXISTS coa.coa_summary_view AS
+    SELECT
+        site_info.site_name,
+        site_info.town,
+        site_info.county,
+        team_info.volunteer_date,
+        item.item_id,
+        item.item_name,
+        item.category,
+        item.material,
+        volunteer_info.quantity,
+        volunteer_info.brand
+    FROM team_info
+    JOIN site_info ON site_info.site_id = team_info.site_id
+    JOIN volunteer_info ON volunteer_info.team_id = team_info.team_id
+    JOIN item ON item.item_id = volunteer_info.item_id;
+"""
+
+_LOOSE_DATE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+_ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_KEY_DEFINITION = re.compile(r',\s*KEY\s+\w+\s*\([^)]*\)')
+
+
+def _param(value: Any) -> Any:
+    """
+    Converts a query parameter the way MySQL would coerce it.
+
+    Args:
+        value: The parameter.
+
+    Returns:
+        The SQLite parameter, loose dates like 2016-1-1 are zero padded
+        so they compare correctly with the stored dates.
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str):
+        match = _LOOSE_DATE.match(value)
+        if match:
+            year, month, day = (int(part) for part in match.groups())
+            return f'{year:04d}-{month:02d}-{day:02d}'
+    return value
+
+
+def _value(value: Any) -> Any:
+    """
+    Converts a result value the way pymysql would return it.
+
+    Args:
+        value: The SQLite value.
+
+    Returns:
+        The value, with ISO dates as date objects.
+    """
+    if isinstance(value, str) and _ISO_DATE.match(value):
+        return date.fromisoformat(value)
+    return value
+
+
+def translate(query: str, params: Optional[Sequence[Any]]) -> Tuple[str, List[Any]]:
+    """
+    Translates a pymysql query and its parameters for SQLite.
+
+    Args:
+        query: The query with %s placeholders.
+        params: The parameters, a tuple or list parameter expands for IN.
+
+    Returns:
+        The query with ? placeholders and the flat parameters.
+    """
+    if 'KEY' in query:
+        query = _KEY_DEFINITION.sub('', query)
+    if params is None:
+        return query.replace('%%', '%'), []
+    if not isinstance(params, (list, tuple)):
+        params = (params,)
+
+    pieces = query.split('%s')
+    flat: List[Any] = []
+    translated = pieces[0]
+    for param, piece in zip(params, pieces[1:]):
+        if isinstance(param, (list, tuple)):
+            translated += '(' + ', '.join('?' * len(param)) + ')'
+            flat.extend(_param(value) for value in param)
+        else:
+            translated += '?'
+            flat.append(_param(param))
+        translated += piece
+
+    return translated.replace('%%', '%'), flat
+
+
+class Cursor:
+    """
+    A pymysql like cursor over a SQLite cursor.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self._cursor = cursor
+
+    def execute(self, query: str, params: Optional[Sequence[Any]] = None) -> int:
+        """
+        Executes a query.
+
+        Args:
+            query: The query with %s placeholders.
+            params: The parameters.
+
+        Returns:
+            The number of affected rows.
+        """
+        try:
+            self._cursor.execute(*translate(query, params))
+        except sqlite3.IntegrityError as error:
+            raise pymysql.IntegrityError(str(error)) from error
+        except sqlite3.DatabaseError as error:
+            raise pymysql.ProgrammingError(str(error)) from error
+        return self._cursor.rowcount
+
+    def executemany(self, query: str, params: Iterable[Sequence[Any]]) -> int:
+        """
+        Executes a query once per set of parameters.
+
+        Args:
+            query: The query with %s placeholders.
+            params: The parameters of each execution.
+
+        Returns:
+            The number of affected rows.
+        """
+        rowcount = 0
+        for param in params:
+            rowcount += self.execute(query, param)
+        return rowcount
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        """
+        The id of the last inserted row.
+        """
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self) -> int:
+        """
+        The number of rows affected by the last query.
+        """
+        return self._cursor.rowcount
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        """
+        Fetches the next row.
+
+        Returns:
+            The row, or None when there are no more.
+        """
+        row = self._cursor.fetchone()
+        return None if row is None else tuple(_value(value) for value in row)
+
+    def fetchall(self) -> Tuple[Tuple[Any, ...], ...]:
+        """
+        Fetches the remaining rows.
+
+        Returns:
+            The rows.
+        """
+        return tuple(tuple(_value(value) for value in row)
+                     for row in self._cursor.fetchall())
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        for row in self._cursor:
+            yield tuple(_value(value) for value in row)
+
+    def close(self) -> None:
+        """
+        Closes the cursor.
+        """
+        self._cursor.close()
+
+
+class Connection:
+    """
+    A pymysql like connection to the local SQLite database.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        The constructor of the Connection class.
+
+        The schema is created if the file is new.
+
+        Args:
+            path: The database file.
+        """
+        self._connection = sqlite3.connect(':memory:', timeout=30,
+                                           check_same_thread=False)
+        self._connection.execute('ATTACH DATABASE ? AS coa', (path,))
+        self._connection.create_function(
+            'IF', 3, lambda condition, then, otherwise: then if condition else otherwise)
+        self._connection.executescript(SCHEMA)
+
+    def cursor(self, cursor_class: Any = None) -> Cursor:
+        """
+        Opens a cursor, the cursor class is ignored as SQLite always streams.
+
+        Returns:
+            A cursor.
+        """
+        _ = cursor_class
+        return Cursor(self._connection.cursor())
+
+    def commit(self) -> None:
+        """
+        Commits the current transaction.
+        """
+        self._connection.commit()
+
+    def rollback(self) -> None:
+        """
+        Rolls back the current transaction.
+        """
+        self._connection.rollback()
+
+    def ping(self, reconnect: bool = False) -> None:
+        """
+        Checks the connection, a local database is always there.
+        """
+        _ = reconnect
+        self._connection.execute('SELECT 1')
+
+    def close(self) -> None:
+        """
+        Closes the connection.
+        """
+        self._connection.close()
+
+
+def connect(path: str) -> Connection:
+    """
+    Opens the local database, creating its schema when needed.
+
+    Args:
+        path: The database file.
+
+    Returns:
+        A pymysql like connection.
+    """
+    return Connection(path)
@@ -0,0 +1,503 @@
+"""
+A module designed to hold the Prometheus style metrics of the app.
+
+Every worker process writes its samples to its own memory mapped file in
+a shared directory, so a /metrics scrape served by any one worker can sum
+the whole process tree. Files of workers that have exited are folded into
+an archive file so counters survive worker recycling.
+
+The metrics are set up with the following environment variables:
+    METRICS_DIR            - The shared directory of the metric files
+                             (default metrics in the private RUNTIME_DIR).
+    METRICS_STATS_INTERVAL - Seconds between writes of a worker's pool and
+                             cache gauges (default 5).
+"""
+
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from flask import Flask, Response, g, request
+
+from coa_flask_app import cache, db_accessor, runtime_files
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HISTOGRAMS = {'coa_http_request_duration_seconds', 'coa_db_query_duration_seconds',
+              'coa_worker_first_response_seconds', 'coa_admission_wait_seconds'}
+
+LOGGER = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<Q')
+_VALUE = struct.Struct('<d')
+_LENGTH = struct.Struct('<I')
+
+
+class MmapStore:
+    """
+    A float per key store in a memory mapped file.
+
+    The file starts with the number of used bytes, followed by entries of a
+    key length, the utf8 key padded to 8 bytes and a double value.
+    """
+
+    def __init__(self, path: str, initial_size: int = 64 * 1024) -> None:
+        """
+        The constructor of the MmapStore class.
+
+        Args:
+            path: The file to store the values in.
+            initial_size: The starting size of a new file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._handle = runtime_files.open_private(path)
+        if os.fstat(self._handle.fileno()).st_size == 0:
+            self._handle.truncate(initial_size)
+        self._map = mmap.mmap(self._handle.fileno(), 0)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        self._offsets = {key: offset for key, offset, _ in _entries(self._map)}
+
+    def _grow(self, needed: int) -> None:
+        """
+        Doubles the file until the needed bytes fit.
+
+        Args:
+            needed: The number of bytes that must fit.
+        """
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._handle.truncate(size)
+        self._map = mmap.mmap(self._handle.fileno(), 0)
+
+    def _offset(self, key: str) -> int:
+        """
+        Returns the offset of a key's value, adding the key if it is new.
+
+        Args:
+            key: The key.
+
+        Returns:
+            The offset of the value.
+        """
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+
+        encoded = key.encode()
+        padded = len(encoded) + (-(_LENGTH.size + len(encoded)) % 8)
+        entry = _LENGTH.size + padded + _VALUE.size
+        if self._used + entry > len(self._map):
+            self._grow(self._used + entry)
+
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _LENGTH.size:
+                  self._used + _LENGTH.size + len(encoded)] = encoded
+        offset = self._used + _LENGTH.size + padded
+        _VALUE.pack_into(self._map, offset, 0.0)
+        self._used += entry
+        # The used size is written last so readers never see half an entry.
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+    def add(self, key: str, amount: float) -> None:
+        """
+        Adds to a key's value.
+
+        Args:
+            key: The key.
+            amount: The amount to add.
+        """
+        with self._lock:
+            offset = self._offset(key)
+            _VALUE.pack_into(self._map, offset,
+                             _VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key: str, value: float) -> None:
+        """
+        Sets a key's value.
+
+        Args:
+            key: The key.
+            value: The value.
+        """
+        with self._lock:
+            _VALUE.pack_into(self._map, self._offset(key), value)
+
+    def close(self) -> None:
+        """
+        Unmaps and closes the file.
+        """
+        with self._lock:
+            self._map.close()
+            self._handle.close()
+
+    def __enter__(self) -> 'MmapStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _entries(data: Union[bytes, mmap.mmap]) -> Iterable[Tuple[str, int, float]]:
+    """
+    Reads every entry of a store's bytes.
+
+    Args:
+        data: The bytes of a store file.
+
+    Yields:
+        The key, the offset of its value and the value.
+    """
+    if len(data) < _HEADER.size:
+        return
+    used = _HEADER.unpack_from(data, 0)[0]
+    position = _HEADER.size
+    while position < used:
+        length = _LENGTH.unpack_from(data, position)[0]
+        key = bytes(data[position + _LENGTH.size:
+                         position + _LENGTH.size + length]).decode()
+        padded = length + (-(_LENGTH.size + length) % 8)
+        offset = position + _LENGTH.size + padded
+        yield key, offset, _VALUE.unpack_from(data, offset)[0]
+        position = offset + _VALUE.size
+
+
+def _read_file(path: str) -> Dict[str, float]:
+    """
+    Reads every value of a store file.
+
+    Args:
+        path: The store file.
+
+    Returns:
+        The values by key.
+    """
+    try:
+        with open(path, 'rb') as handle:
+            return {key: value for key, _, value in _entries(handle.read())}
+    except FileNotFoundError:
+        return {}
+
+
+def _pid_alive(pid: int) -> bool:
+    """
+    Checks if a process is still running.
+
+    Args:
+        pid: The process id.
+
+    Returns:
+        True if the process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def metrics_dir() -> str:
+    """
+    Returns the shared directory of the metric files, creating it when
+    needed.
+
+    Returns:
+        The directory.
+    """
+    return runtime_files.private_dir(os.environ.get('METRICS_DIR')
+                                     or runtime_files.runtime_path('metrics'))
+
+
+def _archive_dead_workers(directory: str) -> None:
+    """
+    Folds the counters of exited workers into the archive file.
+
+    Gauges only describe live workers, so they are dropped.
+
+    Args:
+        directory: The shared metrics directory.
+    """
+    with runtime_files.open_private(os.path.join(directory, 'archive.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [path for path in glob.glob(os.path.join(directory, 'worker_*.db'))
+                if not _pid_alive(int(path.rsplit('_', 1)[1][:-3]))]
+        if not dead:
+            return
+
+        with MmapStore(os.path.join(directory, 'archive.db')) as archive:
+            for path in dead:
+                for key, value in _read_file(path).items():
+                    if not key.startswith('gauge:'):
+                        archive.add(key, value)
+                os.remove(path)
+
+
+_STORE: Optional[MmapStore] = None
+_STORE_PID = 0
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> MmapStore:
+    """
+    Returns this worker's store, creating it on first use after a fork.
+
+    Returns:
+        The store.
+    """
+    global _STORE, _STORE_PID  # pylint: disable=global-statement
+    if _STORE is None or _STORE_PID != os.getpid():
+        with _STORE_LOCK:
+            if _STORE is None or _STORE_PID != os.getpid():
+                directory = metrics_dir()
+                _archive_dead_workers(directory)
+                _STORE = MmapStore(os.path.join(directory,
+                                                f'worker_{os.getpid()}.db'))
+                _STORE_PID = os.getpid()
+    return _STORE
+
+
+def _key(kind: str, name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Builds the store key of a sample.
+
+    Args:
+        kind: counter or gauge.
+        name: The metric name.
+        labels: The label names and values.
+
+    Returns:
+        The store key.
+    """
+    label_text = ','.join(f'{label}="{_escape(value)}"' for label, value in labels)
+    return f'{kind}:{name}{{{label_text}}}'
+
+
+def _escape(value: str) -> str:
+    """
+    Escapes a label value for the Prometheus text format.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def inc(name: str, amount: float = 1.0, **labels: str) -> None:
+    """
+    Increments a counter.
+
+    Args:
+        name: The metric name.
+        amount: The amount to add.
+        labels: The labels of the sample.
+    """
+    get_store().add(_key('counter', name, tuple(sorted(labels.items()))), amount)
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    """
+    Sets a gauge of this worker, the scrape sums the live workers.
+
+    Args:
+        name: The metric name.
+        value: The value.
+        labels: The labels of the sample.
+    """
+    get_store().set(_key('gauge', name, tuple(sorted(labels.items()))), value)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """
+    Records an observation in a histogram.
+
+    Args:
+        name: The metric name.
+        value: The observed value.
+        labels: The labels of the sample.
+    """
+    store = get_store()
+    base = tuple(sorted(labels.items()))
+    for bound in LATENCY_BUCKETS:
+        if value <= bound:
+            store.add(_key('counter', name + '_bucket', base + (('le', str(bound)),)), 1)
+    store.add(_key('counter', name + '_bucket', base + (('le', '+Inf'),)), 1)
+    store.add(_key('counter', name + '_sum', base), value)
+    store.add(_key('counter', name + '_count', base), 1)
+
+
+def _record_query(event: db_accessor.QueryEvent) -> None:
+    """
+    The query hook recording the time and rows of every statement, and
+    counting the failed ones.
+
+    Args:
+        event: The statement that ran.
+    """
+    observe('coa_db_query_duration_seconds', event.duration,
+            call_site=event.call_site)
+    if event.failed:
+        inc('coa_db_query_errors_total', call_site=event.call_site)
+        return
+    # An unbuffered cursor doesn't know its row count until it is read.
+    if not event.unbuffered:
+        inc('coa_db_query_rows_total', event.rows, call_site=event.call_site)
+
+
+_STATS_WRITTEN = 0.0
+
+
+def record_worker_stats(force: bool = False) -> None:
+    """
+    Writes this worker's pool and cache stats to its gauges, at most once
+    per METRICS_STATS_INTERVAL unless forced.
+
+    Args:
+        force: Whether to write them regardless of the interval.
+    """
+    global _STATS_WRITTEN  # pylint: disable=global-statement
+    now = time.monotonic()
+    interval = float(os.environ.get('METRICS_STATS_INTERVAL', '5'))
+    if not force and now - _STATS_WRITTEN < interval:
+        return
+    _STATS_WRITTEN = now
+
+    pool = db_accessor.pool_stats()
+    for stat, name in (('checkedOut', 'checked_out'), ('idle', 'idle'),
+                       ('created', 'created'), ('recycled', 'recycled'),
+                       ('waits', 'waits'), ('waitTimeTotal', 'wait_seconds')):
+        set_gauge('coa_db_pool_' + name, pool[stat])
+
+    cache_stats = cache.cache_stats()
+    for stat in ('size', 'hits', 'misses', 'evictions', 'invalidations'):
+        set_gauge('coa_cache_' + stat, cache_stats[stat])
+
+    flights = cache_stats['singleFlight']
+    for stat, name in (('leaders', 'leaders'), ('collapsedThreads', 'collapsed_threads'),
+                       ('collapsedWorkers', 'collapsed_workers'),
+                       ('workerWaitTime', 'worker_wait_seconds')):
+        set_gauge('coa_single_flight_' + name, flights[stat])
+
+    stale = cache_stats['stale']
+    for stat, name in (('served', 'served'), ('servedOnError', 'served_on_error'),
+                       ('refreshes', 'refreshes'), ('refreshErrors', 'refresh_errors')):
+        set_gauge('coa_cache_stale_' + name, stale[stat])
+
+    breaker = db_accessor.breaker_stats()
+    set_gauge('coa_db_breaker_open', 0 if breaker['state'] == 'closed' else 1)
+    set_gauge('coa_db_breaker_rejected', breaker['rejected'])
+
+
+def collect() -> Dict[str, float]:
+    """
+    Sums the samples of every worker, live or archived.
+
+    Returns:
+        The summed values by store key.
+    """
+    directory = metrics_dir()
+    _archive_dead_workers(directory)
+    totals: Dict[str, float] = {}
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        for key, value in _read_file(path).items():
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _sort_key(sample: str) -> Tuple[str, str, float]:
+    """
+    Orders samples by name and labels with histogram buckets by bound.
+
+    Args:
+        sample: The sample name and labels.
+
+    Returns:
+        The sort key.
+    """
+    name, _, label_text = sample.partition('{')
+    bound = 0.0
+    labels = []
+    for label in label_text.rstrip('}').split(','):
+        if label.startswith('le="'):
+            bound = float(label[4:-1].replace('+Inf', 'inf'))
+        else:
+            labels.append(label)
+    return name, ','.join(labels), bound
+
+
+def render() -> str:
+    """
+    Renders the summed samples in the Prometheus text format.
+
+    Returns:
+        The exposition text.
+    """
+    families: Dict[str, Tuple[str, List[Tuple[str, float]]]] = {}
+    for key, value in collect().items():
+        kind, sample = key.split(':', 1)
+        family = sample.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if family.endswith(suffix) and family[:-len(suffix)] in HISTOGRAMS:
+                family, kind = family[:-len(suffix)], 'histogram'
+        families.setdefault(family, (kind, []))[1].append((sample, value))
+
+    lines: List[str] = []
+    for family in sorted(families):
+        kind, samples = families[family]
+        lines.append(f'# TYPE {family} {kind}')
+        for sample, value in sorted(samples, key=lambda pair: _sort_key(pair[0])):
+            lines.append(f'{sample.replace("{}", "")} {value!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app: Flask) -> None:
+    """
+    Instruments a Flask app with request latency histograms and serves
+    the /metrics route.
+
+    Args:
+        app: The Flask app.
+    """
+    db_accessor.add_query_hook(_record_query)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = getattr(g, 'metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            # A full disk or a broken metrics file must not fail the response.
+            try:
+                observe('coa_http_request_duration_seconds',
+                        time.perf_counter() - started,
+                        route=route,
+                        method=request.method,
+                        status=str(response.status_code))
+                record_worker_stats()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Recording the request metrics failed')
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        The metrics route returns the metrics of every worker in the
+        Prometheus text format.
+
+        Returns:
+            The exposition text.
+        """
+        record_worker_stats(force=True)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
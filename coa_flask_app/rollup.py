@@ -0,0 +1,169 @@
+"""
+A module designed to hold the daily item rollup.
+
+The rollup table keeps the total quantity of every item per site and day,
+so town and county breakdowns sum days × items instead of every volunteer
+line item since 2016. It is kept up to date in the same transaction as
+every contribution insert and can be rebuilt from scratch with:
+    python -m coa_flask_app.rollup backfill
+
+The rollup is set up with the following environment variables:
+    ITEM_ROLLUP        - Set to 1 to maintain and query the rollup.
+    ROLLUP_SITE_TABLE  - The table of site_id, site_name, town and county
+                         (default coa.site_info).
+"""
+
+import argparse
+import os
+from collections import Counter
+from typing import Any, Iterable, List, Tuple
+
+from coa_flask_app.db_accessor import Accessor
+
+
+ROLLUP_TABLE = 'coa.item_daily_rollup'
+
+CREATE_QUERY = """
+               CREATE TABLE IF NOT EXISTS """ + ROLLUP_TABLE + """
+                   (site_id INT NOT NULL,
+                    day DATE NOT NULL,
+                    item_id INT NOT NULL,
+                    quantity BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (site_id, day, item_id),
+                    KEY day_item (day, item_id))
+               """
+
+UPSERT_QUERY = """
+               INSERT INTO """ + ROLLUP_TABLE + """
+                   (site_id, day, item_id, quantity)
+               VALUES
+                   (%s, %s, %s, %s)
+               ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)
+               """
+
+
+def enabled() -> bool:
+    """
+    Checks if the rollup is maintained and queried.
+
+    Returns:
+        True if the rollup is on.
+    """
+    return os.environ.get('ITEM_ROLLUP', '') == '1'
+
+
+def site_table() -> str:
+    """
+    Returns the table holding the site hierarchy.
+
+    Returns:
+        The site table name.
+    """
+    return os.environ.get('ROLLUP_SITE_TABLE', 'coa.site_info')
+
+
+def add_contributions(db_handle: Any,
+                      rows: Iterable[Tuple[int, str, int, int]]) -> None:
+    """
+    Adds inserted item quantities to the rollup in the current transaction.
+
+    Args:
+        db_handle: The cursor of the insert's transaction.
+        rows: The site id, day, item id and quantity of each item line.
+    """
+    totals: Counter = Counter()
+    for site_id, day, item_id, quantity in rows:
+        totals[(site_id, day, item_id)] += quantity
+
+    if totals:
+        db_handle.executemany(UPSERT_QUERY,
+                              [(*key, quantity) for key, quantity in totals.items()])
+
+
+def backfill() -> int:
+    """
+    Rebuilds the rollup from the team and volunteer tables.
+
+    Returns:
+        The number of rollup rows.
+    """
+    query = """
+            INSERT INTO """ + ROLLUP_TABLE + """
+                (site_id, day, item_id, quantity)
+            SELECT
+                team_info.site_id,
+                team_info.volunteer_date,
+                volunteer_info.item_id,
+                SUM(volunteer_info.quantity)
+            FROM coa.team_info
+            JOIN coa.volunteer_info
+                ON volunteer_info.team_id = team_info.team_id
+            GROUP BY team_info.site_id,
+                     team_info.volunteer_date,
+                     volunteer_info.item_id
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(CREATE_QUERY)
+        db_handle.execute('DELETE FROM ' + ROLLUP_TABLE)
+        db_handle.execute(query)
+        return db_handle.rowcount
+
+
+def item_breakdown(location_category: str,
+                   location_name: str,
+                   start_date: str,
+                   end_date: str) -> List[Tuple[int, str, str, str, int]]:
+    """
+    Returns a list of tuples comprising of the item id, item name, category,
+    material, and quantity, the same as site.item_breakdown, from the rollup.
+
+    Args:
+        location_category: The type of location, town or county.
+        location_name: The name of the location.
+        start_date: The start date.
+        end_date: The end date.
+
+    Returns:
+        A list of item id, item name, category, material, quantity.
+    """
+    query = """
+            SELECT
+                item.item_id,
+                item.item_name,
+                item.category,
+                item.material,
+                SUM(daily.quantity) AS quantity_sum
+            FROM """ + ROLLUP_TABLE + """ AS daily
+            JOIN """ + site_table() + """ AS site
+                ON site.site_id = daily.site_id
+            JOIN coa.item AS item
+                ON item.item_id = daily.item_id
+            WHERE %s <= daily.day
+                AND daily.day <= %s
+                AND site.""" + location_category + """ = %s
+            GROUP BY item.item_name
+            HAVING quantity_sum <> 0
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query, (start_date,
+                                  end_date,
+                                  location_name))
+        return [(item_id, item_name, category, material, int(quantity))
+                for item_id, item_name, category, material, quantity
+                in db_handle.fetchall()]
+
+
+def main() -> None:
+    """
+    The command line entry to manage the rollup.
+    """
+    parser = argparse.ArgumentParser(description='Manage the daily item rollup.')
+    parser.add_argument('command', choices=['backfill'])
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        print(f'Rebuilt {ROLLUP_TABLE} with {backfill()} rows')
+
+
+if __name__ == '__main__':
+    main()
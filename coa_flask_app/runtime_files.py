@@ -0,0 +1,107 @@
+"""
+A module designed to hold the opening of the files the workers of a host
+share, like the shared cache, the lock files, the metrics and the journal.
+
+The files default to a directory only the app's user may use, so another
+local user can't plant a file or a symlink the workers then read or write.
+Directories are checked to belong to the app's user and not to be writable
+by anyone else. Files are created exclusively with mode 0600, never
+through a symlink, and an existing file must belong to the app's user.
+
+The files are placed with the following environment variable:
+    RUNTIME_DIR - The private directory the shared files default to
+                  (default coa-<uid> in the system temp directory).
+"""
+
+import os
+import stat
+import tempfile
+from typing import IO, Any
+
+_FLAGS = {
+    'r': os.O_RDONLY,
+    'w': os.O_WRONLY | os.O_TRUNC,
+    'a': os.O_WRONLY | os.O_APPEND,
+    'a+': os.O_RDWR | os.O_APPEND,
+}
+
+
+def private_dir(path: str) -> str:
+    """
+    Creates a directory only this user may use, or checks that an existing
+    one is not writable by anyone else.
+
+    Args:
+        path: The directory.
+
+    Returns:
+        The directory.
+
+    Raises:
+        PermissionError: The directory belongs to another user, is writable
+                         by others or is not a directory.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid()
+            or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        raise PermissionError(f'{path} is not a private directory of this user')
+    return path
+
+
+def runtime_path(name: str) -> str:
+    """
+    Returns the default path of a shared file, in the private runtime
+    directory.
+
+    Args:
+        name: The name of the file or directory.
+
+    Returns:
+        The path.
+    """
+    directory = os.environ.get('RUNTIME_DIR') or os.path.join(
+        tempfile.gettempdir(), f'coa-{os.geteuid()}')
+    return os.path.join(private_dir(directory), name)
+
+
+def open_private(path: str, mode: str = 'a+b') -> IO[Any]:
+    """
+    Opens a file of this user, creating it with mode 0600 if it is missing.
+
+    Symlinks are never followed and an existing file must be a regular file
+    belonging to this user.
+
+    Args:
+        path: The file.
+        mode: The open mode, one of r, w, a or a+ with an optional b.
+
+    Returns:
+        The open file.
+
+    Raises:
+        PermissionError: The file belongs to another user or isn't a
+                         regular file.
+    """
+    flags = _FLAGS[mode.replace('b', '')] | os.O_NOFOLLOW | os.O_CLOEXEC
+    if mode.startswith('r'):
+        descriptor = os.open(path, flags)
+    else:
+        while True:
+            try:
+                descriptor = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+                break
+            except FileExistsError:
+                pass
+            try:
+                descriptor = os.open(path, flags)
+                break
+            except FileNotFoundError:
+                # Removed in between, try creating it again.
+                continue
+
+    info = os.fstat(descriptor)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid():
+        os.close(descriptor)
+        raise PermissionError(f'{path} is not a file of this user')
+    return os.fdopen(descriptor, mode)
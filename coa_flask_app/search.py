@@ -0,0 +1,490 @@
+"""
+A module designed to hold the location search index.
+
+Every site, town and county is indexed by its full name in a prefix trie,
+and by each of its words in a second trie, so a query matches names
+starting with it and names with words starting with each of its words.
+Words that match nothing are looked up in a deletion index, which finds
+the indexed words within one or two typos without scanning them all.
+
+Searches read an index that is never changed once published. When the
+data version changes the new locations are added to a copy that shares
+every part of the old index they don't touch, which then replaces it, and
+the index is only rebuilt when a location disappears.
+"""
+
+import copy
+import heapq
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from coa_flask_app import data_version, site
+
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+# Each query word with the entries it prefixes and, if none, its typo matches.
+_WordMatches = List[Tuple[str, Set[int], Dict[int, int]]]
+
+# The order matches come in when they score the same.
+CATEGORY_ORDER = {'county': 0, 'town': 1, 'site': 2}
+
+
+def normalize(text: str) -> List[str]:
+    """
+    Splits a name or query into lowercase words without punctuation.
+
+    Args:
+        text: The text.
+
+    Returns:
+        The words.
+    """
+    return _WORD.findall(text.lower())
+
+
+def max_typos(word: str) -> int:
+    """
+    Returns the number of typos tolerated in a word of a query.
+
+    Args:
+        word: The word.
+
+    Returns:
+        0 for short words, 1 up to 7 letters and 2 beyond.
+    """
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def deletions(word: str, distance: int) -> Set[str]:
+    """
+    Returns the strings made by deleting up to some letters of a word.
+
+    Args:
+        word: The word.
+        distance: The max number of deleted letters.
+
+    Returns:
+        The word and its deletions.
+    """
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:index] + variant[index + 1:]
+                    for variant in frontier for index in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """
+    Returns the Damerau-Levenshtein distance of two words, stopping early.
+
+    Args:
+        first: A word.
+        second: Another word.
+        limit: The distance beyond which the exact value doesn't matter.
+
+    Returns:
+        The distance, or limit + 1 if it is larger than limit.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    previous_previous: List[int] = []
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, second_char in enumerate(second, 1):
+            cost = 0 if first_char == second_char else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and first_char == second[j - 2]
+                    and first[i - 2] == second_char):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class _Trie:
+    """
+    A prefix trie keeping, at every node, the ids of the entries under it.
+    """
+
+    def __init__(self) -> None:
+        self.root: Dict[str, Any] = {}
+
+    def add(self, key: str, entry_id: int, own: Callable[[Any], Any]) -> None:
+        """
+        Adds an entry under a key.
+
+        Args:
+            key: The key.
+            entry_id: The entry.
+            own: Returns a node or id set that may be changed, copying it
+                 if an older index shares it.
+        """
+        node = self.root = own(self.root)
+        for char in key:
+            child = node[char] = own(node.get(char, {}))
+            ids = child[''] = own(child.get('', set()))
+            ids.add(entry_id)
+            node = child
+
+    def prefixed(self, prefix: str) -> Set[int]:
+        """
+        Returns the entries under every key starting with a prefix.
+
+        Args:
+            prefix: The prefix.
+
+        Returns:
+            The entry ids.
+        """
+        node = self.root
+        for char in prefix:
+            child = node.get(char)
+            if child is None:
+                return set()
+            node = child
+        return node.get('', set())
+
+
+class _Owner:
+    """
+    Tracks the containers copied by one add, so anything an older index
+    shares is copied once before it is changed.
+    """
+
+    def __init__(self) -> None:
+        self._owned: Set[int] = set()
+
+    def own(self, container: Any) -> Any:
+        """
+        Returns a container the add may change, a copy unless it was
+        already copied by it.
+
+        Args:
+            container: A set, dict, list, trie or table of the index.
+
+        Returns:
+            The container to change and store back.
+        """
+        if id(container) in self._owned:
+            return container
+        container = copy.copy(container)
+        self._owned.add(id(container))
+        return container
+
+    def add(self, mapping: Dict[str, Set[Any]], key: str, value: Any) -> None:
+        """
+        Adds a value to the set of a key, copying the set if it is shared.
+        """
+        values = mapping[key] = self.own(mapping.get(key, set()))
+        values.add(value)
+
+
+class _WordTables:
+    """
+    The word lookups of an index, the words of every name in a trie and
+    by their place in the name, the exact words and their deletions.
+    """
+
+    def __init__(self) -> None:
+        self.words = _Trie()
+        self.positions: List[_Trie] = []
+        self.exact: Dict[str, Set[int]] = {}
+        self.deletions: Dict[str, Set[str]] = {}
+
+    def owned(self, owner: _Owner) -> '_WordTables':
+        """
+        Returns the tables an add may change, copying what is shared.
+
+        Args:
+            owner: The copies of the running add.
+
+        Returns:
+            The tables to change and store back.
+        """
+        tables = owner.own(self)
+        for name in ('words', 'positions', 'exact', 'deletions'):
+            setattr(tables, name, owner.own(getattr(tables, name)))
+        return tables
+
+    def add(self, words: List[str], entry_id: int, owner: _Owner) -> None:
+        """
+        Indexes the words of a name.
+
+        Args:
+            words: The normalized words.
+            entry_id: The entry.
+            owner: The copies of the running add.
+        """
+        for position, word in enumerate(words):
+            if position == len(self.positions):
+                self.positions.append(_Trie())
+            trie = self.positions[position] = owner.own(self.positions[position])
+            trie.add(word, entry_id, owner.own)
+            self.words.add(word, entry_id, owner.own)
+            if word not in self.exact:
+                for variant in deletions(word, max_typos(word)):
+                    owner.add(self.deletions, variant, word)
+            owner.add(self.exact, word, entry_id)
+
+    def typo_matches(self, word: str) -> Dict[int, int]:
+        """
+        Returns the entries with a word within the tolerated typos of a word.
+
+        Args:
+            word: The query word.
+
+        Returns:
+            The fewest typos of each matching entry.
+        """
+        limit = max_typos(word)
+        candidates: Set[str] = set()
+        for variant in deletions(word, limit):
+            candidates |= self.deletions.get(variant, set())
+
+        matches: Dict[int, int] = {}
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                for entry_id in self.exact[candidate]:
+                    matches[entry_id] = min(distance, matches.get(entry_id, distance))
+        return matches
+
+
+class LocationIndex:
+    """
+    A search index over the sites, towns and counties.
+
+    An index is only changed by add before it is published, add copies
+    anything it changes that an older index still shares.
+    """
+
+    def __init__(self) -> None:
+        self.entries: List[Dict[str, Optional[str]]] = []
+        self.locations: Set[Tuple[str, str, str]] = set()
+        self._ids: Dict[Tuple[str, str, Optional[str], str], int] = {}
+        self._names = _Trie()
+        self._phrases: Dict[str, Set[int]] = {}
+        self._words = _WordTables()
+        self._order: List[int] = []
+
+    def _add_entry(self, owner: _Owner, category: str, name: str,
+                   town: Optional[str], county: str) -> None:
+        """
+        Indexes a site, town or county once.
+        """
+        key = (category, name, town, county)
+        if key in self._ids:
+            return
+
+        entry_id = len(self.entries)
+        self._ids[key] = entry_id
+        self.entries.append({'locationCategory': category, 'locationName': name,
+                             'town': town, 'county': county})
+        words = normalize(name)
+        phrase = ' '.join(words)
+        self._names.add(phrase, entry_id, owner.own)
+        owner.add(self._phrases, phrase, entry_id)
+        self._words.add(words, entry_id, owner)
+
+    def add(self, locations: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Indexes the sites, and their towns and counties, not indexed yet.
+
+        Nothing an older index shares is changed, so an index copied with
+        updated can be filled while searches read the old one.
+
+        Args:
+            locations: The site, town and county of each site.
+
+        Returns:
+            The number of new sites.
+        """
+        new_locations = [location for location in locations
+                         if location not in self.locations]
+        if not new_locations:
+            return 0
+
+        owner = _Owner()
+        for name in ('entries', 'locations', '_ids', '_names', '_phrases'):
+            setattr(self, name, owner.own(getattr(self, name)))
+        self._words = self._words.owned(owner)
+        added = 0
+        for location in new_locations:
+            if location in self.locations:
+                continue
+            site_name, town, county = location
+            self._add_entry(owner, 'county', county, None, county)
+            self._add_entry(owner, 'town', town, town, county)
+            self._add_entry(owner, 'site', site_name, town, county)
+            self.locations.add(location)
+            added += 1
+
+        if added:
+            # The rank of every entry among the ones scoring the same.
+            ranked = sorted(range(len(self.entries)), key=lambda entry_id: (
+                CATEGORY_ORDER[str(self.entries[entry_id]['locationCategory'])],
+                len(str(self.entries[entry_id]['locationName'])),
+                str(self.entries[entry_id]['locationName'])))
+            self._order = [0] * len(ranked)
+            for rank, entry_id in enumerate(ranked):
+                self._order[entry_id] = rank
+        return added
+
+    def updated(self, locations: Iterable[Tuple[str, str, str]]) -> 'LocationIndex':
+        """
+        Returns a copy of the index with the new locations added, leaving
+        this index as it is for the searches reading it.
+
+        Args:
+            locations: The site, town and county of each site.
+
+        Returns:
+            The new index.
+        """
+        index = copy.copy(self)
+        index.add(locations)
+        return index
+
+    def _match(self, words: List[str]) -> Tuple[Set[int], _WordMatches]:
+        """
+        Finds the entries matching every word of a query.
+
+        The matches of every word are intersected as sets before any entry
+        is scored, so only the entries matching all of them are.
+
+        Args:
+            words: The query words.
+
+        Returns:
+            The matching entries, and each word with its prefix matches and,
+            when it has none, its typo matches.
+        """
+        matched: _WordMatches = []
+        candidates: Set[int] = set()
+        for position, word in enumerate(words):
+            prefixed = self._words.words.prefixed(word)
+            typos = {} if prefixed else self._words.typo_matches(word)
+            word_matches = prefixed or set(typos)
+            candidates = set(word_matches) if position == 0 \
+                else candidates & word_matches
+            if not candidates:
+                return set(), []
+            matched.append((word, prefixed, typos))
+        return candidates, matched
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Returns the locations best matching a query.
+
+        Every word of the query must match a word of the location, exactly,
+        as a prefix or within a few typos. Full name matches rank first,
+        then exact words, prefixes and typos, with a bonus for words in the
+        same place as in the name, like 1 2 in Town 1-2 but not Town 2-1.
+
+        Args:
+            query: The text typed by the user.
+            limit: The max number of results.
+
+        Returns:
+            The matching locations with their town, county and score.
+        """
+        words = normalize(query)
+        candidates, matched = self._match(words)
+        if not candidates:
+            return []
+
+        scores = self._score(words, candidates, matched)
+        order = self._order
+        best = heapq.nsmallest(limit, scores.items(),
+                               key=lambda pair: (-pair[1], order[pair[0]]))
+        return [dict(self.entries[entry_id], score=round(score, 3))
+                for entry_id, score in best]
+
+    def _score(self, words: List[str], candidates: Set[int],
+               matched: _WordMatches) -> Dict[int, float]:
+        """
+        Scores the entries matching every word of a query.
+
+        Args:
+            words: The query words.
+            candidates: The matching entries.
+            matched: The matches of each word.
+
+        Returns:
+            The score of each entry.
+        """
+        prefix_words = sum(1 for _, prefixed, _ in matched if prefixed)
+        scores = dict.fromkeys(candidates, 2.0 * prefix_words)
+        for word, prefixed, typos in matched:
+            if prefixed:
+                for entry_id in candidates & self._words.exact.get(word, set()):
+                    scores[entry_id] += 1.0
+            else:
+                for entry_id in candidates:
+                    scores[entry_id] += 1.0 / (typos[entry_id] + 1)
+
+        for position, word in enumerate(words[:len(self._words.positions)]):
+            for entry_id in candidates & self._words.positions[position].prefixed(word):
+                scores[entry_id] += 0.5
+
+        phrase = ' '.join(words)
+        for entry_id in candidates & self._names.prefixed(phrase):
+            scores[entry_id] += 10.0
+        for entry_id in candidates & self._phrases.get(phrase, set()):
+            scores[entry_id] += 10.0
+        return scores
+
+
+_INDEX = LocationIndex()
+_INDEX_VERSION: Optional[str] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> LocationIndex:
+    """
+    Returns the location index, adding any new locations first when the
+    data version changed. A location that disappeared rebuilds it.
+
+    Returns:
+        The index.
+    """
+    global _INDEX, _INDEX_VERSION  # pylint: disable=global-statement
+    version = data_version.current()
+    if version == _INDEX_VERSION:
+        return _INDEX
+
+    with _INDEX_LOCK:
+        if version != _INDEX_VERSION:
+            locations = site.all_locations()
+            if not _INDEX.locations.issubset(locations):
+                index = LocationIndex()
+                index.add(locations)
+            else:
+                index = _INDEX.updated(locations)
+            # Searches holding the old index keep reading it unchanged.
+            _INDEX = index
+            _INDEX_VERSION = version
+        return _INDEX
+
+
+def search_locations(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Searches the sites, towns and counties.
+
+    Args:
+        query: The text typed by the user.
+        limit: The max number of results.
+
+    Returns:
+        The ranked matches with their town and county.
+    """
+    return get_index().search(query, limit)
@@ -0,0 +1,344 @@
+"""
+A module designed to hold the result cache shared by the workers of a host.
+
+The in-process cache is duplicated in every uwsgi worker and each worker
+fills it with its own queries. This tier is a memory mapped file every
+worker maps, so a result loaded by one worker (or by the master during the
+warm-up) is read by all of them.
+
+The file is a header followed by fixed size slots. A key hashes to a few
+neighbouring slots, a new entry takes a free, expired or outdated slot of
+those and otherwise evicts the least recently used one. Every entry is
+stamped with the generation it was written in, bumping the generation when
+the data changes invalidates every entry at once. Access is serialized
+with a file lock.
+
+The cache is set up with the following environment variables:
+    SHARED_CACHE         - Set to 0 to turn the shared tier off.
+    SHARED_CACHE_PATH    - The cache file (default shared_cache in the
+                           private RUNTIME_DIR).
+    SHARED_CACHE_SLOTS   - The number of entries (default 512).
+    SHARED_CACHE_SLOT_KB - The max size of an entry (default 128).
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+from coa_flask_app import runtime_files
+
+
+MAGIC = b'COASHC01'
+PROBES = 8
+
+# magic, slots, slot size, generation, hits, misses, sets, evictions, too large
+_HEADER = struct.Struct('<8sIIQQQQQQ')
+_HEADER_SIZE = 64
+# key digest, generation, expires, last used, length
+_SLOT = struct.Struct('<16sQddI')
+_GENERATION_OFFSET = 16
+_HITS, _MISSES, _SETS, _EVICTIONS, _TOO_LARGE = range(5)
+_COUNTER = struct.Struct('<Q')
+
+
+def enabled() -> bool:
+    """
+    Checks if the shared tier is turned on.
+
+    Returns:
+        True unless SHARED_CACHE is off.
+    """
+    return os.environ.get('SHARED_CACHE', '1').lower() not in {'0', 'false', 'no'}
+
+
+class SharedCache:
+    """
+    A TTL and size bounded cache in a memory mapped file shared by processes.
+    """
+
+    def __init__(self, path: str, slots: int, slot_size: int) -> None:
+        """
+        The constructor of the SharedCache class.
+
+        The file is created, or reset if it was made with other dimensions.
+
+        Args:
+            path: The cache file.
+            slots: The number of entries.
+            slot_size: The size of a slot, including its header.
+        """
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._lock = threading.Lock()
+        self._handle = runtime_files.open_private(path)
+        size = _HEADER_SIZE + slots * slot_size
+        with self._locked():
+            if os.fstat(self._handle.fileno()).st_size != size:
+                self._handle.truncate(0)
+                self._handle.truncate(size)
+            self._map = mmap.mmap(self._handle.fileno(), size)
+            magic, file_slots, file_slot_size = _HEADER.unpack_from(self._map, 0)[:3]
+            if (magic, file_slots, file_slot_size) != (MAGIC, slots, slot_size):
+                self._map[:size] = bytes(size)
+                _HEADER.pack_into(self._map, 0, MAGIC, slots, slot_size,
+                                  1, 0, 0, 0, 0, 0)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Holds the thread and file locks, a file lock alone doesn't exclude
+        the other threads of this process.
+        """
+        with self._lock:
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._handle, fcntl.LOCK_UN)
+
+    def _count(self, counter: int, amount: int = 1) -> None:
+        """
+        Adds to one of the header counters, the lock must be held.
+        """
+        offset = _HEADER.size - (5 - counter) * _COUNTER.size
+        _COUNTER.pack_into(self._map, offset,
+                           _COUNTER.unpack_from(self._map, offset)[0] + amount)
+
+    def _generation(self) -> int:
+        """
+        Reads the current generation, the lock must be held.
+        """
+        return _COUNTER.unpack_from(self._map, _GENERATION_OFFSET)[0]
+
+    def _slot_offset(self, index: int) -> int:
+        """
+        Returns the offset of a slot in the file.
+        """
+        return _HEADER_SIZE + index * self.slot_size
+
+    def _probe(self, digest: bytes) -> Tuple[int, ...]:
+        """
+        Returns the slots a key may live in.
+
+        Args:
+            digest: The key digest.
+
+        Returns:
+            The slot indexes.
+        """
+        start = int.from_bytes(digest[:8], 'little') % self.slots
+        return tuple((start + step) % self.slots
+                     for step in range(min(PROBES, self.slots)))
+
+    @staticmethod
+    def digest(key: Hashable) -> bytes:
+        """
+        Hashes a key, keys must have a stable repr across processes.
+
+        Args:
+            key: The key.
+
+        Returns:
+            The 16 byte digest.
+        """
+        return hashlib.sha1(repr(key).encode()).digest()[:16]
+
+    def generation(self) -> int:
+        """
+        Returns the current generation.
+
+        Returns:
+            The generation counter.
+        """
+        with self._locked():
+            return self._generation()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Looks up a key in the cache.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            A tuple of whether the key was found and its value.
+        """
+        digest = self.digest(key)
+        data: Optional[bytes] = None
+        with self._locked():
+            generation, now = self._generation(), time.time()
+            for index in self._probe(digest):
+                offset = self._slot_offset(index)
+                slot_digest, slot_generation, expires, _, length = \
+                    _SLOT.unpack_from(self._map, offset)
+                if (slot_digest == digest and slot_generation == generation
+                        and length and expires > now):
+                    _SLOT.pack_into(self._map, offset, slot_digest, slot_generation,
+                                    expires, now, length)
+                    data = self._map[offset + _SLOT.size:offset + _SLOT.size + length]
+                    break
+            self._count(_MISSES if data is None else _HITS)
+
+        if data is None:
+            return False, None
+        return True, pickle.loads(data)
+
+    def set(self, key: Hashable, value: Any, ttl: float,
+            generation: Optional[int] = None) -> None:
+        """
+        Stores a value in the cache, evicting the least recently used entry
+        of the key's slots if they are all taken.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store.
+            ttl: Seconds the entry stays fresh.
+            generation: The generation the value was loaded in, it is not
+                        stored if the data changed since.
+        """
+        digest = self.digest(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked():
+            if len(data) > self.slot_size - _SLOT.size:
+                self._count(_TOO_LARGE)
+                return
+
+            if generation is not None and generation != self._generation():
+                return
+
+            generation, now = self._generation(), time.time()
+            offset = self._slot_offset(self._pick_slot(digest, generation, now))
+            self._map[offset + _SLOT.size:offset + _SLOT.size + len(data)] = data
+            _SLOT.pack_into(self._map, offset, digest, generation,
+                            now + ttl, now, len(data))
+            self._count(_SETS)
+
+    def _pick_slot(self, digest: bytes, generation: int, now: float) -> int:
+        """
+        Picks the slot a key is stored in, the lock must be held.
+
+        The key's own slot or a free, outdated or expired one of its slots
+        is taken, otherwise the least recently used one is evicted.
+
+        Args:
+            digest: The key digest.
+            generation: The current generation.
+            now: The current time.
+
+        Returns:
+            The slot index.
+        """
+        oldest = (0, float('inf'))
+        for index in self._probe(digest):
+            slot_digest, slot_generation, expires, last_used, length = \
+                _SLOT.unpack_from(self._map, self._slot_offset(index))
+            if slot_digest == digest or not length \
+                    or slot_generation != generation or expires <= now:
+                return index
+            if last_used < oldest[1]:
+                oldest = (index, last_used)
+
+        self._count(_EVICTIONS)
+        return oldest[0]
+
+    def bump(self) -> int:
+        """
+        Moves to a new generation, which invalidates every entry.
+
+        Returns:
+            The new generation.
+        """
+        with self._locked():
+            generation = self._generation() + 1
+            _COUNTER.pack_into(self._map, _GENERATION_OFFSET, generation)
+            return generation
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the usage numbers of the cache, summed over every process.
+
+        Only the header is read under the lock. The live entries are counted
+        afterwards without it, so the other workers aren't held up by the
+        scan and the count is approximate.
+
+        Returns:
+            A dict of the cache size and hit/miss counters.
+        """
+        with self._locked():
+            header = _HEADER.unpack(self._map[:_HEADER.size])
+
+        generation, now = header[3], time.time()
+        entries = 0
+        for index in range(self.slots):
+            _, slot_generation, expires, _, length = \
+                _SLOT.unpack_from(self._map, self._slot_offset(index))
+            if length and slot_generation == generation and expires > now:
+                entries += 1
+
+        hits, misses, sets, evictions, too_large = header[4:]
+        lookups = hits + misses
+        return {
+            'enabled': True,
+            'path': self.path,
+            'slots': self.slots,
+            'slotSize': self.slot_size,
+            'generation': generation,
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hitRate': hits / lookups if lookups else 0.0,
+            'sets': sets,
+            'evictions': evictions,
+            'tooLarge': too_large
+        }
+
+
+_CACHE: Optional[SharedCache] = None
+_CACHE_PID = 0
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> Optional[SharedCache]:
+    """
+    Returns this process' handle on the shared cache, reopening it after a
+    fork since a file lock is shared with the parent's handle.
+
+    Returns:
+        The cache, or None if it is off or the file can't be opened.
+    """
+    global _CACHE, _CACHE_PID  # pylint: disable=global-statement
+    if not enabled():
+        return None
+
+    if _CACHE is None or _CACHE_PID != os.getpid():
+        with _CACHE_LOCK:
+            if _CACHE is None or _CACHE_PID != os.getpid():
+                try:
+                    _CACHE = SharedCache(
+                        os.environ.get('SHARED_CACHE_PATH')
+                        or runtime_files.runtime_path('shared_cache'),
+                        slots=int(os.environ.get('SHARED_CACHE_SLOTS', '512')),
+                        slot_size=int(os.environ.get('SHARED_CACHE_SLOT_KB', '128')) * 1024)
+                except OSError:
+                    _CACHE = None
+                _CACHE_PID = os.getpid()
+    return _CACHE
+
+
+def shared_cache_stats() -> Dict[str, Any]:
+    """
+    Returns the usage numbers of the shared cache.
+
+    Returns:
+        A dict of the shared cache stats.
+    """
+    shared = get_cache()
+    return shared.stats() if shared is not None else {'enabled': False}
@@ -0,0 +1,256 @@
+"""
+A module designed to collapse identical concurrent computations.
+
+When many requests for the same result arrive at once only one of them
+computes it. The other threads of the worker wait for it and share its
+result. Workers are coordinated with byte range locks on a shared lock
+file, a worker that finds another one computing the same key blocks on
+its lock and then checks the shared cache, which the first worker filled,
+before computing anything.
+
+The coalescing is set up with the following environment variables:
+    SINGLE_FLIGHT_LOCK    - The shared lock file (default single_flight.lock
+                            in the private RUNTIME_DIR).
+    SINGLE_FLIGHT_STRIPES - The number of key stripes of the lock file
+                            (default 1024).
+    SINGLE_FLIGHT_TIMEOUT - Seconds to wait for another worker before
+                            computing anyway (default 30).
+"""
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from coa_flask_app import runtime_files
+
+
+class _Call:
+    """
+    An in-flight computation the threads of a worker wait on.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+    def finish(self, value: Any, error: Optional[BaseException]) -> None:
+        """
+        Hands the outcome to the waiting threads.
+
+        Args:
+            value: The result.
+            error: The error the computation raised, if it did.
+        """
+        self.value, self.error = value, error
+        self.done.set()
+
+    def result(self) -> Any:
+        """
+        Waits for the computation to finish.
+
+        Returns:
+            The result.
+
+        Raises:
+            The error the computation raised.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+_CALLS: Dict[Hashable, _Call] = {}
+_CALLS_LOCK = threading.Lock()
+_STATS = {'leaders': 0, 'collapsedThreads': 0, 'collapsedWorkers': 0,
+          'workerWaits': 0, 'workerWaitTime': 0.0, 'timeouts': 0}
+
+_LOCK_FILE: Optional[Any] = None
+_LOCK_FILE_PID = 0
+_LOCK_FILE_LOCK = threading.Lock()
+
+
+def _lock_file() -> Any:
+    """
+    Returns this process' handle on the shared lock file.
+
+    Byte range locks belong to the process and are dropped when any of its
+    handles on the file is closed, so one handle is kept per process.
+
+    Returns:
+        The open lock file.
+    """
+    global _LOCK_FILE, _LOCK_FILE_PID  # pylint: disable=global-statement
+    if _LOCK_FILE is None or _LOCK_FILE_PID != os.getpid():
+        with _LOCK_FILE_LOCK:
+            if _LOCK_FILE is None or _LOCK_FILE_PID != os.getpid():
+                _LOCK_FILE = runtime_files.open_private(
+                    os.environ.get('SINGLE_FLIGHT_LOCK')
+                    or runtime_files.runtime_path('single_flight.lock'))
+                _LOCK_FILE_PID = os.getpid()
+    return _LOCK_FILE
+
+
+def _stripe(key: Hashable) -> int:
+    """
+    Returns the lock file stripe of a key.
+
+    Keys sharing a stripe only make other workers wait and then compute,
+    they never share a wrong result.
+
+    Args:
+        key: The key, it must have a stable repr across processes.
+
+    Returns:
+        The byte offset locked for the key.
+    """
+    stripes = int(os.environ.get('SINGLE_FLIGHT_STRIPES', '1024'))
+    digest = hashlib.sha1(repr(key).encode()).digest()
+    return int.from_bytes(digest[:8], 'little') % stripes
+
+
+def _wait_for_stripe(handle: Any, stripe: int, timeout: float) -> bool:
+    """
+    Blocks on the lock of a stripe for up to a timeout.
+
+    The blocking lock can't time out by itself, so it is taken by a helper
+    thread. Byte range locks belong to the process, a lock the helper gets
+    after the timeout is released at once.
+
+    Args:
+        handle: The open lock file.
+        stripe: The byte offset to lock.
+        timeout: Seconds to wait.
+
+    Returns:
+        True if this process now holds the stripe.
+    """
+    acquired = threading.Event()
+    state_lock = threading.Lock()
+    state = {'abandoned': False}
+
+    def lock() -> None:
+        try:
+            fcntl.lockf(handle, fcntl.LOCK_EX, 1, stripe)
+        except OSError:
+            # A deadlock between workers, the waiter computes anyway.
+            return
+        with state_lock:
+            if state['abandoned']:
+                fcntl.lockf(handle, fcntl.LOCK_UN, 1, stripe)
+            else:
+                acquired.set()
+
+    threading.Thread(target=lock, name='single-flight-wait', daemon=True).start()
+    if acquired.wait(timeout):
+        return True
+    with state_lock:
+        state['abandoned'] = not acquired.is_set()
+        return acquired.is_set()
+
+
+def _across_workers(key: Hashable, func: Callable[[], Any],
+                    recheck: Callable[[], Tuple[bool, Any]]) -> Any:
+    """
+    Computes a result unless another worker is already computing it.
+
+    Args:
+        key: The key of the computation.
+        func: The computation, it must publish its result where recheck
+              finds it.
+        recheck: Looks the result up after waiting for another worker.
+
+    Returns:
+        The result.
+    """
+    try:
+        handle = _lock_file()
+    except OSError:
+        return func()
+
+    stripe = _stripe(key)
+    try:
+        fcntl.lockf(handle, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+    except OSError:
+        started = time.monotonic()
+        locked = _wait_for_stripe(handle, stripe,
+                                  float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', '30')))
+        with _CALLS_LOCK:
+            _STATS['workerWaits'] += 1
+            _STATS['workerWaitTime'] += time.monotonic() - started
+            _STATS['timeouts'] += 0 if locked else 1
+        if not locked:
+            return func()
+
+        try:
+            found, value = recheck()
+            if found:
+                with _CALLS_LOCK:
+                    _STATS['collapsedWorkers'] += 1
+                return value
+            return func()
+        finally:
+            fcntl.lockf(handle, fcntl.LOCK_UN, 1, stripe)
+
+    try:
+        return func()
+    finally:
+        fcntl.lockf(handle, fcntl.LOCK_UN, 1, stripe)
+
+
+def do(key: Hashable, func: Callable[[], Any],
+       recheck: Callable[[], Tuple[bool, Any]] = lambda: (False, None)) -> Any:
+    """
+    Runs a computation once for all the concurrent callers with the same key.
+
+    Args:
+        key: The key of the computation.
+        func: The computation.
+        recheck: Looks up a result another worker computed, like the
+                 shared cache.
+
+    Returns:
+        The result, shared with the other callers.
+    """
+    call = _Call()
+    with _CALLS_LOCK:
+        running = _CALLS.setdefault(key, call)
+        if running is call:
+            _STATS['leaders'] += 1
+        else:
+            _STATS['collapsedThreads'] += 1
+
+    if running is not call:
+        return running.result()
+
+    value: Any = None
+    error: Optional[BaseException] = None
+    try:
+        value = _across_workers(key, func, recheck)
+        return value
+    except BaseException as raised:
+        error = raised
+        raise
+    finally:
+        with _CALLS_LOCK:
+            del _CALLS[key]
+        call.finish(value, error)
+
+
+def singleflight_stats() -> Dict[str, Any]:
+    """
+    Returns the coalescing numbers of this worker.
+
+    Returns:
+        A dict of the computations run and the duplicates collapsed into
+        them, within this worker and across workers.
+    """
+    with _CALLS_LOCK:
+        stats = dict(_STATS, inFlight=len(_CALLS))
+    stats['collapsed'] = stats['collapsedThreads'] + stats['collapsedWorkers']
+    stats['workerWaitTime'] = round(stats['workerWaitTime'], 6)
+    return stats
@@ -1,10 +1,18 @@
 """
 A module designed to hold the logic related to the site page.
+
+The trends are limited with the following environment variable:
+    TREND_MAX_BUCKETS - The max buckets of a trend (default 5000).
 """
 
 import heapq
-from typing import Any, Dict, List, Tuple
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
+from coa_flask_app import engine
+from coa_flask_app import rollup as daily_rollup
+from coa_flask_app.cache import cached
 from coa_flask_app.db_accessor import Accessor
 
 
@@ -70,7 +78,23 @@ def dirty_dozen(location_category: str,
                             location_name,
                             start_date,
                             end_date)
-    dozen = heapq.nlargest(12, result, key=lambda x: x[-1])
+    return top_items(result)
+
+
+def top_items(result: List[Tuple[int, str, str, str, int]],
+              count: int = 12) -> List[Dict[str, Any]]:
+    """
+    Returns the items with the most debris out of an item breakdown
+    along with its associated meta data.
+
+    Args:
+        result: The rows returned by item_breakdown.
+        count: The number of items to return.
+
+    Returns:
+        A list of the top items.
+    """
+    dozen = heapq.nlargest(count, result, key=lambda x: x[-1])
     total = sum(count for *_, count in result)
 
     def wrap_for_response(item_id, name, category, material, count, total):
@@ -87,30 +111,461 @@ def dirty_dozen(location_category: str,
             for item_id, name, category, material, count in dozen]
 
 
-def get_child(name: str, children: List[Dict[str, Any]]) -> int:
+# The columns each top-K dimension groups by and their response keys.
+TOP_K_DIMENSIONS = {
+    'item': (('item_id', 'itemId'), ('item_name', 'itemName'),
+             ('category', 'categoryName'), ('material', 'materialName')),
+    'category': (('category', 'categoryName'),),
+    'material': (('material', 'materialName'),),
+    'brand': (('brand', 'brand'),)
+}
+
+
+def top_k(dimension: str,
+          location_category: str,
+          location_name: str,
+          start_date: str,
+          end_date: str,
+          count: int = 12,
+          offset: int = 0) -> Dict[str, Any]:
+    """
+    Returns a page of the items, categories, materials or brands with the
+    most debris, ranked and paginated by the database.
+
+    Debris without a brand is left out of the brand ranking and its total.
+
+    Args:
+        dimension: item, category, material, or brand.
+        location_category: The category of location, site, town, county,
+                           or all for the whole coast.
+        location_name: The name of the location, ignored for all.
+        start_date: The start date for our query.
+        end_date: The end date for our query.
+        count: The number of results in the page.
+        offset: The number of results before the page.
+
+    Returns:
+        A json of the page and the total debris and number of results.
+    """
+    rows, total, groups = _top_k(dimension,
+                                 location_category,
+                                 location_name,
+                                 normalize_date(start_date),
+                                 normalize_date(end_date),
+                                 count,
+                                 offset)
+    keys = [key for _, key in TOP_K_DIMENSIONS[dimension]]
+
+    def wrap_for_response(rank, row):
+        wrapped = dict(zip(keys, row[:-1]))
+        wrapped.update(rank=rank,
+                       count=row[-1],
+                       percentage=row[-1] / total * 100 if total else 0.0)
+        return wrapped
+
+    return {
+        'dimension': dimension,
+        'results': [wrap_for_response(offset + index + 1, row)
+                    for index, row in enumerate(rows)],
+        'total': total,
+        'groups': groups,
+        'offset': offset,
+        'count': count
+    }
+
+
+@cached
+def _top_k(dimension: str,
+           location_category: str,
+           location_name: str,
+           start_date: str,
+           end_date: str,
+           count: int,
+           offset: int) -> Tuple[List[Tuple[Any, ...]], Any, int]:
+    """
+    Returns the ranked rows of top_k, the total debris and the number of
+    groups, from a grouped and limited query and a grouped count.
+    """
+    if dimension not in TOP_K_DIMENSIONS or \
+            location_category not in {'site_name', 'town', 'county', 'all'}:
+        return [], 0, 0
+
+    filters = ''
+    params: List[Any] = [start_date, end_date]
+    if location_category != 'all':
+        filters += ' AND ' + location_category + ' = %s'
+        params.append(location_name)
+    if dimension == 'brand':
+        filters += " AND brand IS NOT NULL AND brand <> ''"
+
+    query, totals_query = _top_k_queries(dimension, filters)
+    with Accessor() as db_handle:
+        db_handle.execute(query, params + [count, offset])
+        rows = db_handle.fetchall()
+        db_handle.execute(totals_query, params)
+        total, groups = db_handle.fetchone()
+
+    return list(rows), total or 0, groups or 0
+
+
+def _top_k_queries(dimension: str, filters: str) -> Tuple[str, str]:
+    """
+    Builds the grouped and limited query of a top-K dimension and the
+    query of its total debris and number of groups.
+
+    Args:
+        dimension: item, category, material, or brand.
+        filters: The conditions after the date range.
+
+    Returns:
+        The ranking and totals queries.
+    """
+    columns = ', '.join(column for column, _ in TOP_K_DIMENSIONS[dimension])
+    group_key = TOP_K_DIMENSIONS[dimension][0][0]
+    query = """
+            SELECT
+                """ + columns + """,
+                SUM(quantity) AS quantity_sum
+            FROM coa_summary_view
+            WHERE %s <= volunteer_date
+                AND volunteer_date <= %s""" + filters + """
+            GROUP BY """ + columns + """
+            ORDER BY quantity_sum DESC, """ + group_key + """
+            LIMIT %s OFFSET %s
+            """
+    totals_query = """
+            SELECT
+                SUM(quantity),
+                COUNT(DISTINCT """ + group_key + """)
+            FROM coa_summary_view
+            WHERE %s <= volunteer_date
+                AND volunteer_date <= %s""" + filters
+    return query, totals_query
+
+
+def compare(location_category: str,
+            location_names: List[str],
+            start_date: str,
+            end_date: str) -> Dict[str, Any]:
+    """
+    Returns the dirty dozen and total of several locations along with the
+    count of every item at each of them, from a single grouped query.
+
+    Args:
+        location_category: The category of location, site, town, or county.
+        location_names: The names of the locations to compare.
+        start_date: The start date for our query.
+        end_date: The end date for our query.
+
+    Returns:
+        A json of each location's dirty dozen and total, and the item by
+        location matrix of counts with the items ordered by total count.
+    """
+    names = list(dict.fromkeys(location_names))
+    per_location = locations_item_breakdown(location_category,
+                                            names,
+                                            normalize_date(start_date),
+                                            normalize_date(end_date))
+    return {
+        'locations': {name: {'dirtydozen': top_items(per_location[name]),
+                             'total': sum(row[-1] for row in per_location[name])}
+                      for name in names},
+        'matrix': _item_matrix(names, per_location)
+    }
+
+
+def _item_matrix(names: List[str],
+                 per_location: Dict[str, List[Tuple[int, str, str, str, int]]]) -> Dict[str, Any]:
+    """
+    Lays the item breakdowns of several locations side by side.
+
+    Items are matched by name, like the breakdowns group them.
+
+    Args:
+        names: The names of the locations, in column order.
+        per_location: The item breakdown rows of each location.
+
+    Returns:
+        The location names, the items ordered by total count, and the
+        count of each item at each location.
+    """
+    items: Dict[str, Tuple[int, str, str]] = {}
+    counts: Dict[str, List[int]] = {}
+    for column, name in enumerate(names):
+        for item_id, item_name, category, material, count in per_location[name]:
+            items.setdefault(item_name, (item_id, category, material))
+            counts.setdefault(item_name, [0] * len(names))[column] = count
+
+    order = sorted(counts, key=lambda item_name: -sum(counts[item_name]))
+    return {
+        'locationNames': names,
+        'items': [{'itemId': items[item_name][0],
+                   'itemName': item_name,
+                   'categoryName': items[item_name][1],
+                   'materialName': items[item_name][2]}
+                  for item_name in order],
+        'counts': [counts[item_name] for item_name in order]
+    }
+
+
+TREND_BUCKETS = ('day', 'week', 'month', 'year')
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """
+    Returns the first day of the bucket a day falls in.
+
+    Args:
+        day: The day.
+        bucket: The bucket size, day, week, month, or year.
+
+    Returns:
+        The first day of the bucket, weeks start on Monday.
+    """
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day: date, bucket: str) -> date:
+    """
+    Returns the first day of the bucket after the one starting on day.
+
+    Args:
+        day: The first day of a bucket.
+        bucket: The bucket size, day, week, month, or year.
+
+    Returns:
+        The first day of the next bucket.
+    """
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    if bucket == 'month':
+        return (day.replace(year=day.year + 1, month=1) if day.month == 12
+                else day.replace(month=day.month + 1))
+    if bucket == 'year':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def trend_bucket_count(start_date: str, end_date: str, bucket: str) -> int:
+    """
+    Returns the number of buckets a trend of a date range has.
+
+    Args:
+        start_date: The start date.
+        end_date: The end date.
+        bucket: The bucket size, day, week, month, or year.
+
+    Returns:
+        The number of buckets, 0 for an empty or malformed range.
+    """
+    try:
+        first = bucket_start(datetime.strptime(start_date, '%Y-%m-%d').date(), bucket)
+        last = bucket_start(datetime.strptime(end_date, '%Y-%m-%d').date(), bucket)
+    except ValueError:
+        return 0
+
+    if last < first:
+        return 0
+    if bucket == 'week':
+        return (last - first).days // 7 + 1
+    if bucket == 'month':
+        return (last.year - first.year) * 12 + last.month - first.month + 1
+    if bucket == 'year':
+        return last.year - first.year + 1
+    return (last - first).days + 1
+
+
+def max_trend_buckets() -> int:
+    """
+    Returns the max number of buckets a trend may have.
+
+    Returns:
+        The TREND_MAX_BUCKETS environment variable, 5000 by default.
+    """
+    return int(os.environ.get('TREND_MAX_BUCKETS', '5000'))
+
+
+def trend(location_category: str,
+          location_name: str,
+          start_date: str,
+          end_date: str,
+          bucket: str = 'month',
+          item_id: Optional[int] = None,
+          material: Optional[str] = None,
+          category: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    Returns the index of the first name of the child that matches the
-    name provided.
+    Returns the total debris of a location per day, week, month, or year.
+
+    The daily totals come from one grouped query and are then folded into
+    the buckets, every bucket in the range is returned even when empty.
+    The results are cached keyed on the normalized arguments, a range of
+    more than max_trend_buckets buckets is empty.
 
     Args:
-        name: The name of the child.
-        children: The list of children.
+        location_category: The category of location, site, town, or county.
+        location_name: The name of the location.
+        start_date: The start date for our query.
+        end_date: The end date for our query.
+        bucket: The bucket size, day, week, month, or year.
+        item_id: Only count this item.
+        material: Only count items of this material.
+        category: Only count items of this category.
 
     Returns:
-        The index of the first child matching that name.
-        If none exist, return -1.
+        A list of the first day of each bucket and its count.
+    """
+    if (location_category not in {'site_name', 'town', 'county'}
+            or bucket not in TREND_BUCKETS
+            or not 0 < trend_bucket_count(start_date, end_date, bucket)
+            <= max_trend_buckets()):
+        return []
+
+    return _trend(location_category,
+                  location_name,
+                  normalize_date(start_date),
+                  normalize_date(end_date),
+                  bucket,
+                  (('item_id', item_id), ('material', material), ('category', category)))
+
+
+@cached
+def _trend(location_category: str,
+           location_name: str,
+           start_date: str,
+           end_date: str,
+           bucket: str,
+           filters: Tuple[Tuple[str, Any], ...]) -> List[Dict[str, Any]]:
+    """
+    Returns the trend of trend for normalized arguments, filtered on the
+    columns with a value.
     """
-    for index, child in enumerate(children):
-        if child['name'] == name:
-            return index
+    first = datetime.strptime(start_date, '%Y-%m-%d').date()
+    last = datetime.strptime(end_date, '%Y-%m-%d').date()
+    conditions = ''
+    params: List[Any] = [first, last, location_name]
+    for column, value in filters:
+        if value is not None:
+            conditions += ' AND ' + column + ' = %s'
+            params.append(value)
+
+    query = """
+            SELECT
+                volunteer_date,
+                SUM(quantity) AS quantity_sum
+            FROM coa_summary_view
+            WHERE %s <= volunteer_date
+                AND volunteer_date <= %s
+                AND """ + location_category + """ = %s""" + conditions + """
+            GROUP BY volunteer_date
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query, params)
+        return _fold_buckets(db_handle.fetchall(), first, last, bucket)
+
 
-    return -1
+def _fold_buckets(rows: List[Tuple[Any, Any]], first: date, last: date,
+                  bucket: str) -> List[Dict[str, Any]]:
+    """
+    Folds daily totals into every bucket of a date range.
+
+    Args:
+        rows: The volunteer date and total of each day.
+        first: The first day of the range.
+        last: The last day of the range.
+        bucket: The bucket size, day, week, month, or year.
+
+    Returns:
+        A list of the first day of each bucket and its count.
+    """
+    buckets: Dict[date, int] = {}
+    day = bucket_start(first, bucket)
+    while day <= last:
+        buckets[day] = 0
+        day = next_bucket(day, bucket)
+
+    for volunteer_date, quantity in rows:
+        # A DATETIME column comes back as a datetime, bucketed by its day.
+        if isinstance(volunteer_date, datetime):
+            volunteer_date = volunteer_date.date()
+        key = bucket_start(volunteer_date, bucket)
+        if key in buckets:
+            buckets[key] += int(quantity or 0)
+
+    return [{'bucket': day.strftime('%Y-%m-%d'), 'count': count}
+            for day, count in buckets.items()]
+
+
+def build_sunburst(result: List[Tuple[int, str, str, str, int]],
+                   rollup: bool = False,
+                   depth: int = 3) -> Dict[str, Any]:
+    """
+    Aggregates the item breakdown into the material and category hierarchy
+    of the sunburst chart in a single pass.
+
+    Materials and categories keep the order they are first seen in, the
+    same as the result rows.
+
+    Args:
+        result: The rows returned by item_breakdown.
+        rollup: Add the summed count to the material and category nodes.
+        depth: 1 for materials only, 2 for materials and categories,
+               and 3 for the items as well.
+
+    Returns:
+        A json breakdown of the debris.
+    """
+    depth = min(max(depth, 1), 3)
+    materials: Dict[str, Dict[str, Any]] = {}
+    categories: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    sunburst_data: Dict[str, Any] = {'name': 'Debris', 'children': []}
+    for _, item_name, category_name, material_name, count in result:
+        material = materials.get(material_name)
+        if material is None:
+            material = {'name': material_name}
+            if depth > 1:
+                material['children'] = []
+            if rollup or depth == 1:
+                material['count'] = 0
+            materials[material_name] = material
+            sunburst_data['children'].append(material)
+
+        if 'count' in material:
+            material['count'] += count
+        if depth == 1:
+            continue
+
+        category = categories.get((material_name, category_name))
+        if category is None:
+            category = {'name': category_name}
+            if depth > 2:
+                category['children'] = []
+            if rollup or depth == 2:
+                category['count'] = 0
+            categories[(material_name, category_name)] = category
+            material['children'].append(category)
+
+        if 'count' in category:
+            category['count'] += count
+        if depth == 2:
+            continue
+
+        category['children'].append({'name': item_name, 'count': count})
+
+    return sunburst_data
 
 
 def breakdown(location_category: str,
               location_name: str,
               start_date: str,
-              end_date: str) -> Dict[str, Any]:
+              end_date: str,
+              rollup: bool = False,
+              depth: int = 3) -> Dict[str, Any]:
     """
     Returns the breakdown of the all the different types of debris.
 
@@ -119,6 +574,9 @@ def breakdown(location_category: str,
         location_name: The name of the location.
         start_date: The start date for our query.
         end_date: The end date for our query.
+        rollup: Add the summed count to the material and category nodes.
+        depth: 1 for materials only, 2 for materials and categories,
+               and 3 for the items as well.
 
     Returns:
         A json breakdown of the debris.
@@ -127,28 +585,101 @@ def breakdown(location_category: str,
                             location_name,
                             start_date,
                             end_date)
-    # Aggregate items into material and category hierarchy for sunburst chart
-    sunburst_data: Dict[str, Any] = {'name': 'Debris', 'children': []}
-    for _, item_name, category_name, material_name, count in result:
-        # Check if this material has already been added
-        material_idx = get_child(material_name, sunburst_data['children'])
-        if material_idx < 0:
-            sunburst_data['children'].append(
-                {'name': material_name, 'children': []})
-            material_idx = len(sunburst_data['children']) - 1
-
-        # Check if this category has already been added
-        material = sunburst_data['children'][material_idx]
-        category_idx = get_child(category_name, material['children'])
-        if category_idx < 0:
-            sunburst_data['children'][material_idx]['children'].append(
-                {'name': category_name, 'children': []})
-            category_idx = len(material['children']) - 1
-
-        material['children'][category_idx]['children'].append(
-            {'name': item_name, 'count': count})
+    return build_sunburst(result, rollup=rollup, depth=depth)
 
-    return sunburst_data
+
+def dashboard(location_category: str,
+              location_name: str,
+              start_date: str,
+              end_date: str,
+              rollup: bool = False,
+              depth: int = 3) -> Dict[str, Any]:
+    """
+    Returns the dirty dozen, the breakdown and the valid date range of a
+    location, answered by one cached aggregate query.
+
+    Args:
+        location_category: The category of location, site, town, or county.
+        location_name: The name of the location.
+        start_date: The start date for our query.
+        end_date: The end date for our query.
+        rollup: Add the summed count to the material and category nodes.
+        depth: 1 for materials only, 2 for materials and categories,
+               and 3 for the items as well.
+
+    Returns:
+        A json of the dirty dozen, breakdown and valid date range.
+    """
+    result, first, last = _dashboard_summary(location_category,
+                                             location_name,
+                                             normalize_date(start_date),
+                                             normalize_date(end_date))
+    return {
+        'dirtydozen': top_items(result),
+        'data': build_sunburst(result, rollup=rollup, depth=depth),
+        'validDateRange': _date_range(first, last)
+    }
+
+
+@cached
+def _dashboard_summary(location_category: str,
+                       location_name: str,
+                       start_date: str,
+                       end_date: str) -> Tuple[List[Tuple[int, str, str, str, int]],
+                                               Optional[date],
+                                               Optional[date]]:
+    """
+    Returns the item breakdown of a date range, see item_breakdown, and the
+    first and last volunteer date of a location.
+
+    The breakdown only sums the quantities within the date range, while
+    the first and last date span every row of the location, so one grouped
+    query over the location answers both.
+    """
+    if location_category not in {'site_name', 'town', 'county'}:
+        return [], None, None
+
+    columnar = engine.get_engine()
+    if columnar is not None:
+        days = columnar.valid_date_range(location_category, location_name)
+        first, last = days if days is not None else (None, None)
+        return (columnar.item_breakdown(location_category,
+                                        location_name,
+                                        start_date,
+                                        end_date), first, last)
+
+    query = """
+            SELECT
+                item_id,
+                item_name,
+                category,
+                material,
+                SUM(CASE
+                        WHEN %s <= volunteer_date AND volunteer_date <= %s
+                        THEN quantity
+                        ELSE 0
+                    END) AS quantity_sum,
+                MIN(volunteer_date),
+                MAX(volunteer_date)
+            FROM coa_summary_view
+            WHERE """ + location_category + """ = %s
+            GROUP BY item_name
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query, (start_date,
+                                  end_date,
+                                  location_name))
+        rows = db_handle.fetchall()
+
+    if not rows:
+        return [], None, None
+
+    result = [(item_id, item_name, category, material, int(quantity))
+              for item_id, item_name, category, material, quantity, _, _ in rows
+              if quantity]
+    return (result,
+            min(row[5] for row in rows),
+            max(row[6] for row in rows))
 
 
 def valid_date_range(location_category: str,
@@ -161,11 +692,46 @@ def valid_date_range(location_category: str,
         location_name: The name of the location.
 
      Returns:
-        The date range.
+        The date range, empty if the location has no data.
      """
-    if location_category not in {'site_name', 'town', 'county'}:
+    return _date_range(*_location_dates(location_category, location_name))
+
+
+def _date_range(first: Optional[date], last: Optional[date]) -> Dict[str, str]:
+    """
+    Formats the first and last volunteer date of a location.
+
+    Args:
+        first: The first date, None if the location has no data.
+        last: The last date, None if the location has no data.
+
+    Returns:
+        The date range, empty if the location has no data.
+    """
+    if first is None or last is None:
         return {}
 
+    return {
+        'firstDate': first.strftime('%Y-%m-%d'),
+        'lastDate': last.strftime('%Y-%m-%d')
+    }
+
+
+@cached
+def _location_dates(location_category: str,
+                    location_name: str) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Returns the first and last volunteer date of a location, or None for
+    both if it has no data.
+    """
+    if location_category not in {'site_name', 'town', 'county'}:
+        return None, None
+
+    columnar = engine.get_engine()
+    if columnar is not None:
+        days = columnar.valid_date_range(location_category, location_name)
+        return days if days is not None else (None, None)
+
     query = """
             SELECT
                MIN(volunteer_date),
@@ -177,10 +743,7 @@ def valid_date_range(location_category: str,
         db_handle.execute(query, (location_name))
         first, last = db_handle.fetchone()
 
-    return {
-        'firstDate': first.strftime('%Y-%m-%d'),
-        'lastDate': last.strftime('%Y-%m-%d')
-    }
+    return first, last
 
 
 def locations_hierarchy() -> Dict[str, Dict[str, List[str]]]:
@@ -220,6 +783,7 @@ def locations_hierarchy() -> Dict[str, Dict[str, List[str]]]:
     return hierarchy
 
 
+@cached
 def all_locations() -> List[Tuple[str, str, str]]:
     """
     Returns a list of tuples comprising of the distinct sites,
@@ -247,6 +811,22 @@ def all_locations() -> List[Tuple[str, str, str]]:
         return db_handle.fetchall()
 
 
+def normalize_date(day: str) -> str:
+    """
+    Zero pads a date like 2016-1-1 so equal dates compare and cache equal.
+
+    Args:
+        day: The date.
+
+    Returns:
+        The date as YYYY-MM-DD, or unchanged if it isn't one.
+    """
+    try:
+        return datetime.strptime(day, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return day
+
+
 def item_breakdown(location_category: str,
                    location_name: str,
                    start_date: str,
@@ -255,6 +835,11 @@ def item_breakdown(location_category: str,
     Returns a list of tuples comprising of the item id, item name, category,
     material, and quantity.
 
+    This is answered by the in-memory engine when it is enabled, and for
+    towns and counties by the daily rollup when it is on. The results are
+    cached, and identical concurrent calls run once, keyed on the
+    normalized arguments.
+
     Args:
         location_category: The type of location.
         location_name: The name of the location.
@@ -264,10 +849,39 @@ def item_breakdown(location_category: str,
     Returns:
         A list of item id, item name, category, material, quantity.
     """
+    return _item_breakdown(location_category,
+                           location_name,
+                           normalize_date(start_date),
+                           normalize_date(end_date))
+
+
+@cached
+def _item_breakdown(location_category: str,
+                    location_name: str,
+                    start_date: str,
+                    end_date: str) -> List[Tuple[int, str, str, str, int]]:
+    """
+    Returns the item breakdown of item_breakdown for normalized arguments.
+    """
     if (location_category not in {'site_name', 'town', 'county'}
             or end_date < start_date):
         return []
 
+    columnar = engine.get_engine()
+    if columnar is not None:
+        return columnar.item_breakdown(location_category,
+                                       location_name,
+                                       start_date,
+                                       end_date)
+
+    # Towns and counties span many sites, so the daily rollup is much
+    # smaller to scan than the raw view.
+    if location_category in {'town', 'county'} and daily_rollup.enabled():
+        return daily_rollup.item_breakdown(location_category,
+                                           location_name,
+                                           start_date,
+                                           end_date)
+
     query = """
             SELECT
                 item_id,
@@ -280,9 +894,66 @@ def item_breakdown(location_category: str,
                 AND volunteer_date <= %s
                 AND """ + location_category + """ = %s
             GROUP BY item_name
+            HAVING quantity_sum <> 0
             """
     with Accessor() as db_handle:
         db_handle.execute(query, (start_date,
                                   end_date,
                                   location_name))
         return db_handle.fetchall()
+
+
+def locations_item_breakdown(location_category: str,
+                             location_names: List[str],
+                             start_date: str,
+                             end_date: str) -> Dict[str, List[Tuple[int, str, str, str, int]]]:
+    """
+    Returns the item breakdown of several locations from one grouped query.
+
+    Args:
+        location_category: The type of location.
+        location_names: The names of the locations.
+        start_date: The start date.
+        end_date: The end date.
+
+    Returns:
+        The item breakdown rows of each location, see item_breakdown.
+    """
+    breakdowns: Dict[str, List[Tuple[int, str, str, str, int]]] = {
+        name: [] for name in location_names}
+    if (location_category not in {'site_name', 'town', 'county'}
+            or end_date < start_date or not location_names):
+        return breakdowns
+
+    columnar = engine.get_engine()
+    if columnar is not None:
+        return {name: columnar.item_breakdown(location_category,
+                                              name,
+                                              start_date,
+                                              end_date)
+                for name in location_names}
+
+    query = """
+            SELECT
+                """ + location_category + """,
+                item_id,
+                item_name,
+                category,
+                material,
+                SUM(quantity) AS quantity_sum
+            FROM coa_summary_view
+            WHERE %s <= volunteer_date
+                AND volunteer_date <= %s
+                AND """ + location_category + """ IN %s
+            GROUP BY """ + location_category + """, item_name
+            HAVING quantity_sum <> 0
+            """
+    with Accessor() as db_handle:
+        db_handle.execute(query, (start_date,
+                                  end_date,
+                                  tuple(location_names)))
+        for name, *row, quantity in db_handle.fetchall():
+            if name in breakdowns:
+                breakdowns[name].append((*row, int(quantity)))
+
+    return breakdowns
@@ -0,0 +1,323 @@
+"""
+A module designed to hold the slow query log.
+
+Every statement run through an Accessor that takes longer than a threshold
+is written to a local log with its normalized SQL, parameters, duration,
+rows and calling function, failed and timed out statements included. The
+EXPLAIN plan is captured for the first few slow runs of each normalized
+statement, counted across all the workers. The log is one json sample per
+line and is rotated by size, all the workers share it under a file lock.
+
+The plans are captured and the log is written by a background thread of
+each worker, so a slow statement doesn't slow down its request further.
+Samples are dropped while SLOW_QUERY_QUEUE of them are waiting.
+
+The log is set up with the following environment variables:
+    SLOW_QUERY_MS       - Log statements slower than this, unset disables it.
+    SLOW_QUERY_LOG      - The log file (default slow_queries.log in the
+                          private RUNTIME_DIR).
+    SLOW_QUERY_MAX_MB   - The size the log is rotated at (default 10).
+    SLOW_QUERY_BACKUPS  - The number of rotated logs kept (default 3).
+    SLOW_QUERY_EXPLAINS - EXPLAIN the first N slow runs of a statement
+                          (default 3).
+    SLOW_QUERY_QUEUE    - The max samples waiting to be written (default 100).
+"""
+
+import fcntl
+import json
+import os
+import queue
+import re
+import threading
+import time
+from typing import IO, Any, Dict, List, Optional, Tuple
+
+from coa_flask_app import db_accessor, runtime_files
+
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+_QUEUE: Optional['queue.Queue[Tuple[Dict[str, Any], str, Any]]'] = None
+_QUEUE_PID = 0
+_QUEUE_LOCK = threading.Lock()
+_WRITER = threading.local()
+
+
+def threshold() -> Optional[float]:
+    """
+    Returns the slow query threshold.
+
+    Returns:
+        The threshold in seconds, or None if the log is off.
+    """
+    value = os.environ.get('SLOW_QUERY_MS')
+    return float(value) / 1000 if value else None
+
+
+def log_path() -> str:
+    """
+    Returns the slow query log file.
+
+    Returns:
+        The log path.
+    """
+    return (os.environ.get('SLOW_QUERY_LOG')
+            or runtime_files.runtime_path('slow_queries.log'))
+
+
+def normalize(query: str) -> str:
+    """
+    Normalizes a statement so runs with different values group together.
+
+    Literals and placeholders become ?, IN lists collapse to (...) and
+    whitespace is squeezed.
+
+    Args:
+        query: The statement.
+
+    Returns:
+        The normalized statement.
+    """
+    normalized = _STRING.sub('?', query).replace('%s', '?')
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _LIST.sub('(...)', normalized)
+    return _SPACE.sub(' ', normalized).strip()
+
+
+def _explain(query: str, params: Any) -> Optional[List[Any]]:
+    """
+    Captures the plan of a slow SELECT on a connection of the pool.
+
+    Args:
+        query: The statement.
+        params: The parameters of the statement.
+
+    Returns:
+        The plan rows, or None if it can't be explained.
+    """
+    try:
+        with db_accessor.Accessor() as cursor:
+            cursor.execute('EXPLAIN ' + query, params)
+            return [[str(value) for value in row] for row in cursor.fetchall()]
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _locked_log(path: str) -> IO[Any]:
+    """
+    Opens the lock file of the log, the caller takes the flock on it.
+
+    Args:
+        path: The log file.
+
+    Returns:
+        The open lock file.
+    """
+    return runtime_files.open_private(path + '.lock', 'a')
+
+
+def _claim_explain(path: str, normalized: str) -> bool:
+    """
+    Counts a plan capture of a statement in the count file every worker
+    shares, unless it has had SLOW_QUERY_EXPLAINS of them already.
+
+    Args:
+        path: The log file.
+        normalized: The normalized statement.
+
+    Returns:
+        True if the plan should be captured.
+    """
+    limit = int(os.environ.get('SLOW_QUERY_EXPLAINS', '3'))
+    with _locked_log(path) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with runtime_files.open_private(path + '.explained', 'a+') as handle:
+            handle.seek(0)
+            try:
+                counts = json.loads(handle.read() or '{}')
+            except ValueError:
+                counts = {}
+            if counts.get(normalized, 0) >= limit:
+                return False
+
+            counts[normalized] = counts.get(normalized, 0) + 1
+            with runtime_files.open_private(path + '.explained.tmp', 'w') as new:
+                json.dump(counts, new)
+            os.replace(path + '.explained.tmp', path + '.explained')
+    return True
+
+
+def _append(line: str) -> None:
+    """
+    Appends a line to the log, rotating it first if it is too big.
+
+    Args:
+        line: The json sample.
+    """
+    path = log_path()
+    max_bytes = float(os.environ.get('SLOW_QUERY_MAX_MB', '10')) * 1024 * 1024
+    backups = int(os.environ.get('SLOW_QUERY_BACKUPS', '3'))
+    with _locked_log(path) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            for index in range(backups - 1, 0, -1):
+                if os.path.exists(f'{path}.{index}'):
+                    os.replace(f'{path}.{index}', f'{path}.{index + 1}')
+            if backups:
+                os.replace(path, path + '.1')
+            else:
+                os.remove(path)
+
+        with runtime_files.open_private(path, 'a') as handle:
+            handle.write(line + '\n')
+
+
+def _write(sample: Dict[str, Any], query: str, params: Any) -> None:
+    """
+    Captures the plan of a sample if it is among the first of its statement,
+    then appends it to the log.
+
+    Args:
+        sample: The sample, without its plan.
+        query: The statement as it ran.
+        params: The parameters of the statement.
+    """
+    if query.lstrip().upper().startswith('SELECT') \
+            and _claim_explain(log_path(), sample['query']):
+        sample['explain'] = _explain(query, params)
+    _append(json.dumps(sample))
+
+
+def _run_writer(samples: 'queue.Queue[Tuple[Dict[str, Any], str, Any]]') -> None:
+    """
+    Writes the queued samples, for ever.
+
+    Args:
+        samples: The queue of samples.
+    """
+    # The plans run through an Accessor too, and must not be logged.
+    _WRITER.active = True
+    while True:
+        sample, query, params = samples.get()
+        try:
+            _write(sample, query, params)
+        except Exception:  # pylint: disable=broad-except
+            pass
+        finally:
+            samples.task_done()
+
+
+def _get_queue() -> 'queue.Queue[Tuple[Dict[str, Any], str, Any]]':
+    """
+    Returns this process' sample queue, starting its writer after a fork.
+
+    Returns:
+        The queue.
+    """
+    global _QUEUE, _QUEUE_PID  # pylint: disable=global-statement
+    with _QUEUE_LOCK:
+        if _QUEUE is None or _QUEUE_PID != os.getpid():
+            _QUEUE = queue.Queue(int(os.environ.get('SLOW_QUERY_QUEUE', '100')))
+            _QUEUE_PID = os.getpid()
+            threading.Thread(target=_run_writer, args=(_QUEUE,),
+                             name='slow-query-log', daemon=True).start()
+        return _QUEUE
+
+
+def record(event: db_accessor.QueryEvent) -> None:
+    """
+    The query hook queueing statements over the threshold for the log.
+
+    Args:
+        event: The statement that ran.
+    """
+    limit = threshold()
+    if limit is None or event.duration < limit or getattr(_WRITER, 'active', False):
+        return
+
+    sample = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'pid': os.getpid(),
+        'callSite': event.call_site,
+        'query': normalize(event.query),
+        'params': repr(event.params)[:500],
+        'durationMs': round(event.duration * 1000, 3),
+        'rows': event.rows,
+        'failed': event.failed,
+        'explain': None
+    }
+    # An unbuffered statement is still streaming, its plan isn't captured.
+    query = '' if event.unbuffered else event.query
+    try:
+        _get_queue().put_nowait((sample, query, event.params))
+    except queue.Full:
+        pass
+
+
+def flush() -> None:
+    """
+    Waits until every queued sample is written to the log.
+    """
+    _get_queue().join()
+
+
+def top_offenders(limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Aggregates the log into the statements with the most total slow time.
+
+    Args:
+        limit: The number of statements to return.
+
+    Returns:
+        Each statement's call sites, count, failures, total, mean and max
+        duration, and its latest plan.
+    """
+    path = log_path()
+    backups = int(os.environ.get('SLOW_QUERY_BACKUPS', '3'))
+    offenders: Dict[str, Dict[str, Any]] = {}
+    for file_path in [f'{path}.{index}' for index in range(backups, 0, -1)] + [path]:
+        if not os.path.exists(file_path):
+            continue
+
+        with open(file_path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    sample = json.loads(line)
+                except ValueError:
+                    continue
+
+                offender = offenders.setdefault(sample['query'], {
+                    'query': sample['query'],
+                    'callSites': [],
+                    'count': 0,
+                    'failures': 0,
+                    'totalMs': 0.0,
+                    'maxMs': 0.0,
+                    'explain': None
+                })
+                if sample['callSite'] not in offender['callSites']:
+                    offender['callSites'].append(sample['callSite'])
+                offender['count'] += 1
+                offender['failures'] += 1 if sample.get('failed') else 0
+                offender['totalMs'] += sample['durationMs']
+                offender['maxMs'] = max(offender['maxMs'], sample['durationMs'])
+                offender['lastSeen'] = sample['time']
+                if sample['explain'] is not None:
+                    offender['explain'] = sample['explain']
+
+    ranked = sorted(offenders.values(), key=lambda item: -item['totalMs'])[:limit]
+    for offender in ranked:
+        offender['meanMs'] = round(offender['totalMs'] / offender['count'], 3)
+        offender['totalMs'] = round(offender['totalMs'], 3)
+    return ranked
+
+
+def init() -> None:
+    """
+    Registers the slow query hook when the log is on.
+    """
+    if threshold() is not None:
+        db_accessor.add_query_hook(record)
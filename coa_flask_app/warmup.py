@@ -0,0 +1,173 @@
+"""
+A module designed to warm the app up before uwsgi forks its workers.
+
+uwsgi loads the app once in the master and forks every worker from it,
+so whatever is loaded at import is shared by the workers copy-on-write.
+The warm-up loads the reference data, the pre-serialized payloads and the
+in-memory engine, closes the master's database connections so no socket
+crosses the fork, and freezes the garbage collector so the collector
+doesn't write to, and copy, the shared pages.
+
+Each worker reports the time from its fork to its first response.
+The warm-up is set up with the following environment variable:
+    WARMUP - Set to 1 to warm up, or 0 to skip it. By default it runs
+             under uwsgi unless FLASK_ENV is development, and not in the
+             scripts and benchmarks importing the package.
+"""
+
+import gc
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from flask import Flask
+
+from coa_flask_app import (contribution, data_version, db_accessor, engine,
+                           fast_json, metrics, site)
+
+try:
+    import uwsgi  # pylint: disable=unused-import
+    from uwsgidecorators import postfork
+except ImportError:  # pragma: no cover
+    uwsgi = None  # pylint: disable=invalid-name
+    postfork = None  # pylint: disable=invalid-name
+
+
+_WARMUP: Dict[str, Any] = {'enabled': False}
+_WORKER: Dict[str, Any] = {'pid': os.getpid(), 'started': time.time(),
+                           'firstResponseSeconds': None}
+
+
+def enabled() -> bool:
+    """
+    Checks if the warm-up should run.
+
+    Returns:
+        True if WARMUP is on, or it is unset and the app is served by uwsgi
+        outside of development.
+    """
+    value = os.environ.get('WARMUP')
+    if value is None:
+        return uwsgi is not None and os.environ.get('FLASK_ENV') != 'development'
+    return value.lower() not in {'0', 'false', 'no'}
+
+
+def steps() -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    Returns the loading steps of the warm-up in order.
+
+    Returns:
+        The name and function of each step.
+    """
+    loaders: List[Tuple[str, Callable[[], Any]]] = [
+        ('dataVersion', data_version.current),
+        ('locations', site.all_locations),
+        ('teamLeads', contribution.get_tls),
+        ('trashItems', contribution.get_trash_items)
+    ]
+    loaders.extend((f'payload:{name}', _payload_loader(name))
+                   for name in sorted(fast_json.PAYLOADS))
+    if engine.enabled():
+        loaders.append(('engine', engine.get_engine))
+    return loaders
+
+
+def _payload_loader(name: str) -> Callable[[], Any]:
+    """
+    Returns a step building the bytes of a pre-serialized payload.
+
+    Args:
+        name: The name of the payload.
+
+    Returns:
+        The step.
+    """
+    return lambda: fast_json.payload_bytes(name)
+
+
+def warm_up(app: Flask) -> Dict[str, Any]:
+    """
+    Loads the shared data in this process.
+
+    A failing step is logged and skipped so the app still starts when the
+    database is away, the workers then load the data themselves.
+
+    Args:
+        app: The Flask app, for its logger.
+
+    Returns:
+        The time taken by each step and the errors.
+    """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    for name, loader in steps():
+        step_started = time.perf_counter()
+        try:
+            loader()
+        except Exception as error:  # pylint: disable=broad-except
+            app.logger.warning('Warm-up step %s failed: %s', name, error)
+            errors[name] = str(error)
+        timings[name] = round(time.perf_counter() - step_started, 6)
+
+    db_accessor.get_pool().close_all()
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    return {
+        'enabled': True,
+        'pid': os.getpid(),
+        'seconds': round(time.perf_counter() - started, 6),
+        'steps': timings,
+        'errors': errors
+    }
+
+
+def _mark_worker_start() -> None:
+    """
+    Records the fork time of a new worker, once per process.
+    """
+    if _WORKER['pid'] != os.getpid():
+        _WORKER.update(pid=os.getpid(), started=time.time(),
+                       firstResponseSeconds=None)
+
+
+def warmup_stats() -> Dict[str, Any]:
+    """
+    Returns the master's warm-up and this worker's start.
+
+    Returns:
+        A dict of the warm-up timings and the worker's time to first response.
+    """
+    return {
+        'warmup': _WARMUP,
+        'worker': dict(_WORKER, uptime=round(time.time() - _WORKER['started'], 3))
+    }
+
+
+def init_app(app: Flask) -> None:
+    """
+    Warms the app up when enabled and times every worker's first response.
+
+    Args:
+        app: The Flask app.
+    """
+    global _WARMUP  # pylint: disable=global-statement
+    if enabled():
+        _WARMUP = warm_up(app)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_mark_worker_start)
+    if postfork is not None:
+        postfork(_mark_worker_start)
+
+    @app.after_request
+    def record_first_response(response):
+        _mark_worker_start()
+        if _WORKER['firstResponseSeconds'] is None:
+            elapsed = time.time() - _WORKER['started']
+            _WORKER['firstResponseSeconds'] = round(elapsed, 6)
+            metrics.observe('coa_worker_first_response_seconds', elapsed,
+                            warm=str(_WARMUP['enabled']).lower())
+        return response
@@ -0,0 +1,664 @@
+"""
+A module designed to hold the optional write-behind queue for contributions.
+
+In write-behind mode a contribution is validated, appended to a local
+append-only journal and acknowledged with an id right away. A background
+flusher then group commits the queued contributions to MySQL in batches,
+retrying while the database is unavailable. Only one worker on the host
+flushes at a time, chosen with a file lock.
+
+Delivery is at least once, a crash between a commit and the recording of
+its status replays that batch. The committed part of the journal is
+dropped once it is flushed, and the statuses are kept for a day. An entry
+torn by a crash half way through its append is skipped and marked failed.
+The mode is set with the following environment variables:
+    WRITE_BEHIND            - Set to 1 to queue contributions.
+    WRITE_BEHIND_DIR        - The journal directory (default write_behind in
+                              the private RUNTIME_DIR).
+    WRITE_BEHIND_BATCH      - Max contributions per group commit (default 100).
+    WRITE_BEHIND_INTERVAL   - Seconds between flushes (default 1).
+    WRITE_BEHIND_STATUS_TTL - Seconds the status of a flushed contribution
+                              is kept (default 86400).
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+from flask import Flask
+
+from coa_flask_app import contribution, runtime_files
+
+try:
+    import uwsgi  # pylint: disable=unused-import
+    from uwsgidecorators import postfork
+except ImportError:  # pragma: no cover
+    uwsgi = None  # pylint: disable=invalid-name
+    postfork = None  # pylint: disable=invalid-name
+
+
+LOGGER = logging.getLogger(__name__)
+
+# The committed part of the journal, or the status file, is rewritten once
+# it passes this size.
+COMPACT_BYTES = 1024 * 1024
+
+_ID = re.compile(rb'"id": "([0-9a-f]{32})"')
+
+
+def enabled() -> bool:
+    """
+    Checks if contributions should be queued instead of written directly.
+
+    Returns:
+        True if write-behind mode is on.
+    """
+    return os.environ.get('WRITE_BEHIND', '') == '1'
+
+
+class Journal:
+    """
+    The append-only files holding the queued contributions and their status.
+
+    The journal and status files hold one json entry per line. The offset
+    file holds the inode of the journal and how far into it the flusher has
+    committed. Both files are compacted by writing a new file and moving it
+    in place, so readers notice a compaction by the inode changing.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        The constructor of the Journal class.
+
+        Args:
+            directory: The directory to keep the files in.
+        """
+        runtime_files.private_dir(directory)
+        self.journal_path = os.path.join(directory, 'journal.ndjson')
+        self.status_path = os.path.join(directory, 'status.ndjson')
+        self.offset_path = os.path.join(directory, 'journal.offset')
+        self.lock_path = os.path.join(directory, 'flusher.lock')
+        self._lock = threading.Lock()
+        self._statuses: Dict[str, Dict[str, Any]] = {}
+        # The inode and offset the statuses have been read up to.
+        self._statuses_read = (0, 0)
+
+    @staticmethod
+    def _append(path: str, entries: List[Dict[str, Any]]) -> None:
+        """
+        Durably appends entries to a file shared by all the workers.
+
+        An append torn by a crash is ended first, so it stays a line of its
+        own, and an append racing a compaction is retried on the new file.
+
+        Args:
+            path: The file to append to.
+            entries: The json entries to append.
+        """
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode()
+        while True:
+            with runtime_files.open_private(path, 'a+b') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    info = os.fstat(handle.fileno())
+                    if os.stat(path).st_ino != info.st_ino:
+                        continue
+                    if info.st_size and \
+                            os.pread(handle.fileno(), 1, info.st_size - 1) != b'\n':
+                        data = b'\n' + data
+                    handle.write(data)
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                    return
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _scan(handle: Any, offset: int,
+              limit: Optional[int] = None) -> List[Tuple[Dict[str, Any], int]]:
+        """
+        Reads the entries of a file from an offset, the caller holds a
+        shared lock on it so no append is half written.
+
+        A line that isn't complete json was torn by a crash, it is returned
+        as an entry marked torn with the id it still holds, if any.
+
+        Args:
+            handle: The open file.
+            offset: The byte offset to start from.
+            limit: The max number of entries to read.
+
+        Returns:
+            Each entry with the offset after it.
+        """
+        entries: List[Tuple[Dict[str, Any], int]] = []
+        handle.seek(offset)
+        for line in handle:
+            if limit is not None and len(entries) >= limit:
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                match = _ID.search(line)
+                entry = {'id': match.group(1).decode() if match else None,
+                         'torn': True}
+            entries.append((entry, offset))
+
+        return entries
+
+    @classmethod
+    def _read(cls, path: str, read: Tuple[int, int]) -> Tuple[List[Dict[str, Any]],
+                                                              Tuple[int, int]]:
+        """
+        Reads the entries of a file added since a previous read.
+
+        Args:
+            path: The file to read.
+            read: The inode and offset read up to, the file is read from the
+                  start if it was compacted since.
+
+        Returns:
+            The entries and the inode and offset read up to.
+        """
+        try:
+            with open(path, 'rb') as handle:
+                fcntl.flock(handle, fcntl.LOCK_SH)
+                inode = os.fstat(handle.fileno()).st_ino
+                offset = read[1] if read[0] == inode else 0
+                entries = cls._scan(handle, offset)
+        except FileNotFoundError:
+            return [], read
+        return ([entry for entry, _ in entries],
+                (inode, entries[-1][1] if entries else offset))
+
+    def enqueue(self, record: Dict[str, Any]) -> str:
+        """
+        Appends a contribution to the journal.
+
+        Args:
+            record: The validated contribution record.
+
+        Returns:
+            The id of the queued contribution.
+        """
+        contribution_id = uuid.uuid4().hex
+        self._append(self.journal_path, [{'id': contribution_id,
+                                          'queued': time.time(),
+                                          'record': record}])
+        return contribution_id
+
+    def committed_offset(self, inode: int) -> int:
+        """
+        Returns how far into the journal has been committed.
+
+        Args:
+            inode: The inode of the journal, the offset of a journal since
+                   compacted away doesn't count.
+
+        Returns:
+            The byte offset.
+        """
+        try:
+            with open(self.offset_path, encoding='utf-8') as handle:
+                committed = json.load(handle)
+        except FileNotFoundError:
+            return 0
+        return committed['offset'] if committed['inode'] == inode else 0
+
+    def pending(self, limit: Optional[int]) -> Tuple[List[Tuple[Dict[str, Any], int]], int]:
+        """
+        Reads the next queued contributions that haven't been committed.
+
+        Args:
+            limit: The max number of contributions to read, or None for all.
+
+        Returns:
+            Each journal entry with the offset after it, and the inode of
+            the journal.
+        """
+        try:
+            with open(self.journal_path, 'rb') as handle:
+                fcntl.flock(handle, fcntl.LOCK_SH)
+                inode = os.fstat(handle.fileno()).st_ino
+                return self._scan(handle, self.committed_offset(inode), limit), inode
+        except FileNotFoundError:
+            return [], 0
+
+    def complete(self, statuses: List[Dict[str, Any]], inode: int,
+                 offset: int) -> None:
+        """
+        Records the outcome of the start of a batch and moves the committed
+        offset past it.
+
+        Args:
+            statuses: The status entry of each contribution recorded.
+            inode: The inode of the journal.
+            offset: The journal offset after the last contribution recorded.
+        """
+        if statuses:
+            now = time.time()
+            self._append(self.status_path, [dict(entry, time=now)
+                                            for entry in statuses])
+        self._write_offset(inode, offset)
+
+    def _write_offset(self, inode: int, offset: int) -> None:
+        """
+        Durably replaces the committed offset.
+
+        Args:
+            inode: The inode of the journal.
+            offset: The offset committed up to.
+        """
+        temp_path = self.offset_path + '.tmp'
+        with runtime_files.open_private(temp_path, 'w') as handle:
+            json.dump({'inode': inode, 'offset': offset}, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.offset_path)
+
+    def _rewrite(self, path: str, data: bytes) -> int:
+        """
+        Durably replaces a file while the caller holds its lock.
+
+        Args:
+            path: The file to replace.
+            data: The new content.
+
+        Returns:
+            The inode of the new file.
+        """
+        temp_path = path + '.tmp'
+        with runtime_files.open_private(temp_path, 'wb') as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+            inode = os.fstat(handle.fileno()).st_ino
+        os.replace(temp_path, path)
+        return inode
+
+    def compact(self, status_ttl: float) -> None:
+        """
+        Drops the committed part of the journal and the expired statuses.
+
+        Only the flusher calls this, it is the one writer of the offset and
+        status files. Appends racing the journal rewrite wait on its lock
+        and then retry on the new file.
+
+        Args:
+            status_ttl: Seconds the status of a contribution is kept.
+        """
+        with runtime_files.open_private(self.journal_path, 'a+b') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            inode = os.fstat(handle.fileno()).st_ino
+            offset = self.committed_offset(inode)
+            if offset:
+                handle.seek(offset)
+                inode = self._rewrite(self.journal_path, handle.read())
+                # A crash before this is harmless, the offset of the old
+                # inode doesn't count for the new journal.
+                self._write_offset(inode, 0)
+
+        if not os.path.exists(self.status_path) or \
+                os.path.getsize(self.status_path) < COMPACT_BYTES:
+            return
+        with runtime_files.open_private(self.status_path, 'a+b') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            kept = time.time() - status_ttl
+            entries = self._scan(handle, 0)
+            self._rewrite(self.status_path, b''.join(
+                json.dumps(entry).encode() + b'\n' for entry, _ in entries
+                if not entry.get('torn') and entry.get('time', 0) >= kept))
+
+    def recorded(self, contribution_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up the recorded outcome of a flushed contribution.
+
+        Args:
+            contribution_id: The id returned when it was queued.
+
+        Returns:
+            The committed or failed status, or None if none was recorded.
+        """
+        with self._lock:
+            read = self._statuses_read
+            entries, self._statuses_read = self._read(self.status_path, read)
+            if self._statuses_read[0] != read[0]:
+                # Compacted, the statuses since dropped are forgotten too.
+                self._statuses = {}
+            for entry in entries:
+                if not entry.get('torn'):
+                    self._statuses[entry['id']] = entry
+            found = self._statuses.get(contribution_id)
+
+        if found is None:
+            return None
+        return {key: value for key, value in found.items() if key != 'time'}
+
+    def status(self, contribution_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up the status of a queued contribution.
+
+        Args:
+            contribution_id: The id returned when it was queued.
+
+        Returns:
+            The status, or None if the id is unknown.
+        """
+        found = self.recorded(contribution_id)
+        if found is not None:
+            return found
+
+        entries, _ = self.pending(limit=None)
+        if any(entry['id'] == contribution_id for entry, _ in entries):
+            return {'id': contribution_id, 'status': 'queued'}
+        return None
+
+
+class Flusher:
+    """
+    The background thread group committing the journal to the database.
+    """
+
+    def __init__(self, journal: Journal, batch_size: int, interval: float) -> None:
+        """
+        The constructor of the Flusher class.
+
+        Args:
+            journal: The journal to flush.
+            batch_size: The max contributions per group commit.
+            interval: Seconds to wait between flushes.
+        """
+        self.journal = journal
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pid = os.getpid()
+        self.counts = {'committed': 0, 'failed': 0, 'retries': 0}
+        self.last_error: Optional[str] = None
+        self._lock_handle: Any = None
+        threading.Thread(target=self._run, name='write-behind-flusher',
+                         daemon=True).start()
+
+    def _try_lock(self) -> bool:
+        """
+        Tries to become the one flusher on the host.
+
+        Returns:
+            True if this process holds the flusher lock.
+        """
+        if self._lock_handle is not None:
+            return True
+
+        handle = runtime_files.open_private(self.journal.lock_path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+
+        self._lock_handle = handle
+        return True
+
+    def _run(self) -> None:
+        """
+        Flushes the journal forever, backing off while the database is down
+        or a flush fails, and compacts it once it is drained.
+
+        The flusher lock is released if the thread ever stops, so another
+        worker can take over.
+        """
+        delay = self.interval
+        status_ttl = float(os.environ.get('WRITE_BEHIND_STATUS_TTL', '86400'))
+        try:
+            while True:
+                time.sleep(delay)
+                try:
+                    if not self._try_lock():
+                        continue
+
+                    flushed = False
+                    while self.flush_batch():
+                        flushed = True
+                    if flushed:
+                        self.journal.compact(status_ttl)
+                    delay = self.interval
+                except Exception as error:  # pylint: disable=broad-except
+                    if not isinstance(error, pymysql.OperationalError):
+                        LOGGER.exception('Write-behind flush failed')
+                    self.counts['retries'] += 1
+                    self.last_error = str(error)
+                    delay = min(delay * 2, 60.0)
+        finally:
+            handle, self._lock_handle = self._lock_handle, None
+            if handle is not None:
+                handle.close()
+
+    def _outcome(self, entry: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Any]:
+        """
+        Decides what to do with a journal entry before it is inserted.
+
+        Args:
+            entry: The journal entry.
+
+        Returns:
+            The status of an entry that is settled without an insert, or the
+            validated rows to insert.
+        """
+        if entry.get('torn'):
+            LOGGER.error('Skipping the torn write-behind entry %s', entry['id'])
+            return {'id': entry['id'], 'status': 'failed',
+                    'error': 'The queued contribution was torn by a crash'}, None
+
+        # Replayed after its status was recorded, it was already settled.
+        known = self.journal.recorded(entry['id'])
+        if known is not None:
+            return dict(known, replayed=True), None
+
+        # An entry that no longer validates fails alone instead of holding
+        # up the journal.
+        try:
+            return None, contribution.validate_contribution(entry['record'])
+        except ValueError as error:
+            return {'id': entry['id'], 'status': 'failed', 'error': str(error)}, None
+
+    def _record(self, batch: List[Tuple[Dict[str, Any], int]],
+                outcomes: List[Optional[Dict[str, Any]]], inode: int) -> None:
+        """
+        Records the statuses of the settled start of a batch and moves the
+        committed offset past it.
+
+        Args:
+            batch: The journal entries of the batch with the offset after each.
+            outcomes: The status of each entry, None from the first one not
+                      settled.
+            inode: The inode of the journal.
+        """
+        settled = outcomes.index(None) if None in outcomes else len(outcomes)
+        if not settled:
+            return
+
+        fresh = [outcome for outcome in outcomes[:settled]
+                 if outcome is not None and not outcome.get('replayed')]
+        self.journal.complete([outcome for outcome in fresh if outcome['id'] is not None],
+                              inode, batch[settled - 1][1])
+        for outcome in fresh:
+            self.counts['committed' if outcome['status'] == 'committed'
+                        else 'failed'] += 1
+
+    def flush_batch(self) -> bool:
+        """
+        Group commits the next batch of queued contributions.
+
+        If the batch is rejected by the database the contributions are
+        committed one by one so only the bad ones fail. Connection errors
+        are raised so the rest of the batch is retried later, after the
+        statuses of the contributions already committed are recorded so
+        they aren't inserted twice.
+
+        Returns:
+            True if a batch was flushed.
+
+        Raises:
+            pymysql.OperationalError: If the database is unavailable.
+        """
+        batch, inode = self.journal.pending(self.batch_size)
+        if not batch:
+            return False
+
+        outcomes: List[Optional[Dict[str, Any]]] = []
+        valid: List[Tuple[int, Any]] = []
+        for index, (entry, _) in enumerate(batch):
+            outcome, rows = self._outcome(entry)
+            outcomes.append(outcome)
+            if outcome is None:
+                valid.append((index, rows))
+
+        try:
+            # One transaction, either all of them commit or none.
+            team_ids = contribution.insert_validated([rows for _, rows in valid]) \
+                if valid else []
+            for (index, _), team_id in zip(valid, team_ids):
+                outcomes[index] = {'id': batch[index][0]['id'], 'status': 'committed',
+                                   'teamId': team_id}
+        except pymysql.OperationalError:
+            raise
+        except pymysql.MySQLError:
+            for index, rows in valid:
+                entry_id = batch[index][0]['id']
+                try:
+                    team_id = contribution.insert_validated([rows])[0]
+                    outcomes[index] = {'id': entry_id, 'status': 'committed',
+                                       'teamId': team_id}
+                except pymysql.OperationalError:
+                    self._record(batch, outcomes, inode)
+                    raise
+                except pymysql.MySQLError as error:
+                    outcomes[index] = {'id': entry_id, 'status': 'failed',
+                                       'error': str(error)}
+
+        self._record(batch, outcomes, inode)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the progress of the flusher.
+
+        Returns:
+            A dict of the flushed, failed and retried counts.
+        """
+        return {
+            'active': self._lock_handle is not None,
+            **self.counts,
+            'lastError': self.last_error
+        }
+
+
+_JOURNAL: Optional[Journal] = None
+_FLUSHER: Optional[Flusher] = None
+_START_LOCK = threading.Lock()
+
+
+def get_journal() -> Journal:
+    """
+    Returns the journal, starting this process' flusher on first use.
+
+    Returns:
+        The journal.
+    """
+    global _JOURNAL, _FLUSHER  # pylint: disable=global-statement
+    with _START_LOCK:
+        if _FLUSHER is None or _FLUSHER.pid != os.getpid():
+            _JOURNAL = Journal(os.environ.get('WRITE_BEHIND_DIR')
+                               or runtime_files.runtime_path('write_behind'))
+            _FLUSHER = Flusher(_JOURNAL,
+                               int(os.environ.get('WRITE_BEHIND_BATCH', '100')),
+                               float(os.environ.get('WRITE_BEHIND_INTERVAL', '1')))
+        return _JOURNAL  # type: ignore
+
+
+def _start_in_worker() -> None:
+    """
+    Starts the flusher of a freshly forked worker.
+    """
+    global _START_LOCK  # pylint: disable=global-statement
+    # The lock may have been held by another thread at the fork.
+    _START_LOCK = threading.Lock()
+    if enabled():
+        get_journal()
+
+
+def init_app(app: Flask) -> None:
+    """
+    Starts the flusher with the app when write-behind mode is on, so the
+    contributions left in the journal are flushed without waiting for a
+    new one. Under uwsgi it starts in every worker once forked, a thread
+    of the master would not survive the fork.
+
+    Args:
+        app: The Flask app.
+    """
+    _ = app
+    if not enabled():
+        return
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_start_in_worker)
+    if postfork is not None:
+        postfork(_start_in_worker)
+    if uwsgi is None:
+        get_journal()
+
+
+def enqueue(record: Dict[str, Any]) -> str:
+    """
+    Validates a contribution and queues it to be written.
+
+    Args:
+        record: The contribution record, see contribution.validate_contribution.
+
+    Returns:
+        The id to poll the status of the contribution with.
+
+    Raises:
+        ValueError: If the record is malformed.
+    """
+    contribution.validate_contribution(record)
+    return get_journal().enqueue(record)
+
+
+def status(contribution_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Looks up the status of a queued contribution.
+
+    Args:
+        contribution_id: The id returned by enqueue.
+
+    Returns:
+        The status, or None if the id is unknown or write-behind is off.
+    """
+    if not enabled():
+        return None
+    return get_journal().status(contribution_id)
+
+
+def write_behind_stats() -> Dict[str, Any]:
+    """
+    Returns the state of the write-behind queue in this process.
+
+    Returns:
+        A dict of whether it is enabled and the flusher's progress.
+    """
+    flusher = _FLUSHER
+    return {
+        'enabled': enabled(),
+        'flusher': flusher.stats() if flusher is not None else None
+    }
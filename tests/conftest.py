@@ -0,0 +1,68 @@
+"""
+The shared fixtures of the tests.
+
+The app runs against a small synthetic database in the local SQLite
+stand-in, and every shared file goes to a private temporary directory.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_RUNTIME_DIR = tempfile.mkdtemp(prefix='coa-tests-')
+os.environ.update({
+    'DB_BACKEND': 'sqlite',
+    'DB_SQLITE_PATH': os.path.join(_RUNTIME_DIR, 'coa.sqlite3'),
+    'RUNTIME_DIR': _RUNTIME_DIR,
+    'WARMUP': '0',
+    'DATA_VERSION_TTL': '0',
+})
+
+# pylint: disable=wrong-import-position
+from benchmarks import datagen
+from coa_flask_app import APP, cache, compression, data_version, db_accessor, engine
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    """
+    Generates the synthetic database once for the whole run.
+
+    Returns:
+        The row counts of the generated database.
+    """
+    return datagen.generate(os.environ['DB_SQLITE_PATH'], counties=2, towns=2,
+                            sites=2, items=40, years=3, teams=4, lines=8)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    """
+    Starts every test without cached results, responses or engine data.
+    """
+    cache.invalidate()
+    cache.STALE_CACHE.invalidate()
+    compression.RESPONSE_CACHE.invalidate()
+    engine.refresh()
+    data_version.bump()
+    yield
+    db_accessor.get_pool().close_all()
+
+
+@pytest.fixture
+def client():
+    """
+    Returns a test client of the app.
+    """
+    return APP.test_client()
+
+
+@pytest.fixture
+def site_row():
+    """
+    Returns the site id and name of the first generated site.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT site_id, site_name FROM coa.site_info ORDER BY site_id')
+        return db_handle.fetchone()
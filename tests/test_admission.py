@@ -0,0 +1,139 @@
+"""
+The tests of the admission control of the database bound routes.
+"""
+
+import threading
+import time
+
+import pytest
+
+from coa_flask_app import admission
+
+RANGE = '/validdaterange?locationCategory=town&locationName=Town 0-1'
+
+
+@pytest.fixture(name='one_slot')
+def one_slot_fixture(monkeypatch):
+    """
+    Gives every read route one run slot and one queue slot, and a short wait.
+    """
+    monkeypatch.setenv('ADMISSION_READ_LIMIT', '1')
+    monkeypatch.setenv('ADMISSION_QUEUE', '1')
+    monkeypatch.setenv('ADMISSION_WAIT', '0.3')
+
+
+def release_later(slot, delay):
+    """
+    Releases a slot from another thread after a delay.
+    """
+    timer = threading.Timer(delay, slot.close)
+    timer.start()
+    return timer
+
+
+def test_waiting_request_gets_the_freed_slot(one_slot):
+    """
+    A waiting request blocks on the slot and runs as soon as it is freed.
+    """
+    _ = one_slot
+    held, _ = admission.acquire('tests')
+    timer = release_later(held, 0.1)
+    started = time.monotonic()
+    slot, reason = admission.acquire('tests')
+    waited = time.monotonic() - started
+    timer.join()
+
+    assert reason is None
+    assert 0.05 < waited < 0.3
+    slot.close()
+
+
+def test_waiting_request_times_out(one_slot):
+    """
+    A request whose slot isn't freed in time is turned away, and the slot
+    freed afterwards goes to the next request.
+    """
+    _ = one_slot
+    held, _ = admission.acquire('tests')
+    started = time.monotonic()
+    assert admission.acquire('tests') == (None, 'timeout')
+    assert time.monotonic() - started >= 0.3
+
+    held.close()
+    slot, reason = admission.acquire('tests')
+    assert reason is None
+    slot.close()
+
+
+def test_full_queue_is_turned_away_at_once(monkeypatch, client):
+    """
+    With every run and queue slot taken the route answers a 503 with
+    Retry-After.
+    """
+    monkeypatch.setenv('ADMISSION_READ_LIMIT', '1')
+    monkeypatch.setenv('ADMISSION_QUEUE', '0')
+    held, _ = admission.acquire('valid_date_range')
+    try:
+        response = client.get(RANGE)
+    finally:
+        held.close()
+
+    assert response.status_code == 503
+    assert response.get_json()['reason'] == 'queue_full'
+    assert response.headers['Retry-After'] == '2'
+    assert client.get(RANGE).status_code == 200
+
+
+def test_cached_responses_take_no_slot(monkeypatch, client):
+    """
+    Revalidations and responses kept by the HTTP cache are answered while
+    every slot is taken, only a cache miss is turned away.
+    """
+    etag = client.get(RANGE).headers['ETag']
+    monkeypatch.setenv('ADMISSION_READ_LIMIT', '1')
+    monkeypatch.setenv('ADMISSION_QUEUE', '0')
+    held, _ = admission.acquire('valid_date_range')
+    try:
+        revalidated = client.get(RANGE, headers={'If-None-Match': etag})
+        kept = client.get(RANGE)
+        missed = client.get(RANGE + '&startDate=2019-1-1')
+    finally:
+        held.close()
+
+    assert revalidated.status_code == 304
+    assert kept.status_code == 200
+    assert missed.status_code == 503
+
+
+def test_export_holds_its_slot_until_the_stream_closes(monkeypatch, client):
+    """
+    A streamed export keeps its slot while the rows are read, and frees it
+    when the stream is closed.
+    """
+    monkeypatch.setenv('ADMISSION_READ_LIMIT', '1')
+    monkeypatch.setenv('ADMISSION_QUEUE', '0')
+    path = '/export?locationCategory=county&locationName=County 0&startDate=2000-1-1'
+    streaming = client.get(path, headers={'Accept-Encoding': 'identity'})
+    assert streaming.status_code == 200
+    assert client.get(path).status_code == 503
+
+    next(streaming.response)
+    streaming.close()
+    again = client.get(path)
+    assert again.status_code == 200
+    again.close()
+
+
+def test_exempt_routes_and_disabled_admission(monkeypatch, client):
+    """
+    The exempt routes and a disabled admission never take a slot.
+    """
+    monkeypatch.setenv('ADMISSION_READ_LIMIT', '1')
+    monkeypatch.setenv('ADMISSION_QUEUE', '0')
+    held, _ = admission.acquire('valid_date_range')
+    try:
+        assert client.get('/stats').status_code == 200
+        monkeypatch.setenv('ADMISSION', '0')
+        assert client.get(RANGE + '&startDate=2018-1-1').status_code == 200
+    finally:
+        held.close()
@@ -0,0 +1,88 @@
+"""
+The tests of the batched read requests.
+"""
+
+import threading
+import time
+
+from coa_flask_app import batch
+
+
+def test_batch_answers_every_sub_request_in_order(client):
+    """
+    Every sub-request gets the response its own route gives.
+    """
+    paths = ['/locations', '/dirtydozen?locationCategory=town&locationName=Town 0-1',
+             {'path': '/validdaterange', 'args': {'locationCategory': 'county',
+                                                  'locationName': 'County 1'}}]
+    response = client.post('/batch', json=paths)
+    assert response.status_code == 200
+    results = response.get_json()['results']
+
+    assert [result['status'] for result in results] == [200, 200, 200]
+    assert results[0]['body'] == client.get(paths[0]).get_json()
+    assert results[1]['body'] == client.get(paths[1]).get_json()
+    assert results[2]['body'] == client.get(
+        '/validdaterange?locationCategory=county&locationName=County 1').get_json()
+
+
+def test_batch_runs_identical_sub_requests_once(client):
+    """
+    A repeated sub-request points at the first one instead of running again.
+    """
+    path = '/dirtydozen?locationName=Site 0-0-0'
+    results = client.post('/batch', json=[path, '/locations', path]).get_json()['results']
+    assert results[2]['duplicateOf'] == 0
+    assert results[2]['body'] == results[0]['body']
+    assert batch.batch_stats()['deduplicated'] >= 1
+
+
+def test_batch_rejects_routes_it_can_not_run(client):
+    """
+    Unknown, write and malformed sub-requests fail on their own.
+    """
+    results = client.post('/batch', json=['/nowhere', '/contributions/bulk', 7,
+                                          '/locations']).get_json()['results']
+    assert [result['status'] for result in results] == [400, 400, 400, 200]
+
+
+def test_batch_limits(client, monkeypatch):
+    """
+    The body must be a list no longer than BATCH_MAX_REQUESTS.
+    """
+    assert client.post('/batch', json={'path': '/locations'}).status_code == 400
+    monkeypatch.setenv('BATCH_MAX_REQUESTS', '2')
+    assert client.post('/batch', json=['/locations'] * 3).status_code == 413
+
+
+def test_batch_threads_stuck_past_the_deadline_turn_batches_away(client, monkeypatch):
+    """
+    A sub-request running past the deadline is answered with a 504, and
+    while it holds the only thread new batches get a 503 instead of
+    queueing behind it.
+    """
+    dispatch, release = batch._dispatch, threading.Event()  # pylint: disable=protected-access
+
+    def stuck(*args):
+        release.wait(5)
+        return dispatch(*args)
+
+    monkeypatch.setenv('BATCH_WORKERS', '1')
+    monkeypatch.setattr(batch, '_EXECUTOR', None)
+    monkeypatch.setattr(batch, '_dispatch', stuck)
+    try:
+        late = client.post('/batch?deadline=0.05', json=['/locations']).get_json()
+        assert late['results'][0]['status'] == 504
+        assert batch.batch_stats()['orphaned'] == 1
+
+        busy = client.post('/batch', json=['/locations', '/nowhere']).get_json()
+        assert [result['status'] for result in busy['results']] == [503, 400]
+
+        release.set()
+        while batch.batch_stats()['orphaned']:
+            time.sleep(0.01)
+        done = client.post('/batch', json=['/locations']).get_json()
+        assert done['results'][0]['status'] == 200
+    finally:
+        release.set()
+        batch.get_executor().shutdown()
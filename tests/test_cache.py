@@ -0,0 +1,170 @@
+"""
+The tests of the result cache and its invalidation.
+"""
+
+import threading
+import time
+
+import pymysql
+import pytest
+
+from coa_flask_app import APP, cache, shared_cache
+
+
+def counting(results):
+    """
+    Returns a cached function counting its calls, answering from results.
+    """
+    calls = []
+
+    @cache.cached
+    def load(key):
+        calls.append(key)
+        result = results[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return load, calls
+
+
+def test_results_are_cached_per_arguments():
+    """
+    A repeated call is answered from the cache, other arguments aren't.
+    """
+    load, calls = counting(['a', 'b'])
+    assert load(1) == 'a'
+    assert load(1) == 'a'
+    assert load(2) == 'b'
+    assert calls == [1, 2]
+
+
+def test_invalidate_moves_to_a_new_generation():
+    """
+    Invalidating bumps the shared generation, so every worker reloads.
+    """
+    load, calls = counting(['old', 'new'])
+    generation = cache.generation()
+    assert load(1) == 'old'
+
+    cache.invalidate()
+
+    assert cache.generation() != generation
+    shared = shared_cache.get_cache()
+    assert shared is not None and shared.generation() == cache.generation()[0]
+    assert load(1) == 'new'
+    assert len(calls) == 2
+
+
+def test_shared_cache_answers_other_workers():
+    """
+    A result another worker stored in the shared cache isn't loaded again.
+    """
+    load, calls = counting(['a'])
+    assert load(1) == 'a'
+    cache.REFERENCE_CACHE.invalidate()
+    assert load(1) == 'a'
+    assert calls == [1]
+
+
+def test_shared_cache_drops_results_of_older_generations():
+    """
+    A result loaded before a write isn't stored under the new generation.
+    """
+    shared = shared_cache.get_cache()
+    generation = shared.generation()
+    shared.bump()
+    shared.set(('key',), 'value', 60, generation)
+    assert shared.get(('key',)) == (False, None)
+
+
+def test_older_generation_served_stale_only_when_loading_fails():
+    """
+    After a write the new result is loaded, the old one is only served,
+    marked stale, while the database fails.
+    """
+    load, _ = counting(['old', 'new', pymysql.OperationalError(2003, 'down')])
+    with APP.test_request_context():
+        assert load(1) == 'old'
+        cache.invalidate()
+        assert load(1) == 'new'
+        assert not cache.served_stale()
+
+    with APP.test_request_context():
+        cache.invalidate()
+        assert load(1) == 'new'
+        assert cache.served_stale()
+
+
+def test_errors_without_stale_results_are_raised():
+    """
+    A failing load with nothing to fall back on raises.
+    """
+    load, _ = counting([pymysql.OperationalError(2003, 'down')])
+    with pytest.raises(pymysql.OperationalError):
+        load(1)
+
+
+def test_concurrent_invalidations_are_all_counted(monkeypatch):
+    """
+    Without the shared cache every invalidation from every thread moves the
+    local generation on.
+    """
+    monkeypatch.setenv('SHARED_CACHE', '0')
+    before = cache.generation()[0]
+
+    def invalidate_many():
+        for _ in range(500):
+            cache.invalidate()
+
+    threads = [threading.Thread(target=invalidate_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.generation()[0] == before + 2000
+
+
+def test_shared_cache_evicts_and_counts(tmp_path):
+    """
+    A full cache evicts the least recently used entry of a key's slots, and
+    the counters of every process are kept in the file.
+    """
+    shared = shared_cache.SharedCache(str(tmp_path / 'shared'), slots=2, slot_size=256)
+    shared.set('a', 1, 60)
+    shared.set('b', 2, 60)
+    assert shared.get('a') == (True, 1)
+    shared.set('c', 3, 60)
+    shared.set('large', 'x' * 1024, 60)
+    assert shared.get('b') == (False, None)
+
+    other = shared_cache.SharedCache(str(tmp_path / 'shared'), slots=2, slot_size=256)
+    assert other.get('c') == (True, 3)
+    stats = other.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (2, 2, 1)
+    assert (stats['sets'], stats['evictions'], stats['tooLarge']) == (3, 1, 1)
+
+    other.bump()
+    assert other.stats()['entries'] == 0
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    """
+    Entries expire after their TTL, and the least recently used one is
+    evicted once the cache is full.
+    """
+    ttl_cache = cache.TTLCache(max_size=2, ttl=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    assert ttl_cache.get('a') == (True, 1)
+    ttl_cache.set('c', 3)
+    assert ttl_cache.get('b') == (False, None)
+    assert ttl_cache.get('a') == (True, 1)
+
+    ttl_cache.set('short', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert ttl_cache.get('short') == (False, None)
+
+    stats = ttl_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 2)
+    assert stats['hitRate'] == 0.5
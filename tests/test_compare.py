@@ -0,0 +1,51 @@
+"""
+The tests of the multi-location comparison.
+"""
+
+from datetime import date
+
+import pytest
+
+from coa_flask_app import cache, engine
+
+ARGS = ('locationCategory=town&locationName=Town 0-0&locationName=Town 1-1'
+        '&locationName=Town 0-0&locationName=Nowhere')
+
+
+def test_compare_matches_the_single_breakdowns(client):
+    """
+    Each location of the comparison totals its own dirty dozen route, and
+    the matrix rows add up to the location totals.
+    """
+    year = date.today().year
+    dates = f'&startDate={year - 1}-1-1&endDate={year}-12-31'
+    compared = client.get('/compare?' + ARGS + dates).get_json()['compare']
+    matrix = compared['matrix']
+    assert matrix['locationNames'] == ['Town 0-0', 'Town 1-1', 'Nowhere']
+    assert compared['locations']['Nowhere']['total'] == 0
+
+    for column, name in enumerate(matrix['locationNames']):
+        single = client.get(f'/dirtydozen?locationCategory=town&locationName={name}'
+                            + dates).get_json()['dirtydozen']
+        assert compared['locations'][name]['dirtydozen'] == single
+        assert sum(row[column] for row in matrix['counts']) == \
+            compared['locations'][name]['total']
+
+    totals = [sum(row) for row in matrix['counts']]
+    assert totals == sorted(totals, reverse=True)
+
+
+def test_engine_and_sql_return_the_same_matrix(client, monkeypatch):
+    """
+    The in-memory engine and the grouped SQL query build the same matrix.
+    """
+    pytest.importorskip('numpy')
+    year = date.today().year
+    path = f'/compare?{ARGS}&startDate={year - 1}-3-1&endDate={year}-8-31'
+    from_sql = client.get(path).get_json()['compare']
+
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    cache.invalidate()
+    from_engine = client.get(path).get_json()['compare']
+    assert engine.get_engine() is not None
+    assert from_engine == from_sql
@@ -0,0 +1,98 @@
+"""
+The tests of the response compression.
+"""
+
+import gzip
+import os
+
+import pytest
+from werkzeug.datastructures import Accept
+
+from coa_flask_app import compression
+
+BODY = b'{"items":[' + b','.join(b'"Item %d"' % index for index in range(300)) + b']}'
+
+
+def test_small_bodies_are_sent_plain(monkeypatch):
+    """
+    Bodies under the threshold aren't compressed at all.
+    """
+    assert compression.compress_all(b'{"a":1}') == {}
+    monkeypatch.setenv('COMPRESS_MIN_BYTES', str(len(BODY) + 1))
+    assert compression.compress_all(BODY) == {}
+
+
+def test_variants_decompress_to_the_body():
+    """
+    Every supported encoding is compressed once and decompresses back.
+    """
+    variants = compression.compress_all(BODY)
+    assert set(variants) == set(compression.ENCODINGS)
+    assert gzip.decompress(variants['gzip']) == BODY
+    assert all(len(variant) < len(BODY) for variant in variants.values())
+
+
+def test_variants_that_save_nothing_are_dropped():
+    """
+    Incompressible bodies are only sent plain.
+    """
+    assert compression.compress_all(os.urandom(4096)) == {}
+
+
+@pytest.mark.parametrize('accepted, expected', [
+    ([('gzip', 1)], 'gzip'),
+    ([('gzip', 0.5), ('identity', 1)], 'gzip'),
+    ([('gzip', 0)], None),
+    ([('identity', 1)], None),
+    ([], None),
+])
+def test_negotiate(accepted, expected):
+    """
+    The encoding the client accepts is picked, none is sent plain.
+    """
+    assert compression.negotiate(Accept(accepted), {'gzip': b''}) == expected
+
+
+def test_negotiate_prefers_what_the_client_likes_best():
+    """
+    The client's quality wins, ties go to the order of ENCODINGS.
+    """
+    available = {'br': b'', 'gzip': b''}
+    assert compression.negotiate(Accept([('gzip', 1), ('br', 0.5)]), available) == 'gzip'
+    assert compression.negotiate(Accept([('gzip', 1), ('br', 1)]), available) == \
+        compression.ENCODINGS[0]
+    assert compression.negotiate(Accept([('br', 1)]), {'gzip': b''}) is None
+
+
+def test_encoded_response():
+    """
+    The response carries the picked variant and varies on Accept-Encoding.
+    """
+    variants = compression.compress_all(BODY)
+    response, encoding = compression.encoded_response(
+        BODY, variants, 'application/json', Accept([('gzip', 1)]))
+    assert encoding == 'gzip'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == BODY
+    assert 'Accept-Encoding' in response.vary
+
+    plain, encoding = compression.encoded_response(BODY, variants, 'application/json',
+                                                   Accept([]))
+    assert encoding is None
+    assert plain.get_data() == BODY
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_route_responses_are_compressed_once(client):
+    """
+    A cacheable route is compressed when it is built, repeated requests
+    are answered from the compressed response cache.
+    """
+    path = '/breakdown?locationCategory=county&locationName=County 0&startDate=2000-1-1'
+    plain = client.get(path, headers={'Accept-Encoding': 'identity'})
+    hits = compression.RESPONSE_CACHE.stats()['hits']
+    zipped = client.get(path, headers={'Accept-Encoding': 'gzip'})
+
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert compression.RESPONSE_CACHE.stats()['hits'] == hits + 1
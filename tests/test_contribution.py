@@ -0,0 +1,104 @@
+"""
+The tests of the contribution validation and inserts.
+"""
+
+import pytest
+
+from coa_flask_app import cache, contribution, db_accessor, site
+
+
+def make_record(site_id, **overrides):
+    """
+    Builds a valid contribution record.
+    """
+    record = {
+        'siteId': site_id,
+        'volunteerDate': '4/27/2019',
+        'teamCaptain': 'Jane Doe',
+        'numOfPeople': '4',
+        'updatedBy': 'tests',
+        'eventCode': 'TEST',
+        'items': [{'itemId': 1, 'quantity': 31}, {'itemId': 2, 'quantity': 5, 'brand': 'B'}]
+    }
+    record.update(overrides)
+    return record
+
+
+def count_rows(table):
+    """
+    Counts the rows of a table.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT COUNT(*) FROM coa.' + table)
+        return db_handle.fetchone()[0]
+
+
+def test_validate_converts_the_record(site_row):
+    """
+    A valid record becomes a team row and one volunteer row per item.
+    """
+    team_row, volunteer_rows = contribution.validate_contribution(make_record(site_row[0]))
+    assert team_row == (site_row[0], '2019-04-27', 'Jane Doe', 4, 0, 0.0, 0.0, 'tests')
+    assert volunteer_rows == [(1, 31, '', 'tests', 'TEST'), (2, 5, 'B', 'tests', 'TEST')]
+
+
+@pytest.mark.parametrize('overrides, message', [
+    ({'siteId': None}, 'siteId is required'),
+    ({'numOfPeople': 'four'}, 'numOfPeople'),
+    ({'volunteerDate': '27.4.2019'}, 'volunteerDate'),
+    ({'volunteerDate': 20190427}, 'volunteerDate'),
+    ({'items': []}, 'items must be a non empty list'),
+    ({'items': [{'itemId': 1}]}, 'quantity is required'),
+    ({'items': ['x']}, 'Every item must be an object'),
+])
+def test_validate_rejects_malformed_records(overrides, message):
+    """
+    Every malformed field is reported by name.
+    """
+    with pytest.raises(ValueError, match=message):
+        contribution.validate_contribution(make_record(1, **overrides))
+
+
+def test_bulk_insert_reports_every_record(site_row):
+    """
+    The valid records are inserted and the invalid ones are reported.
+    """
+    teams, lines = count_rows('team_info'), count_rows('volunteer_info')
+    records = [make_record(site_row[0]), 'not a record',
+               make_record(site_row[0], numOfPeople=None), make_record(site_row[0])]
+
+    outcome = contribution.insert_contributions(records, chunk_size=1)
+
+    assert [result['ok'] for result in outcome['results']] == [True, False, False, True]
+    assert outcome['inserted'] == 2
+    assert outcome['failed'] == 2
+    assert outcome['rows'] == 6
+    assert count_rows('team_info') == teams + 2
+    assert count_rows('volunteer_info') == lines + 4
+    assert all('teamId' in outcome['results'][index] for index in (0, 3))
+
+
+def test_bulk_insert_route_rejects_non_lists(client):
+    """
+    The bulk route only takes a json list.
+    """
+    response = client.post('/contributions/bulk', json={'siteId': 1})
+    assert response.status_code == 400
+
+
+def test_insert_invalidates_cached_results(site_row):
+    """
+    A committed insert is seen by the next read instead of a cached result.
+    """
+    _, site_name = site_row
+    before = site.item_breakdown('site_name', site_name, '2019-1-1', '2019-12-31')
+    generation = cache.generation()
+
+    contribution.insert_contributions([make_record(site_row[0])])
+
+    assert cache.generation() != generation
+    after = dict((row[0], row[-1]) for row in
+                 site.item_breakdown('site_name', site_name, '2019-1-1', '2019-12-31'))
+    counts = dict((row[0], row[-1]) for row in before)
+    assert after[1] == counts.get(1, 0) + 31
+    assert after[2] == counts.get(2, 0) + 5
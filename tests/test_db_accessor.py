@@ -0,0 +1,115 @@
+"""
+The tests of the connection pool and the Accessor.
+"""
+
+import pytest
+
+from coa_flask_app import db_accessor
+
+
+def count_teams():
+    """
+    Counts the team rows.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT COUNT(*) FROM coa.team_info')
+        return db_handle.fetchone()[0]
+
+
+def test_pool_reuses_released_connections():
+    """
+    A released connection is handed out again instead of opening another.
+    """
+    pool = db_accessor.ConnectionPool(size=2)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    assert second is first
+    assert pool.stats()['created'] == 1
+    assert pool.stats()['checkedOut'] == 1
+    pool.release(second)
+    assert pool.stats()['checkedOut'] == 0
+
+
+def test_pool_times_out_when_exhausted():
+    """
+    A checkout waits for a free connection and gives up after the timeout.
+    """
+    pool = db_accessor.ConnectionPool(size=1, timeout=0.05)
+    pooled = pool.acquire()
+    with pytest.raises(db_accessor.PoolTimeoutError):
+        pool.acquire()
+
+    pool.release(pooled)
+    assert pool.acquire() is pooled
+
+
+def test_discarded_connection_frees_its_slot():
+    """
+    A discarded connection is closed and a new one takes its slot.
+    """
+    pool = db_accessor.ConnectionPool(size=1, timeout=0.05)
+    pooled = pool.acquire()
+    pool.release(pooled, discard=True)
+    assert pool.acquire() is not pooled
+    assert pool.stats()['created'] == 2
+
+
+def test_accessor_commits_and_releases():
+    """
+    A statement run without an error is committed and the connection goes
+    back to the pool.
+    """
+    teams = count_teams()
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('INSERT INTO coa.team_info (site_id, volunteer_date) '
+                          'VALUES (%s, %s)', (1, '2020-01-01'))
+
+    assert count_teams() == teams + 1
+    assert db_accessor.pool_stats()['checkedOut'] == 0
+
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute("DELETE FROM coa.team_info WHERE volunteer_date = '2020-01-01'")
+
+
+def test_accessor_rolls_back_on_error():
+    """
+    A failed block is rolled back, so the next user of the connection
+    doesn't commit its half finished work.
+    """
+    teams = count_teams()
+    with pytest.raises(RuntimeError):
+        with db_accessor.Accessor() as db_handle:
+            db_handle.execute('INSERT INTO coa.team_info (site_id, volunteer_date) '
+                              'VALUES (%s, %s)', (1, '2020-01-01'))
+            raise RuntimeError('failed half way')
+
+    assert count_teams() == teams
+    assert db_accessor.pool_stats()['checkedOut'] == 0
+
+
+def test_breaker_counts_only_connection_failures(monkeypatch):
+    """
+    A failed connect opens the breaker, a pool timeout doesn't.
+    """
+    breaker = db_accessor.CircuitBreaker(failures=1, reset_timeout=60)
+    monkeypatch.setattr(db_accessor, 'BREAKER', breaker)
+    monkeypatch.setattr(db_accessor, '_POOL',
+                        db_accessor.ConnectionPool(size=1, timeout=0.05))
+
+    pooled = db_accessor.get_pool().acquire()
+    with pytest.raises(db_accessor.PoolTimeoutError):
+        count_teams()
+    assert breaker.stats()['state'] == 'closed'
+    db_accessor.get_pool().release(pooled, discard=True)
+
+    def refuse():
+        raise db_accessor.pymysql.OperationalError(2003, "Can't connect")
+
+    db_accessor.register_backend('refusing', refuse)
+    monkeypatch.setenv('DB_BACKEND', 'refusing')
+    with pytest.raises(db_accessor.pymysql.OperationalError):
+        count_teams()
+    assert breaker.stats()['state'] == 'open'
+    with pytest.raises(db_accessor.CircuitOpenError):
+        count_teams()
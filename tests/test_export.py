@@ -0,0 +1,73 @@
+"""
+The tests of the streaming export.
+"""
+
+import csv
+import gzip
+import io
+import json
+
+from coa_flask_app import db_accessor, export
+
+ARGS = 'locationCategory=county&locationName=County 0&startDate=2000-1-1&endDate=2100-1-1'
+
+
+def county_rows():
+    """
+    Counts the summary rows of County 0 straight from the database.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT COUNT(*) FROM coa_summary_view WHERE county = %s',
+                          ('County 0',))
+        return db_handle.fetchone()[0]
+
+
+def test_csv_export_has_every_row(client):
+    """
+    The CSV export is a header line and one line per summary row.
+    """
+    response = client.get('/export?' + ARGS, headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    lines = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert tuple(lines[0]) == export.COLUMNS
+    assert len(lines) - 1 == county_rows()
+    assert {line[2] for line in lines[1:]} == {'County 0'}
+
+
+def test_gzipped_ndjson_export(client):
+    """
+    The NDJSON export is gzipped when the client accepts it.
+    """
+    response = client.get('/export?format=ndjson&' + ARGS,
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert len(lines) == county_rows()
+    assert set(json.loads(lines[0])) == set(export.COLUMNS)
+
+
+def test_export_rejects_unknown_formats(client):
+    """
+    Only csv and ndjson can be exported.
+    """
+    assert client.get('/export?format=xml&' + ARGS).status_code == 400
+
+
+def test_export_stream_leaves_the_pool_alone():
+    """
+    A stream reads over a connection of its own, and the pool stays free
+    for the other requests until the stream is closed.
+    """
+    rows = export.export_rows('county', 'County 0', '2000-1-1', '2100-1-1')
+    next(rows)
+    assert db_accessor.pool_stats()['checkedOut'] == 0
+    rows.close()
+    assert db_accessor.pool_stats()['checkedOut'] == 0
+
+
+def test_export_of_unknown_category_is_empty():
+    """
+    A category that isn't a location column never reaches the query.
+    """
+    assert list(export.export_rows('team_captain', 'x', '2000-1-1', '2100-1-1')) == []
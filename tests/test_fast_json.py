@@ -0,0 +1,92 @@
+"""
+The tests of the fast JSON serialization.
+"""
+
+import gzip
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask import jsonify
+
+from coa_flask_app import APP, contribution, data_version, fast_json
+
+PAYLOADS = [
+    {'b': 1, 'a': [1.5, None, True, 'text']},
+    {'nested': {'z': [], 'y': {}}, 'count': 10 ** 12},
+    {'unicode': 'Café ☕'},
+    {'tiny': 0.00001, 'huge': 1e30, 'third': 1 / 3},
+    {2: 'int key', 1: 'other int key'},
+    {'day': date(2019, 4, 27), 'moment': datetime(2019, 4, 27, 10, 30)},
+    {'quantity': Decimal('12.50')},
+]
+
+
+@pytest.mark.parametrize('payload', PAYLOADS)
+def test_dumps_matches_jsonify(payload):
+    """
+    The fast encoder writes the same bytes as jsonify, whichever encoder
+    ends up serializing.
+    """
+    with APP.app_context():
+        expected = jsonify(payload).get_data()
+    assert fast_json.dumps(payload) + b'\n' == expected
+    assert json.loads(expected) == json.loads(fast_json.dumps(payload))
+
+
+def test_dumps_matches_the_standard_library():
+    """
+    Without orjson the standard library writes the same bytes.
+    """
+    payload = {'b': [1, 2.5], 'a': 'x', 'c': {'e': None, 'd': False}}
+    assert fast_json.dumps(payload) == \
+        json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+
+@pytest.fixture(name='counted_payload')
+def counted_payload_fixture():
+    """
+    Registers a payload counting its builds.
+
+    Returns:
+        The list of build calls.
+    """
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {'builds': len(builds), 'padding': 'x' * 4096}
+
+    fast_json.register_payload('tests', build)
+    yield builds
+    del fast_json.PAYLOADS['tests']
+
+
+def test_payload_is_built_once_per_data_version(counted_payload, monkeypatch):
+    """
+    A stable payload is serialized once and rebuilt when the data version
+    moves.
+    """
+    monkeypatch.setattr(data_version, 'current', lambda: 'version-1')
+    first, variants = fast_json.payload_bytes('tests')
+    assert fast_json.payload_bytes('tests') == (first, variants)
+    assert json.loads(first)['builds'] == 1
+    assert gzip.decompress(variants['gzip']) == first
+
+    monkeypatch.setattr(data_version, 'current', lambda: 'version-2')
+    assert json.loads(fast_json.payload_bytes('tests')[0])['builds'] == 2
+    assert len(counted_payload) == 2
+
+
+def test_payload_route_is_compressed(client):
+    """
+    A stable payload route answers the pre-serialized bytes, gzipped when
+    the client accepts it.
+    """
+    plain = client.get('/getTrashItems', headers={'Accept-Encoding': 'identity'})
+    zipped = client.get('/getTrashItems', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert plain.get_json() == json.loads(json.dumps(
+        {'getTrashItems': contribution.get_trash_items()}, default=str))
@@ -0,0 +1,103 @@
+"""
+The tests of the ETags and the conditional read routes.
+"""
+
+from coa_flask_app import cache, contribution, data_version
+
+
+def test_matching_etag_answers_304(client):
+    """
+    A client revalidating with the current ETag gets an empty 304.
+    """
+    response = client.get('/locations')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    revalidated = client.get('/locations', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+
+
+def test_etag_depends_on_the_request(client):
+    """
+    Other args are another representation with another ETag.
+    """
+    first = client.get('/dirtydozen?locationCategory=town&locationName=Town 0-1')
+    second = client.get('/dirtydozen?locationCategory=town&locationName=Town 1-1')
+    assert first.headers['ETag'] != second.headers['ETag']
+
+    stale = client.get('/dirtydozen?locationCategory=town&locationName=Town 1-1',
+                       headers={'If-None-Match': first.headers['ETag']})
+    assert stale.status_code == 200
+
+
+def test_compressed_variants_have_their_own_etag(client):
+    """
+    Every encoding of a body is its own representation.
+    """
+    path = '/breakdown?locationCategory=county&locationName=County 0&startDate=2000-1-1'
+    plain = client.get(path, headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+    revalidated = client.get(path, headers={'Accept-Encoding': 'gzip',
+                                            'If-None-Match': gzipped.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_write_changes_the_etag(client, site_row):
+    """
+    After a write the old ETag no longer matches and the new data is sent.
+    """
+    site_id, site_name = site_row
+    path = f'/dirtydozen?locationName={site_name}&startDate=2010-1-1&endDate=2010-12-31'
+    response = client.get(path)
+    assert response.get_json() == {'dirtydozen': []}
+
+    contribution.insert_contributions([{
+        'siteId': site_id, 'volunteerDate': '2010-06-01', 'teamCaptain': 'Jane Doe',
+        'numOfPeople': 2, 'updatedBy': 'tests', 'items': [{'itemId': 3, 'quantity': 7}]}])
+
+    changed = client.get(path, headers={'If-None-Match': response.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != response.headers['ETag']
+    assert [item['count'] for item in changed.get_json()['dirtydozen']] == [7]
+
+
+def test_304_repeats_the_matched_etag_and_vary(client):
+    """
+    A client revalidating a compressed body gets back the ETag it sent,
+    and the 304 varies on Accept-Encoding like the body.
+    """
+    path = '/breakdown?locationCategory=county&locationName=County 1&startDate=2000-1-1'
+    gzipped = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+
+    revalidated = client.get(path, headers={'Accept-Encoding': 'gzip',
+                                            'If-None-Match': gzipped.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == gzipped.headers['ETag']
+    assert 'Accept-Encoding' in revalidated.headers['Vary']
+
+
+def test_data_version_is_shared_between_workers(monkeypatch):
+    """
+    A version read by one worker is used by the others until a write.
+    """
+    monkeypatch.setenv('DATA_VERSION_TTL', '60')
+    version = data_version.current()
+    reads = []
+    monkeypatch.setattr(data_version, 'read_version',
+                        lambda: reads.append(1) or 'fresh')
+
+    # Another worker has no version of its own yet.
+    data_version.bump()
+    assert data_version.current() == version
+    assert not reads
+
+    cache.invalidate()
+    data_version.bump()
+    assert data_version.current() == 'fresh'
+    assert reads == [1]
@@ -0,0 +1,119 @@
+"""
+The tests of the shared metrics.
+"""
+
+import os
+
+import pytest
+
+from coa_flask_app import db_accessor, metrics
+
+
+def counter(name, *labels):
+    """
+    Reads the summed value of a counter over every worker.
+    """
+    return metrics.collect().get(metrics._key(  # pylint: disable=protected-access
+        'counter', name, labels), 0.0)
+
+
+def test_store_grows_and_keeps_its_values(tmp_path):
+    """
+    A store grows past its initial size, and a reopened file reads the same
+    values.
+    """
+    path = str(tmp_path / 'store.db')
+    with metrics.MmapStore(path, initial_size=64) as store:
+        for index in range(50):
+            store.add(f'counter:key_{index}', index)
+        store.add('counter:key_3', 0.5)
+        store.set('gauge:level', 7)
+
+    with metrics.MmapStore(path) as store:
+        store.add('counter:key_49', 1)
+
+    values = metrics._read_file(path)  # pylint: disable=protected-access
+    assert len(values) == 51
+    assert values['counter:key_3'] == 3.5
+    assert values['counter:key_49'] == 50
+    assert values['gauge:level'] == 7
+
+
+def test_histogram_buckets_are_cumulative():
+    """
+    An observation counts in every bucket at or above its value.
+    """
+    metrics.observe('coa_http_request_duration_seconds', 0.03, route='/tests')
+    route = ('route', '/tests')
+    name = 'coa_http_request_duration_seconds'
+    assert counter(name + '_bucket', route, ('le', '0.025')) == 0
+    assert counter(name + '_bucket', route, ('le', '0.05')) == 1
+    assert counter(name + '_bucket', route, ('le', '+Inf')) == 1
+    assert counter(name + '_count', route) == 1
+
+
+def test_metrics_route_renders_the_requests(client):
+    """
+    The scrape shows the request histogram and the pool gauges.
+    """
+    client.get('/validdaterange?locationCategory=town&locationName=Town 0-1')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE coa_http_request_duration_seconds histogram' in text
+    assert 'route="/validdaterange"' in text
+    assert '# TYPE coa_db_pool_checked_out gauge' in text
+
+
+def test_failed_statements_reach_the_hooks():
+    """
+    A statement that raises is still timed and passed to the hooks, marked
+    as failed.
+    """
+    events = []
+    db_accessor.add_query_hook(events.append)
+    errors = counter('coa_db_query_errors_total', ('call_site', 'run_bad_statement'))
+
+    def run_bad_statement():
+        with db_accessor.Accessor() as db_handle:
+            db_handle.execute('SELECT no_such_column FROM coa.item')
+
+    try:
+        with pytest.raises(Exception):
+            run_bad_statement()
+    finally:
+        db_accessor.QUERY_HOOKS.remove(events.append)
+
+    assert [(event.call_site, event.failed, event.rows) for event in events] == \
+        [('run_bad_statement', True, 0)]
+    assert events[0].duration > 0
+    assert counter('coa_db_query_errors_total', ('call_site', 'run_bad_statement')) == errors + 1
+
+
+def test_broken_metrics_dont_fail_the_response(client, monkeypatch):
+    """
+    A request is answered even when its metrics can't be written.
+    """
+    def fail(*_, **__):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(metrics, 'observe', fail)
+    response = client.get('/validdaterange?locationCategory=town&locationName=Town 0-1')
+    assert response.status_code == 200
+
+
+def test_counters_of_exited_workers_are_archived():
+    """
+    The counters of a worker that exited are kept in the archive and its
+    gauges are dropped.
+    """
+    directory = metrics.metrics_dir()
+    before = counter('coa_tests_total')
+    # The pid is past the default pid_max, so no process has it.
+    path = os.path.join(directory, 'worker_4999999.db')
+    with metrics.MmapStore(path) as store:
+        store.add('counter:coa_tests_total{}', 2)
+        store.set('gauge:coa_tests_level{}', 5)
+
+    totals = metrics.collect()
+    assert not os.path.exists(path)
+    assert totals['counter:coa_tests_total{}'] == before + 2
+    assert 'gauge:coa_tests_level{}' not in totals
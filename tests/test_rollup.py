@@ -0,0 +1,54 @@
+"""
+The tests of the daily item rollup.
+"""
+
+from collections import Counter
+from datetime import date
+
+import pytest
+
+from coa_flask_app import cache, db_accessor, rollup, site
+
+
+@pytest.fixture(name='rollup_on')
+def rollup_on_fixture(monkeypatch):
+    """
+    Backfills the rollup and answers towns and counties from it.
+    """
+    assert rollup.backfill() > 0
+    monkeypatch.setenv('ITEM_ROLLUP', '1')
+    yield
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('DROP TABLE ' + rollup.ROLLUP_TABLE)
+
+
+def sites_of(category, name):
+    """
+    Returns the names of the sites of a town or county.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT site_name FROM coa.site_info WHERE ' + category + ' = %s',
+                          (name,))
+        return [row[0] for row in db_handle.fetchall()]
+
+
+@pytest.mark.parametrize('category, name', [('town', 'Town 1-1'), ('county', 'County 0')])
+def test_rollup_totals_match_their_sites(rollup_on, monkeypatch, category, name):
+    """
+    A town or county answered by the rollup totals the breakdowns of its
+    sites read from the summary view, and matches the view itself.
+    """
+    _ = rollup_on
+    start, end = f'{date.today().year - 2}-3-1', f'{date.today().year}-9-30'
+    from_rollup = {row[1]: row[4] for row in site.item_breakdown(category, name, start, end)}
+
+    from_sites: Counter = Counter()
+    for site_name in sites_of(category, name):
+        for row in site.item_breakdown('site_name', site_name, start, end):
+            from_sites[row[1]] += row[4]
+    assert from_rollup == dict(from_sites)
+
+    monkeypatch.setenv('ITEM_ROLLUP', '0')
+    cache.invalidate()
+    from_view = {row[1]: row[4] for row in site.item_breakdown(category, name, start, end)}
+    assert from_rollup == from_view
@@ -0,0 +1,89 @@
+"""
+The tests of the location search index.
+"""
+
+from coa_flask_app import data_version, search, site
+
+LOCATIONS = [('Ocean Ave 1', 'Harbor Town 1-2', 'Bay County'),
+             ('Ocean Beach 2', 'Harbor Town 2-1', 'Bay County'),
+             ('Lighthouse Point', 'Harbor Town 1-2', 'Bay County'),
+             ('Bay St', 'Cove Town', 'Dune County')]
+
+
+def names(results):
+    """
+    Returns the location names of some results in order.
+    """
+    return [result['locationName'] for result in results]
+
+
+def test_added_locations_leave_the_published_index_alone():
+    """
+    New locations are added to a copy, the index searches read is unchanged.
+    """
+    index = search.LocationIndex()
+    assert index.add(LOCATIONS[:3]) == 3
+    newer = index.updated(LOCATIONS)
+
+    assert names(newer.search('bay st')) == ['Bay St']
+    assert names(index.search('bay st')) == []
+    assert len(index.entries) == 6
+    assert len(newer.entries) == 9
+    assert newer.add(LOCATIONS) == 0
+
+
+def test_removed_location_rebuilds_the_index(monkeypatch):
+    """
+    A location that disappeared is dropped by a full rebuild, while new
+    ones are added to the current index.
+    """
+    versions = iter(['v1', 'v2', 'v3'])
+    located = [LOCATIONS[:2], LOCATIONS[:3], LOCATIONS[1:3]]
+    monkeypatch.setattr(data_version, 'current', lambda: next(versions))
+    monkeypatch.setattr(site, 'all_locations', lambda: located.pop(0))
+    monkeypatch.setattr(search, '_INDEX_VERSION', None)
+
+    first = search.get_index()
+    added = search.get_index()
+    rebuilt = search.get_index()
+
+    assert names(first.search('lighthouse')) == []
+    assert names(added.search('lighthouse')) == ['Lighthouse Point']
+    assert 'Ocean Ave 1' in names(added.search('ocean'))
+    assert names(rebuilt.search('ocean')) == ['Ocean Beach 2']
+
+
+def test_typos_are_tolerated_in_longer_words():
+    """
+    Long words match within one or two typos, short ones only exactly.
+    """
+    index = search.LocationIndex()
+    index.add(LOCATIONS)
+    assert names(index.search('lighthuose')) == ['Lighthouse Point']
+    assert names(index.search('ocaen beech')) == ['Ocean Beach 2']
+    assert names(index.search('bqy st')) == []
+
+
+def test_ranking():
+    """
+    The full name ranks first, then counties before towns before sites,
+    and words in their place in the name score higher.
+    """
+    index = search.LocationIndex()
+    index.add(LOCATIONS)
+    assert names(index.search('bay'))[:2] == ['Bay County', 'Bay St']
+    assert names(index.search('harbor town 2')) == ['Harbor Town 2-1', 'Harbor Town 1-2']
+    assert names(index.search('bay county', limit=1)) == ['Bay County']
+    assert index.search('zzz') == []
+    assert index.search('  ') == []
+
+
+def test_search_route(client):
+    """
+    The route searches the generated locations.
+    """
+    response = client.get('/locations/search?q=Town 1-0')
+    assert response.status_code == 200
+    assert names(response.get_json()['results']) == ['Town 1-0', 'Town 0-1']
+    limited = client.get('/locations/search?q=Site&limit=3')
+    assert len(limited.get_json()['results']) == 3
@@ -0,0 +1,112 @@
+"""
+The tests of the collapsing of identical concurrent computations.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from coa_flask_app import shared_cache, singleflight
+
+
+def test_threads_share_one_computation():
+    """
+    Threads asking for the same key at once wait for one computation and
+    share its result.
+    """
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return 'value'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(singleflight.do('same', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(singleflight.do('same', compute)))
+                 for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == ['value'] * 5
+
+
+def test_errors_reach_every_waiter():
+    """
+    The error of a computation is raised in every thread waiting for it.
+    """
+    started = threading.Event()
+    errors = []
+
+    def compute():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError('failed')
+
+    def call():
+        try:
+            singleflight.do('failing', compute)
+        except ValueError as error:
+            errors.append(str(error))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    for thread in (leader, follower):
+        thread.join(5)
+
+    assert errors == ['failed', 'failed']
+
+
+def _worker(key, count_path, barrier, results):
+    """
+    A worker process asking for a result the other worker asks for too.
+    """
+    shared = shared_cache.get_cache()
+
+    def compute():
+        with open(count_path, 'a', encoding='utf-8') as handle:
+            handle.write(f'{os.getpid()}\n')
+        time.sleep(0.5)
+        shared.set(key, 'value', 60)
+        return 'value'
+
+    barrier.wait()
+    results.put(singleflight.do(key, compute, lambda: shared.get(key)))
+
+
+def test_workers_share_one_computation(tmp_path):
+    """
+    Two worker processes asking for the same result at once run one query,
+    the second one waits and reads the result from the shared cache.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('the workers are forked')
+    context = multiprocessing.get_context('fork')
+    key = ('tests', 'cross worker', time.time())
+    count_path = str(tmp_path / 'computed')
+    barrier, results = context.Barrier(2), context.Queue()
+    workers = [context.Process(target=_worker, args=(key, count_path, barrier, results))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    answers = [results.get(timeout=10) for _ in workers]
+    for worker in workers:
+        worker.join(10)
+
+    assert answers == ['value', 'value']
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    with open(count_path, encoding='utf-8') as handle:
+        assert len(handle.read().split()) == 1
@@ -0,0 +1,196 @@
+"""
+The tests of the site queries and routes.
+"""
+
+from datetime import date
+
+import pytest
+
+from coa_flask_app import cache, contribution, db_accessor, engine, site
+
+LOCATIONS = [('site_name', 'Site 0-1-1'), ('town', 'Town 1-0'), ('county', 'County 0')]
+
+
+def location_dates(category, name):
+    """
+    Reads the first and last volunteer date of a location straight from
+    the database.
+    """
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT MIN(volunteer_date), MAX(volunteer_date) '
+                          'FROM coa_summary_view WHERE ' + category + ' = %s', (name,))
+        return db_handle.fetchone()
+
+
+@pytest.mark.parametrize('category, name', LOCATIONS)
+def test_engine_matches_sql_breakdown(monkeypatch, category, name):
+    """
+    The in-memory engine answers every breakdown like the SQL query.
+    """
+    pytest.importorskip('numpy')
+    start, end = f'{date.today().year - 1}-1-1', f'{date.today().year}-6-30'
+    from_sql = site.item_breakdown(category, name, start, end)
+    assert from_sql
+
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    cache.invalidate()
+    from_engine = site.item_breakdown(category, name, start, end)
+    assert engine.get_engine() is not None
+    assert sorted(map(tuple, from_engine)) == sorted(map(tuple, from_sql))
+
+
+@pytest.fixture(name='twin_items')
+def twin_items_fixture():
+    """
+    Adds two items sharing a name and a line of quantity 0 to a team at
+    Site 0-1-1, and removes them afterwards.
+    """
+    day = f'{date.today().year}-03-01'
+    with db_accessor.Accessor() as db_handle:
+        db_handle.executemany('INSERT INTO coa.item VALUES (%s, %s, %s, %s)',
+                              [(1001, 'Plastic', 'Twins', 'Twin item'),
+                               (1002, 'Glass', 'Twins', 'Twin item'),
+                               (1003, 'Paper', 'Zeros', 'Zero item')])
+        db_handle.execute('SELECT site_id FROM coa.site_info WHERE site_name = %s',
+                          ('Site 0-1-1',))
+        site_id = db_handle.fetchone()[0]
+        db_handle.execute(contribution.TEAM_QUERY,
+                          (site_id, day, 'Captain', 1, 1, 1.0, 1.0, 'tests'))
+        team_id = db_handle.lastrowid
+        db_handle.executemany(contribution.VOLUNTEER_QUERY,
+                              [(team_id, 1001, 5, '', 'tests', 'T'),
+                               (team_id, 1002, 7, '', 'tests', 'T'),
+                               (team_id, 1003, 0, '', 'tests', 'T')])
+    yield day
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('DELETE FROM coa.volunteer_info WHERE team_id = %s', (team_id,))
+        db_handle.execute('DELETE FROM coa.team_info WHERE team_id = %s', (team_id,))
+        db_handle.execute('DELETE FROM coa.item WHERE item_id > 1000')
+
+
+@pytest.mark.parametrize('category, name', [('site_name', 'Site 0-1-1'),
+                                            ('town', 'Town 0-1'),
+                                            ('county', 'County 0')])
+def test_engine_groups_items_like_sql(monkeypatch, twin_items, category, name):
+    """
+    Items sharing a name are summed into one row and items totalling 0 are
+    left out, by the SQL and the engine alike.
+    """
+    pytest.importorskip('numpy')
+    cache.invalidate()
+
+    def quantities():
+        rows = site.item_breakdown(category, name, twin_items, twin_items)
+        return {row[1]: row[4] for row in rows}
+
+    from_sql = quantities()
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    cache.invalidate()
+    from_engine = quantities()
+    assert from_engine == from_sql
+    assert from_engine['Twin item'] == 12
+    assert 'Zero item' not in from_engine
+
+
+def test_failed_engine_load_keeps_the_refresh(monkeypatch):
+    """
+    A refresh isn't lost when the reload fails, the next call loads again.
+    """
+    pytest.importorskip('numpy')
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    assert engine.get_engine() is not None
+    engine.refresh()
+
+    def fail():
+        raise db_accessor.pymysql.OperationalError(2013, 'Lost connection')
+
+    monkeypatch.setattr(engine, 'load_rows', fail)
+    with pytest.raises(db_accessor.pymysql.OperationalError):
+        engine.get_engine()
+    assert engine.engine_stats()['stale']
+
+    monkeypatch.undo()
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    assert engine.get_engine() is not None
+    assert not engine.engine_stats()['stale']
+
+
+def test_breakdown_dates_are_normalized():
+    """
+    Zero padded and unpadded dates share one result.
+    """
+    year = date.today().year
+    assert site.item_breakdown('town', 'Town 0-1', f'{year - 1}-01-01', f'{year}-02-03') \
+        == site.item_breakdown('town', 'Town 0-1', f'{year - 1}-1-1', f'{year}-2-3')
+
+
+def test_breakdown_of_unknown_category_is_empty():
+    """
+    A category that isn't a location column never reaches the query.
+    """
+    assert site.item_breakdown('team_captain', 'x', '2016-1-1', '2030-1-1') == []
+
+
+@pytest.mark.parametrize('category, name', LOCATIONS)
+def test_valid_date_range(category, name):
+    """
+    The valid date range is the first and last volunteer date.
+    """
+    first, last = location_dates(category, name)
+    assert site.valid_date_range(category, name) == {
+        'firstDate': str(first), 'lastDate': str(last)}
+
+
+def test_valid_date_range_without_data(client):
+    """
+    A location without data has no date range instead of failing.
+    """
+    response = client.get('/validdaterange?locationCategory=town&locationName=Nowhere')
+    assert response.status_code == 200
+    assert response.get_json() == {'validDateRange': {}}
+
+
+def test_dashboard_matches_the_separate_routes(client):
+    """
+    The dashboard answers the dirty dozen, breakdown and date range of the
+    requested dates, like the routes it replaces.
+    """
+    year = date.today().year
+    args = ('locationCategory=town&locationName=Town 0-1'
+            f'&startDate={year - 1}-2-1&endDate={year}-10-1')
+    dashboard = client.get('/dashboard?' + args).get_json()
+
+    assert dashboard['dirtydozen'] == client.get('/dirtydozen?' + args).get_json()['dirtydozen']
+    assert dashboard['data'] == client.get('/breakdown?' + args).get_json()['data']
+    first, last = location_dates('town', 'Town 0-1')
+    assert dashboard['validDateRange'] == {'firstDate': str(first), 'lastDate': str(last)}
+
+
+def test_dashboard_date_range_filters_the_breakdown(client):
+    """
+    Only the contributions within the requested dates are counted.
+    """
+    year = date.today().year
+    args = 'locationCategory=county&locationName=County 1'
+    whole = client.get(f'/dashboard?{args}&startDate=2000-1-1&endDate={year}-12-31').get_json()
+    part = client.get(f'/dashboard?{args}&startDate={year}-1-1&endDate={year}-12-31').get_json()
+    empty = client.get(f'/dashboard?{args}&startDate={year}-12-31&endDate={year - 1}-1-1')
+
+    def total(payload):
+        return sum(item['count'] for item in payload['dirtydozen'])
+
+    assert 0 < total(part) < total(whole)
+    assert empty.get_json()['dirtydozen'] == []
+
+
+def test_dashboard_engine_matches_sql(client, monkeypatch):
+    """
+    The dashboard answers the same with the in-memory engine.
+    """
+    pytest.importorskip('numpy')
+    year = date.today().year
+    args = f'locationCategory=county&locationName=County 1&startDate={year - 1}-5-1'
+    from_sql = client.get('/dashboard?' + args).get_json()
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    cache.invalidate()
+    assert client.get('/dashboard?' + args).get_json() == from_sql
@@ -0,0 +1,112 @@
+"""
+The tests of the slow query log.
+"""
+
+import json
+
+import pytest
+
+from coa_flask_app import db_accessor, slow_query
+
+QUERY = 'SELECT item_name FROM coa.item WHERE item_id = %s'
+
+
+@pytest.fixture(name='log')
+def log_fixture(monkeypatch, tmp_path):
+    """
+    Logs every statement to a fresh log file.
+
+    Returns:
+        The log file.
+    """
+    path = tmp_path / 'slow.log'
+    monkeypatch.setenv('SLOW_QUERY_MS', '0')
+    monkeypatch.setenv('SLOW_QUERY_LOG', str(path))
+    return path
+
+
+def run(query=QUERY, params=(1,), **fields):
+    """
+    Records a statement the way the query hook sees it and waits for it to
+    be written.
+    """
+    event = db_accessor.QueryEvent('tests', query, params, 0.25, 1, None, False)
+    slow_query.record(event._replace(**fields))
+    slow_query.flush()
+
+
+def samples(path):
+    """
+    Reads the samples of a log file.
+    """
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_normalize_groups_values_together():
+    """
+    Literals, placeholders and IN lists don't tell statements apart.
+    """
+    assert slow_query.normalize("SELECT *  FROM t WHERE a = 'x' AND b IN (1, 2, %s)") == \
+        slow_query.normalize('SELECT * FROM t\n WHERE a = "y" AND b IN (%s)') == \
+        'SELECT * FROM t WHERE a = ? AND b IN (...)'
+
+
+def test_slow_statements_are_logged_with_a_plan(log):
+    """
+    A slow SELECT is logged with its plan, captured away from the request.
+    """
+    run()
+    sample, = samples(log)
+    assert sample['query'] == 'SELECT item_name FROM coa.item WHERE item_id = ?'
+    assert sample['durationMs'] == 250
+    assert sample['failed'] is False
+    assert sample['explain']
+
+
+def test_plans_are_counted_over_all_workers(log, monkeypatch):
+    """
+    The plan captures of a statement are counted in the shared count file,
+    so another worker's captures count against the limit.
+    """
+    monkeypatch.setenv('SLOW_QUERY_EXPLAINS', '2')
+    normalized = slow_query.normalize(QUERY)
+    log.with_name('slow.log.explained').write_text(json.dumps({normalized: 1}))
+    run()
+    run()
+    assert [sample['explain'] is not None for sample in samples(log)] == [True, False]
+    assert json.loads(log.with_name('slow.log.explained').read_text()) == {normalized: 2}
+
+
+def test_failed_statements_are_logged(log):
+    """
+    A statement that timed out is logged and counted as a failure.
+    """
+    run(failed=True, rows=0)
+    run()
+    offender, = slow_query.top_offenders()
+    assert samples(log)[0]['failed'] is True
+    assert (offender['count'], offender['failures']) == (2, 1)
+    assert offender['meanMs'] == 250
+
+
+def test_statements_under_the_threshold_are_skipped(log, monkeypatch):
+    """
+    Only the statements slower than the threshold reach the log.
+    """
+    monkeypatch.setenv('SLOW_QUERY_MS', '500')
+    run()
+    assert not log.exists()
+
+
+def test_full_log_is_rotated(log, monkeypatch):
+    """
+    The log is rotated at its max size keeping the configured backups.
+    """
+    monkeypatch.setenv('SLOW_QUERY_MAX_MB', '0')
+    monkeypatch.setenv('SLOW_QUERY_BACKUPS', '1')
+    for _ in range(3):
+        run('UPDATE coa.item SET item_name = %s', ('x',))
+    assert len(samples(log)) == 1
+    assert log.with_name('slow.log.1').exists()
+    assert not log.with_name('slow.log.2').exists()
+    assert slow_query.top_offenders()[0]['count'] == 2
@@ -0,0 +1,85 @@
+"""
+The tests of the top-K rankings.
+"""
+
+import pytest
+
+from coa_flask_app import site
+
+ARGS = 'locationCategory=county&locationName=County 0&startDate=2000-1-1&endDate=2100-1-1'
+
+
+def ranking(client, **args):
+    """
+    Fetches a top-K ranking of County 0.
+    """
+    query = '&'.join(f'{name}={value}' for name, value in args.items())
+    return client.get(f'/topk?{ARGS}&{query}').get_json()['topk']
+
+
+@pytest.mark.parametrize('dimension', sorted(site.TOP_K_DIMENSIONS))
+def test_rankings_are_ordered(client, dimension):
+    """
+    Every dimension is ranked by count with percentages of the total.
+    """
+    topk = ranking(client, dimension=dimension, k=500)
+    counts = [result['count'] for result in topk['results']]
+    assert counts == sorted(counts, reverse=True)
+    assert [result['rank'] for result in topk['results']] == list(range(1, len(counts) + 1))
+    assert topk['groups'] == len(counts)
+    assert sum(counts) == topk['total']
+    assert sum(result['percentage'] for result in topk['results']) == pytest.approx(100)
+
+
+def test_brand_ranking_leaves_out_unbranded_debris(client):
+    """
+    Debris without a brand counts in the item ranking only.
+    """
+    brands = ranking(client, dimension='brand', k=500)
+    items = ranking(client, dimension='item', k=1)
+    assert '' not in [result['brand'] for result in brands['results']]
+    assert 0 < brands['total'] < items['total']
+
+
+def test_unknown_dimension_is_rejected(client):
+    """
+    The route only ranks the known dimensions, the query never sees others.
+    """
+    response = client.get(f'/topk?{ARGS}&dimension=volunteer')
+    assert response.status_code == 400
+    assert 'dimension must be one of' in response.get_json()['error']
+    # pylint: disable=protected-access
+    assert site._top_k('volunteer', 'county', 'County 0', '2000-1-1', '2100-1-1', 5, 0) == \
+        ([], 0, 0)
+    assert site._top_k('item', 'team_captain', 'x', '2000-1-1', '2100-1-1', 5, 0) == \
+        ([], 0, 0)
+
+
+@pytest.mark.parametrize('k, expected', [(0, 1), (-3, 1), (3, 3), (100000, 500)])
+def test_k_is_capped(client, monkeypatch, k, expected):
+    """
+    The page size is kept between 1 and 500.
+    """
+    pages = []
+    real_top_k = site.top_k
+
+    def recorded(*args, count, offset):
+        pages.append((count, offset))
+        return real_top_k(*args, count=count, offset=offset)
+
+    monkeypatch.setattr(site, 'top_k', recorded)
+    ranking(client, k=k, offset=-5)
+    assert pages == [(expected, 0)]
+
+
+def test_pages_continue_the_ranking(client):
+    """
+    The pages of a ranking add up to the whole ranking, ranked on.
+    """
+    whole = ranking(client, dimension='category', k=10)
+    first = ranking(client, dimension='category', k=4)
+    second = ranking(client, dimension='category', k=6, offset=4)
+    assert first['results'] + second['results'] == whole['results']
+    assert second['results'][0]['rank'] == 5
+    assert (second['offset'], second['count']) == (4, 6)
+    assert second['total'] == whole['total']
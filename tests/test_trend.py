@@ -0,0 +1,90 @@
+"""
+The tests of the trend buckets.
+"""
+
+from datetime import date, datetime
+
+from coa_flask_app import site
+
+
+def test_buckets_sum_to_the_total(client):
+    """
+    Every bucket of the range is returned and they add up to the total
+    debris of the range.
+    """
+    year = date.today().year - 1
+    args = f'locationCategory=county&locationName=County 0&startDate={year}-1-1' \
+        f'&endDate={year}-12-31'
+    months = client.get('/trend?' + args).get_json()['trend']
+    assert [bucket['bucket'] for bucket in months] == \
+        [f'{year}-{month:02d}-01' for month in range(1, 13)]
+
+    total = sum(row[4] for row in site.item_breakdown('county', 'County 0',
+                                                      f'{year}-1-1', f'{year}-12-31'))
+    assert sum(bucket['count'] for bucket in months) == total
+    weeks = client.get('/trend?' + args + '&bucket=week').get_json()['trend']
+    assert sum(bucket['count'] for bucket in weeks) == total
+
+
+def test_trend_is_cached(monkeypatch):
+    """
+    A repeated trend is answered from the cache.
+    """
+    args = ('town', 'Town 0-0', '2020-01-01', '2030-01-01')
+    first = site.trend(*args, bucket='year')
+    monkeypatch.setattr(site, 'Accessor', None)
+    assert site.trend(*args[:2], '2020-1-1', '2030-1-1', bucket='year') == first
+
+
+def test_too_many_buckets_are_refused(client, monkeypatch):
+    """
+    A range with more buckets than TREND_MAX_BUCKETS gets a 400.
+    """
+    monkeypatch.setenv('TREND_MAX_BUCKETS', '24')
+    args = 'locationCategory=town&locationName=Town 0-0&startDate=2020-1-1&endDate=2021-12-31'
+    assert client.get('/trend?' + args).status_code == 200
+    assert client.get('/trend?' + args + '&bucket=week').status_code == 400
+    assert site.trend('town', 'Town 0-0', '2020-1-1', '2021-12-31', bucket='day') == []
+
+
+def test_bucket_count():
+    """
+    The bucket count covers the partial buckets at both ends.
+    """
+    assert site.trend_bucket_count('2020-1-31', '2020-2-1', 'month') == 2
+    assert site.trend_bucket_count('2020-1-5', '2020-1-6', 'week') == 2
+    assert site.trend_bucket_count('2019-12-31', '2021-1-1', 'year') == 3
+    assert site.trend_bucket_count('2020-1-1', '2020-12-31', 'day') == 366
+    assert site.trend_bucket_count('2020-2-1', '2020-1-1', 'day') == 0
+
+
+def test_datetime_days_are_bucketed(monkeypatch):
+    """
+    A DATETIME volunteer date lands in the bucket of its day.
+    """
+    class Cursor:
+        """
+        Answers the trend query with DATETIME values.
+        """
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            pass
+
+        def execute(self, *_):
+            """
+            Ignores the query.
+            """
+
+        @staticmethod
+        def fetchall():
+            """
+            Returns a daily total at noon.
+            """
+            return [(datetime(2021, 3, 9, 12, 0), 4)]
+
+    monkeypatch.setattr(site, 'Accessor', Cursor)
+    trend = site.trend('town', 'Nowhere', '2021-3-1', '2021-3-31', bucket='month')
+    assert trend == [{'bucket': '2021-03-01', 'count': 4}]
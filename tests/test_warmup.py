@@ -0,0 +1,79 @@
+"""
+The tests of the warm-up before the fork.
+"""
+
+import gc
+
+import pytest
+
+from coa_flask_app import APP, db_accessor, warmup
+
+
+@pytest.mark.parametrize('value, expected', [('1', True), ('yes', True),
+                                             ('0', False), ('False', False), (None, False)])
+def test_enabled(monkeypatch, value, expected):
+    """
+    WARMUP turns the warm-up on and off, unset it only runs under uwsgi.
+    """
+    if value is None:
+        monkeypatch.delenv('WARMUP', raising=False)
+    else:
+        monkeypatch.setenv('WARMUP', value)
+    assert warmup.enabled() is expected
+
+
+def test_steps_load_every_payload(monkeypatch):
+    """
+    The reference data, every stable payload and the engine are loaded.
+    """
+    names = [name for name, _ in warmup.steps()]
+    assert names[:4] == ['dataVersion', 'locations', 'teamLeads', 'trashItems']
+    assert 'payload:getTrashItems' in names
+    assert 'engine' not in names
+
+    monkeypatch.setenv('AGGREGATION_ENGINE', 'columnar')
+    assert [name for name, _ in warmup.steps()][-1] == 'engine'
+
+
+def test_warm_up_skips_failing_steps(monkeypatch):
+    """
+    A failing step is reported and the others still run, then the pool is
+    emptied and the collector frozen.
+    """
+    loaded = []
+
+    def fail():
+        raise db_accessor.pymysql.OperationalError(2003, 'Can\'t connect')
+
+    monkeypatch.setattr(warmup, 'steps', lambda: [('broken', fail),
+                                                  ('locations', lambda: loaded.append(1))])
+    with db_accessor.Accessor() as db_handle:
+        db_handle.execute('SELECT 1')
+    try:
+        result = warmup.warm_up(APP)
+        if hasattr(gc, 'get_freeze_count'):
+            assert gc.get_freeze_count() > 0
+    finally:
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    assert loaded == [1]
+    assert set(result['steps']) == {'broken', 'locations'}
+    assert 'Can\'t connect' in result['errors']['broken']
+    assert db_accessor.pool_stats()['idle'] == 0
+
+
+def test_first_response_is_timed_once_per_worker(client, monkeypatch):
+    """
+    A newly forked worker times its first response, later responses don't
+    change it.
+    """
+    # pylint: disable=protected-access
+    monkeypatch.setitem(warmup._WORKER, 'pid', -1)
+    client.get('/getTrashItems')
+    worker = warmup.warmup_stats()['worker']
+    assert worker['firstResponseSeconds'] is not None
+
+    client.get('/getTrashItems')
+    assert warmup.warmup_stats()['worker']['firstResponseSeconds'] == \
+        worker['firstResponseSeconds']
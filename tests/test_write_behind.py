@@ -0,0 +1,123 @@
+"""
+The tests of the write-behind journal and its flusher.
+"""
+
+import os
+
+import pymysql
+import pytest
+
+from coa_flask_app import APP, contribution, write_behind
+
+
+def make_record(site_id, quantity):
+    """
+    Builds a valid contribution record.
+    """
+    return {'siteId': site_id, 'volunteerDate': '5/1/2019', 'teamCaptain': 'Jane Doe',
+            'numOfPeople': '2', 'updatedBy': 'tests', 'eventCode': 'WB',
+            'items': [{'itemId': 4, 'quantity': quantity}]}
+
+
+@pytest.fixture(name='flusher')
+def flusher_fixture(tmp_path):
+    """
+    Returns a flusher of a fresh journal whose thread never wakes up, the
+    batches are flushed by the tests.
+    """
+    return write_behind.Flusher(write_behind.Journal(str(tmp_path)),
+                                batch_size=10, interval=3600)
+
+
+def test_flush_commits_and_compacts(flusher, site_row):
+    """
+    Queued contributions are committed in a batch, their status recorded
+    and the committed journal dropped.
+    """
+    journal = flusher.journal
+    ids = [journal.enqueue(make_record(site_row[0], quantity)) for quantity in (1, 2)]
+    assert journal.status(ids[0]) == {'id': ids[0], 'status': 'queued'}
+
+    assert flusher.flush_batch()
+    assert not flusher.flush_batch()
+    assert [journal.status(entry_id)['status'] for entry_id in ids] == ['committed'] * 2
+
+    journal.compact(status_ttl=60)
+    assert os.path.getsize(journal.journal_path) == 0
+    assert journal.status(ids[1])['status'] == 'committed'
+    assert flusher.stats()['committed'] == 2
+
+
+def test_connection_loss_mid_batch_keeps_the_committed_part(flusher, site_row, monkeypatch):
+    """
+    When the database goes away part way through the one by one fallback,
+    the contributions already committed are recorded and not replayed.
+    """
+    journal = flusher.journal
+    ids = [journal.enqueue(make_record(site_row[0], quantity)) for quantity in (1, 2, 3)]
+    inserted = []
+
+    def insert(rows):
+        if len(rows) > 1:
+            raise pymysql.IntegrityError(1452, 'a bad row')
+        if len(inserted) == 1:
+            raise pymysql.OperationalError(2013, 'Lost connection')
+        inserted.append(rows)
+        return [len(inserted)]
+
+    monkeypatch.setattr(contribution, 'insert_validated', insert)
+    with pytest.raises(pymysql.OperationalError):
+        flusher.flush_batch()
+    assert journal.status(ids[0])['status'] == 'committed'
+    assert journal.status(ids[1])['status'] == 'queued'
+
+    monkeypatch.setattr(contribution, 'insert_validated',
+                        lambda rows: inserted.append(rows) or list(range(len(rows))))
+    assert flusher.flush_batch()
+    # The first one isn't inserted a second time.
+    assert len(inserted) == 2 and len(inserted[1]) == 2
+    assert [journal.status(entry_id)['status'] for entry_id in ids] == ['committed'] * 3
+
+
+def test_torn_entry_is_skipped_and_failed(flusher, site_row):
+    """
+    An entry torn by a crash half way through its append fails alone and
+    doesn't hold up the entries after it.
+    """
+    journal = flusher.journal
+    torn_id = 'a' * 32
+    with open(journal.journal_path, 'wb') as handle:
+        handle.write(b'{"id": "' + torn_id.encode() + b'", "queued": 1, "rec')
+    entry_id = journal.enqueue(make_record(site_row[0], 1))
+
+    assert flusher.flush_batch()
+    assert journal.status(torn_id)['status'] == 'failed'
+    assert journal.status(entry_id)['status'] == 'committed'
+
+
+def test_expired_statuses_are_compacted(flusher, site_row, monkeypatch):
+    """
+    The status file only keeps the statuses within their TTL.
+    """
+    journal = flusher.journal
+    entry_id = journal.enqueue(make_record(site_row[0], 1))
+    assert flusher.flush_batch()
+    assert journal.status(entry_id)['status'] == 'committed'
+
+    monkeypatch.setattr(write_behind, 'COMPACT_BYTES', 0)
+    journal.compact(status_ttl=-1)
+    assert journal.status(entry_id) is None
+
+
+def test_flusher_starts_with_the_app(monkeypatch, tmp_path):
+    """
+    In write-behind mode the flusher starts when the app is set up, not on
+    the first queued contribution.
+    """
+    monkeypatch.setenv('WRITE_BEHIND', '1')
+    monkeypatch.setenv('WRITE_BEHIND_DIR', str(tmp_path))
+    monkeypatch.setenv('WRITE_BEHIND_INTERVAL', '3600')
+    monkeypatch.setattr(write_behind, '_FLUSHER', None)
+    monkeypatch.setattr(write_behind.os, 'register_at_fork', lambda **_: None)
+    write_behind.init_app(APP)
+    assert write_behind.write_behind_stats()['flusher'] is not None